@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2021 ARM Limited. All rights reserved.
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import argparse
+import hashlib
+import json
+import logging
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from atomic_write import file_sha256, write_file_atomically
+
+try:
+    import zstandard
+except ImportError as e:
+    print(str(e) + " To install it, type:")
+    print("python3 -m pip install zstandard")
+    exit(1)
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+
+BUNDLE_FORMAT_VERSION = 1
+# Files are streamed through fixed size chunks so memory use does not
+# depend on the size of the artifacts being packed.
+CHUNK_SIZE = 1024 * 1024
+ZSTD_LEVEL = 10
+
+
+def blob_path(bundle_dir, digest):
+    """
+    Return the path of the compressed blob for a given digest
+    :param bundle_dir: Bundle directory
+    :param digest: SHA-256 hex digest of the uncompressed content
+    """
+    return os.path.join(bundle_dir, "blobs", digest[:2], digest + ".zst")
+
+
+def check_relative_path(path):
+    """
+    Check a path read from a manifest stays inside the directory it is
+    relative to
+    :param path: Path using "/" as separator
+    :raises ValueError: If the path is absolute or has a "." or ".." part
+    """
+    parts = path.split("/")
+    if (
+        os.path.isabs(path)
+        or "\\" in path
+        or os.path.splitdrive(path)[0]
+        or any(part in ("", ".", "..") for part in parts)
+    ):
+        raise ValueError("Invalid path %r in bundle manifest" % path)
+
+
+def check_manifest(manifest):
+    """
+    Check the paths and digests of a manifest, which may come from
+    another host
+    :param manifest: Content of a manifest
+    :raises ValueError: If a file would be restored outside the directory
+                        or a digest is malformed
+    """
+    for path, entry in manifest["files"].items():
+        check_relative_path(path)
+        if not re.fullmatch("[0-9a-f]{64}", str(entry.get("sha256"))):
+            raise ValueError("Invalid digest for %s in bundle manifest" % path)
+
+
+def _manifest_path(bundle_dir, target, suite, toolchain=None):
+    """
+    Return the path of the manifest for a target/suite pair
+    :param bundle_dir: Bundle directory
+    :param target: Target name
+    :param suite: Test suite
+    :param toolchain: Optional toolchain, used to keep manifests apart
+    """
+    parts = [bundle_dir, "manifests", target]
+    if toolchain:
+        parts.append(toolchain)
+    parts.append(suite + ".json")
+    return os.path.join(*parts)
+
+
+def _collect_files(root, paths):
+    """
+    Expand files and directories into a sorted list of relative file paths
+    :param root: Directory the paths are relative to
+    :param paths: List of files or directories
+    :return: Sorted list of paths relative to root
+    """
+    files = set()
+    for path in paths:
+        abs_path = os.path.join(root, path)
+        if os.path.isfile(abs_path):
+            files.add(os.path.relpath(abs_path, root))
+        elif os.path.isdir(abs_path):
+            for dirpath, __, filenames in os.walk(abs_path):
+                for f in filenames:
+                    files.add(os.path.relpath(os.path.join(dirpath, f), root))
+        else:
+            logging.info("Skipping missing path %s", path)
+
+    return sorted(files)
+
+
+def _get_entry(abs_path):
+    """
+    Hash a file
+    :param abs_path: File to hash
+    :return: Manifest entry of the file
+    """
+    st = os.stat(abs_path)
+    return {
+        "sha256": file_sha256(abs_path),
+        "size": st.st_size,
+        "mode": st.st_mode & 0o777,
+        "mtime_ns": st.st_mtime_ns,
+    }
+
+
+def _store_blob(bundle_dir, digest, abs_path):
+    """
+    Store a file as a compressed blob
+    :param bundle_dir: Bundle directory
+    :param digest: SHA-256 hex digest of the file
+    :param abs_path: File to store
+    """
+    blob = blob_path(bundle_dir, digest)
+    os.makedirs(os.path.dirname(blob), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(blob), suffix=".tmp")
+    try:
+        cctx = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+        with os.fdopen(fd, "wb") as dst, open(abs_path, "rb") as src:
+            cctx.copy_stream(src, dst, read_size=CHUNK_SIZE)
+        os.replace(tmp, blob)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _write_json(path, data):
+    """
+    Atomically write a JSON document
+    :param path: Destination path
+    :param data: JSON serializable object
+    """
+    write_file_atomically(path, json.dumps(data, indent=2, sort_keys=True))
+
+
+def pack_bundle(
+    bundle_dir, paths, target, suite, toolchain=None, root=ROOT, jobs=None
+):
+    """
+    Store files in a bundle and write the manifest for target/suite.
+    Blobs already in the bundle are not compressed again.
+
+    :param bundle_dir: Bundle directory, created if it does not exist
+    :param paths: Files or directories to pack, relative to root
+    :param target: Target name
+    :param suite: Test suite
+    :param toolchain: Optional toolchain
+    :param root: Directory the paths are relative to
+    :param jobs: Number of parallel compression workers
+    :return: dict with packing statistics
+    """
+    files = _collect_files(root, paths)
+    logging.info(
+        "Packing %d files for %s %s into %s",
+        len(files),
+        target,
+        suite,
+        bundle_dir,
+    )
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        entries = list(
+            executor.map(lambda f: _get_entry(os.path.join(root, f)), files)
+        )
+        # Files with the same content are compressed once
+        new_blobs = {}
+        for f, entry in zip(files, entries):
+            digest = entry["sha256"]
+            if digest not in new_blobs and not os.path.isfile(
+                blob_path(bundle_dir, digest)
+            ):
+                new_blobs[digest] = (os.path.join(root, f), entry["size"])
+        list(
+            executor.map(
+                lambda item: _store_blob(bundle_dir, item[0], item[1][0]),
+                new_blobs.items(),
+            )
+        )
+
+    manifest = {
+        "version": BUNDLE_FORMAT_VERSION,
+        "target": target,
+        "suite": suite,
+        "toolchain": toolchain,
+        "files": {},
+    }
+    stats = {
+        "files": len(files),
+        "bytes": 0,
+        "new_bytes": sum(size for __, size in new_blobs.values()),
+    }
+    for f, entry in zip(files, entries):
+        # Manifests use "/" so bundles can move between host types
+        manifest["files"][f.replace(os.sep, "/")] = entry
+        stats["bytes"] += entry["size"]
+
+    _write_json(_manifest_path(bundle_dir, target, suite, toolchain), manifest)
+    logging.info(
+        "Packed %d bytes, %d bytes were new to the bundle",
+        stats["bytes"],
+        stats["new_bytes"],
+    )
+    return stats
+
+
+def _is_up_to_date(dst, entry):
+    """
+    Check whether a file already matches a manifest entry
+    :param dst: Path of the file on disk
+    :param entry: Manifest entry
+    """
+    try:
+        st = os.stat(dst)
+    except FileNotFoundError:
+        return False
+
+    if st.st_size != entry["size"]:
+        return False
+    # Same size and timestamp is taken as a match, like rsync does,
+    # anything else falls back to comparing the content.
+    if st.st_mtime_ns == entry["mtime_ns"]:
+        return True
+    return file_sha256(dst) == entry["sha256"]
+
+
+def _restore_blob(bundle_dir, dst, entry):
+    """
+    Decompress a blob to its destination unless the file already matches
+    :param bundle_dir: Bundle directory
+    :param dst: Destination path
+    :param entry: Manifest entry
+    :return: Number of bytes written
+    """
+    if _is_up_to_date(dst, entry):
+        return 0
+
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dst), suffix=".tmp")
+    try:
+        sha = hashlib.sha256()
+        dctx = zstandard.ZstdDecompressor()
+        with os.fdopen(fd, "wb") as out, open(
+            blob_path(bundle_dir, entry["sha256"]), "rb"
+        ) as blob:
+            reader = dctx.stream_reader(blob, read_size=CHUNK_SIZE)
+            for chunk in iter(lambda: reader.read(CHUNK_SIZE), b""):
+                sha.update(chunk)
+                out.write(chunk)
+
+        if sha.hexdigest() != entry["sha256"]:
+            raise Exception("Corrupted blob %s in bundle" % entry["sha256"])
+
+        os.chmod(tmp, entry["mode"])
+        os.utime(tmp, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+        os.replace(tmp, dst)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+    return entry["size"]
+
+
+def unpack_bundle(
+    bundle_dir, target, suite, toolchain=None, root=ROOT, jobs=None
+):
+    """
+    Restore the files recorded for target/suite into root.
+    Files which already match the manifest are left untouched.
+
+    :param bundle_dir: Bundle directory
+    :param target: Target name
+    :param suite: Test suite
+    :param toolchain: Optional toolchain
+    :param root: Directory to restore into
+    :param jobs: Number of parallel decompression workers
+    :return: dict with unpacking statistics
+    """
+    with open(_manifest_path(bundle_dir, target, suite, toolchain)) as f:
+        manifest = json.load(f)
+
+    if manifest["version"] != BUNDLE_FORMAT_VERSION:
+        raise Exception(
+            "Unsupported bundle format version %s" % manifest["version"]
+        )
+
+    # Nothing is written unless every path stays under root
+    check_manifest(manifest)
+    files = sorted(manifest["files"].items())
+    logging.info(
+        "Unpacking %d files for %s %s into %s", len(files), target, suite, root
+    )
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        written = list(
+            executor.map(
+                lambda item: _restore_blob(
+                    bundle_dir,
+                    os.path.join(root, *item[0].split("/")),
+                    item[1],
+                ),
+                files,
+            )
+        )
+
+    stats = {
+        "files": len(files),
+        "written_files": len([w for w in written if w]),
+        "written_bytes": sum(written),
+    }
+    logging.info(
+        "Restored %d of %d files (%d bytes)",
+        stats["written_files"],
+        stats["files"],
+        stats["written_bytes"],
+    )
+    return stats
+
+
+def list_bundle(bundle_dir):
+    """
+    List the manifests stored in a bundle
+    :param bundle_dir: Bundle directory
+    :return: List of manifest paths relative to the manifests directory
+    """
+    manifests_dir = os.path.join(bundle_dir, "manifests")
+    manifests = []
+    for dirpath, __, filenames in os.walk(manifests_dir):
+        for f in filenames:
+            if f.endswith(".json"):
+                manifests.append(
+                    os.path.relpath(os.path.join(dirpath, f), manifests_dir)
+                )
+    return sorted(manifests)
+
+
+def _get_parser():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    pack = subparsers.add_parser("pack", help="Pack files into a bundle")
+    unpack = subparsers.add_parser(
+        "unpack", help="Restore files from a bundle"
+    )
+    for p in [pack, unpack]:
+        p.add_argument("bundle", help="Bundle directory")
+        p.add_argument("-m", "--mcu", help="Target name", required=True)
+        p.add_argument("-s", "--suite", help="Test suite", required=True)
+        p.add_argument("-t", "--toolchain", help="Toolchain", default=None)
+        p.add_argument(
+            "--root",
+            help="Directory the files are relative to",
+            default=ROOT,
+        )
+        p.add_argument(
+            "-j",
+            "--jobs",
+            help="Number of parallel (de)compression workers",
+            type=int,
+            default=None,
+        )
+    pack.add_argument("paths", help="Files or directories to pack", nargs="+")
+
+    bundle_list = subparsers.add_parser("list", help="List bundle manifests")
+    bundle_list.add_argument("bundle", help="Bundle directory")
+
+    return parser
+
+
+def _main():
+    """
+    Pack and unpack content-addressed artifact bundles
+    """
+    parser = _get_parser()
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        pack_bundle(
+            args.bundle,
+            args.paths,
+            args.mcu,
+            args.suite,
+            args.toolchain,
+            args.root,
+            args.jobs,
+        )
+    elif args.command == "unpack":
+        unpack_bundle(
+            args.bundle,
+            args.mcu,
+            args.suite,
+            args.toolchain,
+            args.root,
+            args.jobs,
+        )
+    else:
+        for manifest in list_bundle(args.bundle):
+            print(manifest)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[Artifact-Bundle] %(asctime)s: %(message)s.",
+        datefmt="%H:%M:%S",
+    )
+    _main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2021 ARM Limited. All rights reserved.
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import hashlib
+import shutil
+import tempfile
+import threading
+
+# Number of generated files written and left untouched by this process
+_WRITE_STATS = {"written": 0, "unchanged": 0}
+_WRITE_STATS_LOCK = threading.Lock()
+
+# Permissions of new files, mkstemp() would make them private
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+NEW_FILE_MODE = 0o666 & ~_UMASK
+
+
+# Size of the reads when hashing a file
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path):
+    """
+    Compute the SHA-256 of a file without reading it into memory at once
+    :param path: Path of the file
+    :return: Hex digest of the file content
+    """
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _count(name):
+    with _WRITE_STATS_LOCK:
+        _WRITE_STATS[name] += 1
+
+
+def write_file_atomically(path, content):
+    """
+    Write a generated file unless it already has this content, so its
+    timestamp only changes when its content does and build tools do not
+    see a change. Readers, and a later run after an interruption, see
+    either the old or the new content but never a partial file.
+
+    :param path: Path of the file
+    :param content: Text or bytes to write
+    :return: True if the file was written
+    """
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+
+    try:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == len(content):
+                if f.read() == content:
+                    _count("unchanged")
+                    return False
+    except FileNotFoundError:
+        pass
+
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            shutil.copymode(path, tmp_path)
+        else:
+            os.chmod(tmp_path, NEW_FILE_MODE)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    _count("written")
+    return True
+
+
+def get_write_stats():
+    """
+    :return: dict with the number of generated files "written" and left
+             "unchanged" by this process
+    """
+    with _WRITE_STATS_LOCK:
+        return dict(_WRITE_STATS)
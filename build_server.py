@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2021 ARM Limited. All rights reserved.
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+# The client side of this script is on the hot path of every request, so
+# only light modules are imported at the top. The server imports the build
+# scripts once and keeps them loaded between requests.
+import os
+import sys
+import argparse
+import json
+import socket
+import logging
+import io
+import contextlib
+import event_log
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+DEFAULT_SOCKET = os.path.join(ROOT, ".build_server.sock")
+
+# Request name: (entry point module, extra arguments)
+COMMANDS = {
+    "build": ("build_tfm", []),
+    "copy": ("build_tfm", ["--skip-build"]),
+    "spec": ("test_psa_target", ["--spec-only"]),
+    "test": ("test_psa_target", []),
+}
+
+# Files whose changes invalidate the cached targets and YAML data
+WATCHED_FILES = [
+    os.path.join(ROOT, "mbed-os", "targets", "targets.json"),
+    os.path.join(ROOT, "tfm_ns_import.yaml"),
+]
+TFM_GIT_DIR = os.path.join(ROOT, "tfm", "repos", "trusted-firmware-m", ".git")
+
+
+def _file_state(path):
+    """
+    Return a cheap fingerprint of a file
+    :param path: Path of the file
+    :return: tuple (modification time, size) or None if missing
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _tfm_checkout_state():
+    """
+    Return a fingerprint of the TF-M checkout without running git
+    :return: tuple of the HEAD content and the state of the refs
+    """
+    try:
+        with open(os.path.join(TFM_GIT_DIR, "HEAD")) as f:
+            head = f.read().strip()
+    except FileNotFoundError:
+        return None
+
+    ref_state = None
+    if head.startswith("ref: "):
+        ref_state = _file_state(os.path.join(TFM_GIT_DIR, head[5:]))
+    return (
+        head,
+        ref_state,
+        _file_state(os.path.join(TFM_GIT_DIR, "packed-refs")),
+    )
+
+
+def _get_fingerprint():
+    """
+    Fingerprint of everything the warm state depends on
+    """
+    return (
+        tuple(_file_state(f) for f in WATCHED_FILES),
+        _tfm_checkout_state(),
+    )
+
+
+class _SocketLogHandler(logging.Handler):
+    """
+    Forward log records of a request to the client
+    """
+
+    def __init__(self, wfile):
+        super().__init__()
+        self.wfile = wfile
+
+    def emit(self, record):
+        try:
+            _send(self.wfile, {"log": self.format(record)})
+        except OSError:
+            # The client went away, keep building regardless
+            pass
+
+
+class _SocketStream(io.TextIOBase):
+    """
+    Forward what a request prints, e.g. argparse errors, to the client
+    """
+
+    def __init__(self, wfile):
+        super().__init__()
+        self.wfile = wfile
+        self.pending = ""
+
+    def write(self, text):
+        self.pending += text
+        *lines, self.pending = self.pending.split("\n")
+        for line in lines:
+            try:
+                _send(self.wfile, {"log": line})
+            except OSError:
+                pass
+        return len(text)
+
+
+def _send(wfile, message):
+    """
+    Send one JSON message
+    :param wfile: Writable file object of the socket
+    :param message: JSON serializable object
+    """
+    wfile.write((json.dumps(message) + "\n").encode("utf-8"))
+    wfile.flush()
+
+
+class _WarmState:
+    """
+    Mbed OS tools, targets and YAML data kept loaded between requests
+    """
+
+    def __init__(self):
+        import psa_builder
+        import build_tfm
+        import test_psa_target
+
+        self.psa_builder = psa_builder
+        self.entry_points = {
+            "build_tfm": build_tfm,
+            "test_psa_target": test_psa_target,
+        }
+        build_tfm.IN_PROCESS = True
+        test_psa_target.IN_PROCESS = True
+        self.fingerprint = _get_fingerprint()
+        # Prime the caches and load the Mbed OS tools
+        for target in psa_builder.get_tfm_regression_targets():
+            psa_builder.get_target(target)
+
+    def refresh(self):
+        """
+        Drop the cached data if any of its sources changed
+        """
+        fingerprint = _get_fingerprint()
+        if fingerprint != self.fingerprint:
+            logging.info("Sources changed, reloading targets and YAML data")
+            self.psa_builder.clear_caches()
+            self.fingerprint = fingerprint
+
+    def run(self, command, argv, cwd):
+        """
+        Run one request in the server process
+        :param command: Request name, key of COMMANDS
+        :param argv: Command-line arguments for the entry point
+        :param cwd: Working directory of the client
+        :return: Exit code of the request
+        :raises KeyboardInterrupt: If the request was interrupted, once its
+                                   child processes are terminated
+        """
+        module, extra_args = COMMANDS[command]
+        self.refresh()
+        saved_cwd = os.getcwd()
+        os.chdir(cwd)
+        try:
+            self.entry_points[module]._main(argv + extra_args)
+            return 0
+        except SystemExit as e:
+            if e.code is None:
+                return 0
+            return e.code if isinstance(e.code, int) else 1
+        except KeyboardInterrupt:
+            logging.info("Request %s interrupted", command)
+            self.psa_builder.terminate_children()
+            raise
+        except Exception:
+            logging.exception("Request %s failed", command)
+            return 1
+        finally:
+            os.chdir(saved_cwd)
+
+
+def _serve(socket_path):
+    """
+    Run the build server until interrupted
+    :param socket_path: Path of the Unix socket to listen on
+    """
+    import socketserver
+
+    if not hasattr(socketserver, "UnixStreamServer"):
+        logging.critical("The build server requires Unix domain sockets")
+        sys.exit(1)
+
+    from psa_builder import are_dependencies_installed
+
+    if are_dependencies_installed() != 0:
+        sys.exit(1)
+
+    state = _WarmState()
+
+    class RequestHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            request = json.loads(self.rfile.readline().decode("utf-8"))
+            if request.get("command") not in COMMANDS:
+                _send(self.wfile, {"log": "Unknown request", "exit": 2})
+                return
+
+            handler = _SocketLogHandler(self.wfile)
+            handler.setFormatter(event_log.get_text_formatter())
+            logging.getLogger().addHandler(handler)
+            stream = _SocketStream(self.wfile)
+            interrupted = False
+            try:
+                with contextlib.redirect_stdout(
+                    stream
+                ), contextlib.redirect_stderr(stream):
+                    retcode = state.run(
+                        request["command"], request["argv"], request["cwd"]
+                    )
+            except KeyboardInterrupt:
+                # Fail the request, then stop the server
+                interrupted = True
+                retcode = 130
+            finally:
+                logging.getLogger().removeHandler(handler)
+
+            try:
+                _send(self.wfile, {"exit": retcode})
+            except OSError:
+                pass
+            if interrupted:
+                raise KeyboardInterrupt
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    # Requests are handled one at a time: they share the Mbed OS and
+    # TF-M trees, the working directory and the child process handle.
+    server = socketserver.UnixStreamServer(socket_path, RequestHandler)
+    logging.info("Build server listening on %s", socket_path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Interrupted, shutting down")
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+
+
+def _request(socket_path, command, argv):
+    """
+    Forward a request to the build server and print its output
+    :param socket_path: Path of the server's Unix socket
+    :param command: Request name, key of COMMANDS
+    :param argv: Command-line arguments for the entry point
+    :return: Exit code of the request
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        print("No build server listening on " + socket_path)
+        print("Start it with: python3 build_server.py serve")
+        return 1
+
+    with sock, sock.makefile("rwb") as f:
+        _send(f, {"command": command, "argv": argv, "cwd": os.getcwd()})
+        for line in f:
+            message = json.loads(line.decode("utf-8"))
+            if "log" in message:
+                print(message["log"], flush=True)
+            if "exit" in message:
+                return message["exit"]
+
+    print("Build server closed the connection")
+    return 1
+
+
+def _get_parser():
+    parser = argparse.ArgumentParser(
+        description="Keep the build scripts loaded between invocations"
+    )
+
+    parser.add_argument(
+        "--socket",
+        help="Unix socket of the build server",
+        default=DEFAULT_SOCKET,
+    )
+
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("serve", help="Start the build server")
+
+    helps = {
+        "build": "Build TF-M, takes the arguments of build_tfm.py",
+        "copy": "Copy an existing TF-M build, takes the arguments of "
+        "build_tfm.py",
+        "spec": "Write test_spec.json, takes the arguments of "
+        "test_psa_target.py",
+        "test": "Build and run tests, takes the arguments of "
+        "test_psa_target.py",
+    }
+    for command in COMMANDS:
+        subparsers.add_parser(command, help=helps[command])
+
+    return parser
+
+
+def _main():
+    """
+    Run the build server or forward a request to it
+    """
+    parser = _get_parser()
+    # Everything after the request name is forwarded as is
+    args, forwarded = parser.parse_known_args()
+
+    if args.command == "serve":
+        if forwarded:
+            parser.error("unrecognized arguments: " + " ".join(forwarded))
+        _serve(args.socket)
+    else:
+        sys.exit(_request(args.socket, args.command, forwarded))
+
+
+if __name__ == "__main__":
+    event_log.configure("Build-Server")
+    _main()
@@ -20,21 +20,30 @@ limitations under the License.
 import os
 import argparse
 import glob
+import re
 import sys
 import signal
 import shutil
 import logging
+import threading
+import time
+import subprocess
 from psa_builder import *
-from tools.toolchains import TOOLCHAIN_PATHS
-from tools.targets import TARGET_MAP
+import event_log
+from psa_lib_store import store_libs, activate_libs
+from elf_archive import localize_file
+from workspace_pool import WorkspacePool, DEFAULT_BUDGET
+from job_slots import parse_size
+import ninja_log
+import footprint
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="[Build-TF-M] %(asctime)s: %(message)s.",
-    datefmt="%H:%M:%S",
-)
+event_log.configure("Build-TF-M")
 
 MBED_TF_M_PATH = os.path.join(mbed_path, TF_M_RELATIVE_PATH)
+TF_M_SOURCE_DIR = os.path.join(TF_M_BUILD_DIR, "trusted-firmware-m")
+
+# Set by build_server.py when builds run in the server process
+IN_PROCESS = False
 
 
 def _detect_and_write_tfm_version(tfm_dir, commit):
@@ -58,27 +67,32 @@ def _detect_and_write_tfm_version(tfm_dir, commit):
     if not os.path.isdir(MBED_TF_M_PATH):
         os.makedirs(MBED_TF_M_PATH)
     # Write the version to Mbed OS
-    with open(os.path.join(MBED_TF_M_PATH, "VERSION.txt"), "w") as f:
-        f.write(tfm_version)
+    write_file_atomically(
+        os.path.join(MBED_TF_M_PATH, "VERSION.txt"), tfm_version
+    )
 
     if commit:
         _commit_changes(MBED_TF_M_PATH)
 
 
-def _clone_tfm_repo(target, commit):
+def _get_dependency_set(target):
+    """
+    :param target: Target name
+    :return: Key of the TF-M dependencies used for the target
+    """
+    return "nuvoton-tfm" if target == "NU_M2354" else "released-tfm"
+
+
+def _clone_tfm_repo(target, commit, update_lock=False):
     """
     Clone TF-M git repos and it's dependencies
     :param target: Target name
     :param commit: If True then commit VERSION.txt
+    :param update_lock: If True resolve the refs of the manifest again
     """
-    if target == "NU_M2354":
-        check_and_clone_repo(
-            "trusted-firmware-m", "nuvoton-tfm", TF_M_BUILD_DIR
-        )
-    else:
-        check_and_clone_repo(
-            "trusted-firmware-m", "released-tfm", TF_M_BUILD_DIR
-        )
+    check_and_clone_repos(
+        _get_dependency_set(target), TF_M_BUILD_DIR, update_lock
+    )
 
     _detect_and_write_tfm_version(
         os.path.join(TF_M_BUILD_DIR, "trusted-firmware-m"), commit
@@ -95,23 +109,23 @@ def _get_target_info(target, toolchain=None):
     :return: tuple (target name, TF-M target name, toolchain, delivery directory)
     """
     if toolchain:
-        if not TARGET_MAP[target].tfm_supported_toolchains:
+        if not get_target(target).tfm_supported_toolchains:
             msg = "Supported Toolchains is not configured for target %s" % (
-                TARGET_MAP[target].name
+                get_target(target).name
             )
             raise Exception(msg)
-        elif toolchain not in TARGET_MAP[target].tfm_supported_toolchains:
+        elif toolchain not in get_target(target).tfm_supported_toolchains:
             msg = "Toolchain %s is not supported by %s" % (
                 toolchain,
-                TARGET_MAP[target].name,
+                get_target(target).name,
             )
             raise Exception(msg)
         tc = toolchain
     else:
-        tc = TARGET_MAP[target].tfm_default_toolchain
+        tc = get_target(target).tfm_default_toolchain
 
     delivery_dir = os.path.join(
-        mbed_path, "targets", TARGET_MAP[target].tfm_delivery_dir
+        mbed_path, "targets", get_target(target).tfm_delivery_dir
     )
 
     if not os.path.exists(delivery_dir):
@@ -120,8 +134,8 @@ def _get_target_info(target, toolchain=None):
 
     return tuple(
         [
-            TARGET_MAP[target].name,
-            TARGET_MAP[target].tfm_target_name,
+            get_target(target).name,
+            get_target(target).tfm_target_name,
             tc,
             delivery_dir,
         ]
@@ -158,7 +172,7 @@ def _commit_changes(directory, target_toolchain=None):
 
     if target_toolchain is None:
         if changes_made:
-            logging.info("Committing changes in directory %s" % directory)
+            logging.info("Committing changes in directory %s", directory)
             cmd = [
                 "git",
                 "-C",
@@ -180,7 +194,7 @@ def _commit_changes(directory, target_toolchain=None):
         return
 
     if changes_made:
-        logging.info("Committing image for %s" % target_toolchain)
+        logging.info("Committing image for %s", target_toolchain)
         cmd = [
             "git",
             "-C",
@@ -198,6 +212,92 @@ def _commit_changes(directory, target_toolchain=None):
         )
 
 
+def _get_ccache_env(args):
+    """
+    Return the environment of the TF-M build with the ccache settings
+    :param args: Command-line arguments
+    :return: Environment dictionary, or None to inherit ours
+    """
+    if not args.ccache:
+        return None
+
+    env = dict(os.environ)
+    # Paths under the repository are hashed relative to it, so the cache
+    # is shared between checkouts and build directories.
+    env.setdefault("CCACHE_BASEDIR", ROOT)
+    if args.ccache_dir:
+        env["CCACHE_DIR"] = os.path.abspath(args.ccache_dir)
+    if args.ccache_max_size:
+        env["CCACHE_MAXSIZE"] = args.ccache_max_size
+    return env
+
+
+def _parse_ccache_summary(output):
+    """
+    Read the counters of ccache before 3.7, which has no --print-stats
+    :param output: Output of "ccache -s"
+    :return: tuple (hits, misses), or None if there are no counters
+    """
+    counters = {}
+    for line in output.splitlines():
+        match = re.match(r"(cache hit \(\w+\)|cache miss)\s+(\d+)$", line)
+        if match:
+            counters[match.group(1)] = int(match.group(2))
+    if "cache miss" not in counters:
+        return None
+    hits = counters.get("cache hit (direct)", 0) + counters.get(
+        "cache hit (preprocessed)", 0
+    )
+    return hits, counters["cache miss"]
+
+
+def _get_ccache_stats(env):
+    """
+    Read the cache hit and miss counters of ccache
+    :param env: Environment from _get_ccache_env()
+    :return: tuple (hits, misses), or None if they cannot be read
+    """
+    try:
+        output = subprocess.check_output(
+            ["ccache", "--print-stats"], env=env, stderr=subprocess.DEVNULL
+        )
+    except OSError:
+        return None
+    except subprocess.CalledProcessError:
+        # Older versions only print a human-readable summary
+        try:
+            output = subprocess.check_output(
+                ["ccache", "-s"], env=env, stderr=subprocess.DEVNULL
+            )
+        except (OSError, subprocess.CalledProcessError):
+            output = b""
+        stats = _parse_ccache_summary(output.decode("utf-8"))
+        if stats is None:
+            logging.info(
+                "The installed ccache is too old to report its statistics, "
+                "the cache hit rate is not recorded"
+            )
+        return stats
+
+    counters = {}
+    for line in output.decode("utf-8").splitlines():
+        key, __, value = line.partition("\t")
+        if value.strip().isdigit():
+            counters[key] = int(value)
+
+    # Counter names changed in ccache 4
+    hits = sum(
+        counters.get(key, 0)
+        for key in [
+            "direct_cache_hit",
+            "preprocessed_cache_hit",
+            "cache_hit_direct",
+            "cache_hit_preprocessed",
+        ]
+    )
+    return hits, counters.get("cache_miss", 0)
+
+
 def _run_cmake_build(cmake_build_dir, args, tgt, tfm_config):
     """
     Run the Cmake build
@@ -226,9 +326,13 @@ def _run_cmake_build(cmake_build_dir, args, tgt, tfm_config):
         )
     logging.info(msg)
 
-    cmake_cmd = ["cmake", "../", "-GNinja", "-DTFM_PSA_API=ON"]
+    # Absolute paths, as the build directory may be outside of TF-M
+    cmake_cmd = ["cmake", TF_M_SOURCE_DIR, "-GNinja", "-DTFM_PSA_API=ON"]
     cmake_cmd.append("-DTFM_PLATFORM=" + tgt[1])
-    cmake_cmd.append("-DTFM_TOOLCHAIN_FILE=../toolchain_" + tgt[2] + ".cmake")
+    cmake_cmd.append(
+        "-DTFM_TOOLCHAIN_FILE="
+        + os.path.join(TF_M_SOURCE_DIR, "toolchain_" + tgt[2] + ".cmake")
+    )
 
     if args.profile:
         cmake_cmd.append("-DTFM_PROFILE=" + args.profile.lower())
@@ -246,7 +350,7 @@ def _run_cmake_build(cmake_build_dir, args, tgt, tfm_config):
     else:
         cmake_cmd.append("-DCMAKE_BUILD_TYPE=Release")
 
-    if not TARGET_MAP[tgt[0]].tfm_bootloader_supported:
+    if not get_target(tgt[0]).tfm_bootloader_supported:
         cmake_cmd.append("-DBL2=FALSE")
     else:
         cmake_cmd.append("-DBL2=True")
@@ -255,9 +359,24 @@ def _run_cmake_build(cmake_build_dir, args, tgt, tfm_config):
         if args.suite in PSA_SUITE_CHOICES:
             cmake_cmd.append("-DTEST_PSA_API=" + args.suite)
 
+    if args.config in SUPPORTED_TFM_BENCHMARK_CONFIGS:
+        # Mbed Crypto defaults to RelWithDebInfo, benchmark what ships
+        cmake_cmd.append("-DMBEDCRYPTO_BUILD_TYPE=release")
+        if args.debug:
+            logging.warning("Crypto benchmark results of a debug build")
+
+    env = _get_ccache_env(args)
+    if args.ccache:
+        # Works for the GNUARM and ARMCLANG toolchain files alike, the
+        # launcher is prepended to every compiler command line by CMake.
+        ccache = shutil.which("ccache")
+        cmake_cmd.append("-DCMAKE_C_COMPILER_LAUNCHER=" + ccache)
+        cmake_cmd.append("-DCMAKE_CXX_COMPILER_LAUNCHER=" + ccache)
+
     logging.info(cmake_cmd)
 
-    retcode = run_cmd_output_realtime(cmake_cmd, cmake_build_dir)
+    start = time.monotonic()
+    retcode = run_cmd_output_realtime(cmake_cmd, cmake_build_dir, env)
     if retcode:
         msg = "Cmake configure failed for target %s using toolchain %s" % (
             tgt[0],
@@ -268,9 +387,15 @@ def _run_cmake_build(cmake_build_dir, args, tgt, tfm_config):
 
     # install option exports NS APIs to a dedicated folder under
     # cmake build folder
-    cmake_cmd = ["cmake", "--build", ".", "--", "install"]
-
-    retcode = run_cmd_output_realtime(cmake_cmd, cmake_build_dir)
+    cmake_cmd = ["cmake", "--build", ".", "--"]
+    if args.jobs:
+        cmake_cmd.extend(["-j", str(args.jobs)])
+    cmake_cmd.append("install")
+
+    configured = time.monotonic()
+    stats_before = _get_ccache_stats(env) if args.ccache else None
+    log_offset = ninja_log.get_log_offset(cmake_build_dir)
+    retcode = run_cmd_output_realtime(cmake_cmd, cmake_build_dir, env)
     if retcode:
         msg = "Cmake build failed for target %s using toolchain %s" % (
             tgt[0],
@@ -279,6 +404,218 @@ def _run_cmake_build(cmake_build_dir, args, tgt, tfm_config):
         logging.critical(msg)
         sys.exit(1)
 
+    _report_build_stats(
+        args,
+        tgt,
+        configured - start,
+        time.monotonic() - configured,
+        stats_before,
+        _get_ccache_stats(env) if stats_before else None,
+    )
+    _report_ninja_stats(args, tgt, cmake_build_dir, log_offset)
+    _report_footprint(args, tgt, cmake_build_dir)
+
+
+def _report_build_stats(args, tgt, configure_time, build_time, before, after):
+    """
+    Log the duration and cache statistics of a TF-M build and append them
+    to build_reports/build_stats.jsonl
+
+    :param args: Command-line arguments
+    :param tgt: Target tuple, see _run_cmake_build()
+    :param configure_time: Duration of the configure step in seconds
+    :param build_time: Duration of the build step in seconds
+    :param before: ccache counters before the build, or None
+    :param after: ccache counters after the build, or None
+    """
+    record = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "target": tgt[0],
+        "toolchain": tgt[2],
+        "config": args.config,
+        "suite": args.suite,
+        "profile": args.profile,
+        "debug": args.debug,
+        "configure_seconds": round(configure_time, 1),
+        "build_seconds": round(build_time, 1),
+        "ccache": args.ccache,
+        "cache_hits": None,
+        "cache_misses": None,
+        "cache_hit_rate": None,
+    }
+    logging.info(
+        "Configured in %.1fs, built in %.1fs", configure_time, build_time
+    )
+
+    if before and after:
+        # ccache only keeps global counters, so this also counts any other
+        # build using the same cache at the same time.
+        hits = after[0] - before[0]
+        misses = after[1] - before[1]
+        record["cache_hits"] = hits
+        record["cache_misses"] = misses
+        rate = "n/a"
+        if hits + misses:
+            record["cache_hit_rate"] = round(hits / (hits + misses), 3)
+            rate = "{:.0%}".format(record["cache_hit_rate"])
+        logging.info(
+            "ccache: %d hits, %d misses (%s hit rate)", hits, misses, rate
+        )
+
+    append_build_report("build_stats", record)
+
+
+def _get_build_key(args, tgt):
+    """
+    :param args: Command-line arguments
+    :param tgt: Target tuple, see _run_cmake_build()
+    :return: dict of what identifies the configuration of a TF-M build
+    """
+    return {
+        "target": tgt[0],
+        "toolchain": tgt[2],
+        "config": args.config,
+        "suite": args.suite,
+        "profile": args.profile,
+        "debug": args.debug,
+    }
+
+
+def _get_tfm_version():
+    """
+    :return: Version of the TF-M checkout being built, None if unknown
+    """
+    cmd = ["git", "-C", TF_M_SOURCE_DIR, "describe", "--tags", "--always"]
+    version = run_cmd_and_return(cmd, True)
+    return version.strip() if isinstance(version, str) else None
+
+
+def _report_ninja_stats(args, tgt, cmake_build_dir, log_offset):
+    """
+    Analyse the steps of a TF-M build from its Ninja log, compare the time
+    spent per component with the previous build of the same configuration
+    and append the analysis to build_reports/ninja_stats.jsonl
+
+    :param args: Command-line arguments
+    :param tgt: Target tuple, see _run_cmake_build()
+    :param cmake_build_dir: Cmake build directory
+    :param log_offset: ninja_log.get_log_offset() before the build
+    """
+    try:
+        steps = ninja_log.read_ninja_log(
+            os.path.join(cmake_build_dir, ninja_log.NINJA_LOG), log_offset
+        )
+    except (OSError, ValueError) as e:
+        logging.info("Unable to analyse the Ninja log: %s", e)
+        return
+
+    analysis = ninja_log.analyse(steps)
+    if not analysis:
+        return
+
+    key = _get_build_key(args, tgt)
+    record = dict(
+        key,
+        time=time.strftime("%Y-%m-%dT%H:%M:%S"),
+        tfm_version=_get_tfm_version(),
+        **analysis
+    )
+    logging.info(
+        "%d steps took %.1f CPU-seconds, the slowest was %s (%.1fs)",
+        analysis["steps"],
+        analysis["cpu_seconds"],
+        analysis["slowest"][0]["output"],
+        analysis["slowest"][0]["seconds"],
+    )
+
+    # Incremental builds are only compared with builds of a similar size
+    previous = [
+        report
+        for report in ninja_log.load_reports()
+        if all(report.get(k) == v for k, v in key.items())
+        and abs(report["steps"] - analysis["steps"]) <= analysis["steps"] / 10
+    ]
+    if previous:
+        for name, before, after in ninja_log.compare(previous[-1], record):
+            logging.warning(
+                "%s took %.0f CPU-seconds, %.0f in the previous build (%s)",
+                name,
+                after,
+                before,
+                previous[-1]["tfm_version"],
+            )
+
+    append_build_report(ninja_log.REPORT_NAME, record)
+
+
+def _report_footprint(args, tgt, cmake_build_dir):
+    """
+    Measure the flash and RAM used by the secure image and the bootloader
+    against the regions of the target, log what changed since the previous
+    build of the same configuration and append the footprint to
+    build_reports/footprint.jsonl
+
+    :param args: Command-line arguments
+    :param tgt: Target tuple, see _run_cmake_build()
+    :param cmake_build_dir: Cmake build directory
+    """
+    output_dir = os.path.join(
+        cmake_build_dir, "install", "outputs", tgt[1].upper()
+    )
+    target_dir = os.path.join(TF_M_SOURCE_DIR, "platform", "ext", "target")
+    header_dirs = [
+        os.path.join(target_dir, tgt[1], "partition"),
+        os.path.join(target_dir, tgt[1]),
+    ]
+    defines = {}
+    if get_target(tgt[0]).tfm_bootloader_supported:
+        defines["BL2"] = "1"
+    try:
+        macros = footprint.read_layout(header_dirs, defines)
+    except (OSError, ValueError) as e:
+        logging.info("Unable to read the memory layout: %s", e)
+        macros = None
+
+    images = {}
+    for image, name in (("secure", "tfm_s.axf"), ("bl2", "bl2.axf")):
+        path = os.path.join(output_dir, name)
+        if not os.path.isfile(path):
+            continue
+        limits = footprint.get_limits(macros, image) if macros else None
+        try:
+            images[image] = footprint.analyse_elf(path, limits)
+        except (OSError, ValueError) as e:
+            logging.info("Unable to analyse %s: %s", name, e)
+            continue
+        footprint.log_footprint(image, images[image])
+    if not images:
+        return
+
+    key = _get_build_key(args, tgt)
+    record = dict(
+        key,
+        time=time.strftime("%Y-%m-%dT%H:%M:%S"),
+        tfm_version=_get_tfm_version(),
+        images=images,
+    )
+    previous = [
+        report
+        for report in footprint.load_reports()
+        if all(report.get(k) == v for k, v in key.items())
+    ]
+    if previous:
+        for image, item, before, after in footprint.diff(previous[-1], record):
+            logging.info(
+                "%s %s: %d bytes, %+d since %s",
+                image,
+                item,
+                after,
+                after - before,
+                previous[-1]["tfm_version"],
+            )
+
+    append_build_report(footprint.REPORT_NAME, record)
+
 
 def _copy_binaries(source, destination, toolchain, target):
     """
@@ -305,7 +642,7 @@ def _copy_binaries(source, destination, toolchain, target):
     shutil.copy2(tfm_secure_axf, output_dir)
 
     try:
-        out_ext = TARGET_MAP[target].TFM_OUTPUT_EXT
+        out_ext = get_target(target).TFM_OUTPUT_EXT
     except AttributeError:
         tfm_secure_bin = os.path.join(source, "tfm_s.bin")
         logging.info(
@@ -318,6 +655,10 @@ def _copy_binaries(source, destination, toolchain, target):
         shutil.copy2(tfm_secure_bin, output_dir)
     else:
         if out_ext == "hex":
+            # Only needed for targets converting their image, it loads the
+            # Mbed OS configuration
+            from tools.toolchains import TOOLCHAIN_PATHS
+
             tfm_secure_bin = os.path.join(source, "tfm_s.hex")
             global TC_DICT
             if toolchain == "ARMCLANG":
@@ -348,17 +689,17 @@ def _copy_binaries(source, destination, toolchain, target):
             )
             shutil.copy2(tfm_secure_bin, output_dir)
 
-    if TARGET_MAP[target].tfm_bootloader_supported:
+    if get_target(target).tfm_bootloader_supported:
         mcu_bin = os.path.join(source, "bl2.bin")
         shutil.copy2(mcu_bin, output_dir)
 
-    if "TFM_V8M" in TARGET_MAP[target].extra_labels:
+    if "TFM_V8M" in get_target(target).extra_labels:
         install_dir = os.path.abspath(
             os.path.join(source, os.pardir, os.pardir)
         )
 
         # Support multi-level TF-M target name.
-        head_tail = os.path.split(TARGET_MAP[target].tfm_target_name)
+        head_tail = os.path.split(get_target(target).tfm_target_name)
         while head_tail[0]:
             install_dir = os.path.join(install_dir, os.pardir)
             head_tail = os.path.split(head_tail[0])
@@ -369,6 +710,20 @@ def _copy_binaries(source, destination, toolchain, target):
         shutil.copy2(tfm_veneer, output_dir)
 
 
+def _get_source_path(source, path):
+    """
+    Resolve a path of tfm_ns_import.yaml. Paths are relative to the cmake
+    build folder, and those starting with ../ to the TF-M source folder,
+    which is the parent of the default build folder.
+
+    :param source: cmake build folder
+    :param path: Path from tfm_ns_import.yaml
+    """
+    if path.startswith("../"):
+        return os.path.join(TF_M_SOURCE_DIR, path[3:])
+    return os.path.join(source, path)
+
+
 def _copy_tfm_ns_files(source, target):
     """
     Copy TF-M NS API files into Mbed OS
@@ -384,9 +739,9 @@ def _copy_tfm_ns_files(source, target):
         return False
 
     def _copy_file(fname, path):
-        src_file = os.path.join(source, fname["src"])
+        src_file = _get_source_path(source, fname["src"])
         dst_file = os.path.join(path, fname["dst"])
-        logging.info("Copying file: " + src_file + " - to - " + dst_file)
+        log_event("copy", "Copying file: %s - to - %s", src_file, dst_file)
         if not os.path.isdir(os.path.dirname(dst_file)):
             os.makedirs(os.path.dirname(dst_file))
         try:
@@ -400,13 +755,15 @@ def _copy_tfm_ns_files(source, target):
             # files/folders which are not exported (the path names in
             # `tfm_ns_import.yaml` which don't begin with `install`). These
             # are handled as exceptions.
-            src_file = os.path.join(source, os.pardir, fname["src"])
+            src_file = os.path.join(TF_M_SOURCE_DIR, fname["src"])
             shutil.copy2(src_file, dst_file)
 
     def _copy_folder(folder, path):
-        src_folder = os.path.join(source, folder["src"])
+        src_folder = _get_source_path(source, folder["src"])
         dst_folder = os.path.join(path, folder["dst"])
-        logging.info("Copying folder: " + src_folder + " - to - " + dst_folder)
+        log_event(
+            "copy", "Copying folder: %s - to - %s", src_folder, dst_folder
+        )
         if not os.path.isdir(dst_folder):
             os.makedirs(dst_folder)
         for f in os.listdir(src_folder):
@@ -419,74 +776,53 @@ def _copy_tfm_ns_files(source, target):
 
     def _check_and_copy(list_of_items, path):
         for item in list_of_items:
-            if os.path.isdir(os.path.join(source, item["src"])):
+            if os.path.isdir(_get_source_path(source, item["src"])):
                 _copy_folder(item, path)
             else:
                 _copy_file(item, path)
 
-    with open(
-        os.path.join(os.path.dirname(__file__), "tfm_ns_import.yaml")
-    ) as ns_import:
-        yaml_data = yaml.safe_load(ns_import)
-        logging.info("Copying files/folders from TF-M to Mbed OS")
-        mbed_os_data = yaml_data["mbed-os"]
-        mbed_os_excluded_files = mbed_os_data["excluded_files"]
-        if target in mbed_os_data:
-            _check_and_copy(mbed_os_data[target], mbed_path)
-        if "common" in mbed_os_data:
-            _check_and_copy(mbed_os_data["common"], mbed_path)
-        if "TFM_V8M" in TARGET_MAP[target].extra_labels:
-            if "v8-m" in mbed_os_data:
-                _check_and_copy(mbed_os_data["v8-m"], mbed_path)
-        if "TFM_DUALCPU" in TARGET_MAP[target].extra_labels:
-            if "dualcpu" in mbed_os_data:
-                _check_and_copy(mbed_os_data["dualcpu"], mbed_path)
-
-        logging.info("Copying files/folders from TF-M to regression test")
-        tf_regression_data = yaml_data["tf-m-regression"]
-        if target in tf_regression_data:
-            _check_and_copy(tf_regression_data[target], ROOT)
-        if "common" in tf_regression_data:
-            _check_and_copy(tf_regression_data["common"], ROOT)
-        if "TFM_V8M" in TARGET_MAP[target].extra_labels:
-            if "v8-m" in tf_regression_data:
-                _check_and_copy(tf_regression_data["v8-m"], ROOT)
-        if "TFM_DUALCPU" in TARGET_MAP[target].extra_labels:
-            if "dualcpu" in tf_regression_data:
-                _check_and_copy(tf_regression_data["dualcpu"], ROOT)
-
-
-def _copy_psa_libs(source, destination, args):
-    """
-    Copy PSA Compliance libraries from source to destination
+    yaml_data = load_ns_import_yaml()
+    logging.info("Copying files/folders from TF-M to Mbed OS")
+    mbed_os_data = yaml_data["mbed-os"]
+    mbed_os_excluded_files = mbed_os_data["excluded_files"]
+    if target in mbed_os_data:
+        _check_and_copy(mbed_os_data[target], mbed_path)
+    if "common" in mbed_os_data:
+        _check_and_copy(mbed_os_data["common"], mbed_path)
+    if "TFM_V8M" in get_target(target).extra_labels:
+        if "v8-m" in mbed_os_data:
+            _check_and_copy(mbed_os_data["v8-m"], mbed_path)
+    if "TFM_DUALCPU" in get_target(target).extra_labels:
+        if "dualcpu" in mbed_os_data:
+            _check_and_copy(mbed_os_data["dualcpu"], mbed_path)
+
+    logging.info("Copying files/folders from TF-M to regression test")
+    tf_regression_data = yaml_data["tf-m-regression"]
+    if target in tf_regression_data:
+        _check_and_copy(tf_regression_data[target], ROOT)
+    if "common" in tf_regression_data:
+        _check_and_copy(tf_regression_data["common"], ROOT)
+    if "TFM_V8M" in get_target(target).extra_labels:
+        if "v8-m" in tf_regression_data:
+            _check_and_copy(tf_regression_data["v8-m"], ROOT)
+    if "TFM_DUALCPU" in get_target(target).extra_labels:
+        if "dualcpu" in tf_regression_data:
+            _check_and_copy(tf_regression_data["dualcpu"], ROOT)
+
+
+def _copy_psa_libs(source, target, toolchain, args):
+    """
+    Store the PSA Compliance libraries of the suite and make them the ones
+    Mbed OS links with
 
     :param source: directory where libraries are available
-    :param destination: directory to which libraries are copied to
+    :param target: Target name
+    :param toolchain: ARMCLANG or GNUARM
     :param args: Command-line arguments
     """
 
-    output_dir = os.path.join(
-        destination, "test", "lib", "TOOLCHAIN_" + TC_DICT[args.toolchain]
-    )
-    if not os.path.isdir(output_dir):
-        os.makedirs(output_dir)
-
     source = os.path.join(source, "app", "psa_api_tests")
-    output_lib_suffix = ".ar" if args.toolchain == "ARMCLANG" else ".a"
-
-    val_nspe = os.path.join(source, "val", "val_nspe.a")
-    val_nspe_output = os.path.join(
-        output_dir, "libval_nspe" + output_lib_suffix
-    )
-    logging.info("Copying file: %s - to - %s" % (val_nspe, val_nspe_output))
-    shutil.copy2(val_nspe, val_nspe_output)
-
-    pal_nspe = os.path.join(source, "platform", "pal_nspe.a")
-    pal_nspe_output = os.path.join(
-        output_dir, "libpal_nspe" + output_lib_suffix
-    )
-    logging.info("Copying file: %s - to - %s" % (pal_nspe, pal_nspe_output))
-    shutil.copy2(pal_nspe, pal_nspe_output)
+    output_lib_suffix = ".ar" if toolchain == "ARMCLANG" else ".a"
 
     if (
         args.suite == "INITIAL_ATTESTATION"
@@ -508,74 +844,67 @@ def _copy_psa_libs(source, destination, args):
             source, "dev_apis", suite_folder, "test_combine.a"
         )
 
-    test_combine_output = os.path.join(
-        output_dir, "libtest_combine" + output_lib_suffix
-    )
+    # val_nspe and pal_nspe are the same for all suites, so they are
+    # stored once and only test_combine is kept per suite.
+    val_nspe = os.path.join(source, "val", "val_nspe.a")
+    pal_nspe = os.path.join(source, "platform", "pal_nspe.a")
+    libs = {
+        "libval_nspe" + output_lib_suffix: val_nspe,
+        "libpal_nspe" + output_lib_suffix: pal_nspe,
+        "libtest_combine" + output_lib_suffix: test_combine,
+    }
+    store_libs(libs, target, toolchain, args.suite)
+    activate_libs(target, toolchain, args.suite)
+
+
+def _copy_library(source, toolchain):
+
     logging.info(
-        "Copying file: %s - to - %s" % (test_combine, test_combine_output)
+        "Copying regression test libraries from TF-M to regression test"
     )
-    shutil.copy2(test_combine, test_combine_output)
+    tf_regression_data = load_ns_import_yaml()["tf-m-regression"]
 
+    if "regression_libs" in tf_regression_data:
+        for item in tf_regression_data["regression_libs"]:
+            src_file = os.path.join(source, item["src"])
+            dst_base = os.path.basename(src_file)
 
-def _copy_library(source, toolchain):
+            if toolchain == "ARMCLANG":
+                dst_base = os.path.splitext(dst_base)[0] + ".ar"
 
-    with open(
-        os.path.join(os.path.dirname(__file__), "tfm_ns_import.yaml")
-    ) as ns_import:
-        logging.info(
-            "Copying regression test libraries from TF-M to regression test"
-        )
-        yaml_data = yaml.safe_load(ns_import)
-        tf_regression_data = yaml_data["tf-m-regression"]
-
-        if "regression_libs" in tf_regression_data:
-            for item in tf_regression_data["regression_libs"]:
-                src_file = os.path.join(source, item["src"])
-                dst_base = os.path.basename(src_file)
-
-                if toolchain == "ARMCLANG":
-                    dst_base = os.path.splitext(dst_base)[0] + ".ar"
-
-                dst_file = os.path.join(
-                    ROOT,
-                    item["dst"],
-                    "TOOLCHAIN_" + TC_DICT[toolchain],
-                    dst_base,
-                )
-                logging.info(
-                    "Copying file: " + src_file + " - to - " + dst_file
-                )
-                if not os.path.isdir(os.path.dirname(dst_file)):
-                    os.makedirs(os.path.dirname(dst_file))
-
-                # TODO:
-                # https://github.com/ARMmbed/mbed-os-tf-m-regression-tests/issues/103
-                # libtfm_test_suite_fwu_ns.a exists for Musca B1 only.
-                # This is to avoid failure on Musca S1.
-                if os.path.exists(src_file):
-                    shutil.copy2(src_file, dst_file)
-                else:
-                    logging.info("Skipping " + src_file)
-
-                if dst_base == "libplatform_ns.ar":
-                    # TF-M redirects output to serial by declaring its own `FILE __stdout`
-                    # and disables the toolchain's default version of this symbol using
-                    # the flag `-nostdlib`. But stdlib is enabled and required by Mbed OS,
-                    # so we need to disable the one from TF-M's libplatform_ns to avoid
-                    # symbol duplication.
-                    cmd = [
-                        "fromelf",
-                        "--elf",
-                        "--localize",
-                        "__stdout",
-                        dst_file,
-                        "-o",
-                        dst_file,
-                    ]
-                    ret = run_cmd_and_return(cmd)
-                    if ret:
-                        msg = "Unable to strip __stdout from %s" % (dst_base,)
-                        raise Exception(msg)
+            dst_file = os.path.join(
+                ROOT,
+                item["dst"],
+                "TOOLCHAIN_" + TC_DICT[toolchain],
+                dst_base,
+            )
+            log_event("copy", "Copying file: %s - to - %s", src_file, dst_file)
+            if not os.path.isdir(os.path.dirname(dst_file)):
+                os.makedirs(os.path.dirname(dst_file))
+
+            # TODO:
+            # https://github.com/ARMmbed/mbed-os-tf-m-regression-tests/issues/103
+            # libtfm_test_suite_fwu_ns.a exists for Musca B1 only.
+            # This is to avoid failure on Musca S1.
+            if not os.path.exists(src_file):
+                logging.info("Skipping %s", src_file)
+            elif dst_base == "libplatform_ns.ar":
+                # TF-M redirects output to serial by declaring its own `FILE __stdout`
+                # and disables the toolchain's default version of this symbol using
+                # the flag `-nostdlib`. But stdlib is enabled and required by Mbed OS,
+                # so we need to disable the one from TF-M's libplatform_ns to avoid
+                # symbol duplication. The result is cached, and the library is
+                # left untouched if it did not change.
+                try:
+                    localize_file(src_file, dst_file, ["__stdout"])
+                except Exception as e:
+                    msg = "Unable to strip __stdout from %s: %s" % (
+                        dst_base,
+                        e,
+                    )
+                    raise Exception(msg)
+            else:
+                shutil.copy2(src_file, dst_file)
 
 
 def _build_target(tgt, cmake_build_dir, args):
@@ -589,9 +918,11 @@ def _build_target(tgt, cmake_build_dir, args):
     :param args: Command-line arguments
     """
     tgt_list = []
-    logging.info("Building target - %s using %s toolchain" % (tgt[0], tgt[2]))
-
-    _run_cmake_build(cmake_build_dir, args, tgt, args.config)
+    if not args.skip_build:
+        logging.info(
+            "Building target - %s using %s toolchain" % (tgt[0], tgt[2])
+        )
+        _run_cmake_build(cmake_build_dir, args, tgt, args.config)
 
     if not args.skip_copy:
         source = os.path.join(
@@ -607,7 +938,7 @@ def _build_target(tgt, cmake_build_dir, args):
         if args.config == SUPPORTED_TFM_CONFIGS[1]:
             _copy_library(cmake_build_dir, tgt[2])
         elif args.config in SUPPORTED_TFM_PSA_CONFIGS:
-            _copy_psa_libs(cmake_build_dir, ROOT, args)
+            _copy_psa_libs(cmake_build_dir, tgt[0], tgt[2], args)
 
         _copy_tfm_ns_files(cmake_build_dir, tgt[0])
 
@@ -622,15 +953,14 @@ def _build_tfm(args):
     """
 
     if not args.skip_clone:
-        _clone_tfm_repo(args.mcu, args.commit)
-
-    cmake_build_dir = os.path.join(
-        TF_M_BUILD_DIR, "trusted-firmware-m", "cmake_build"
-    )
-    if os.path.isdir(cmake_build_dir):
-        shutil.rmtree(cmake_build_dir, onerror=handle_read_permission_error)
+        _clone_tfm_repo(args.mcu, args.commit, args.update_lock)
 
-    os.mkdir(cmake_build_dir)
+    if args.workspace_pool:
+        # Each target gets its own workspace, see _build_in_workspace()
+        cmake_build_dir = None
+    else:
+        cmake_build_dir = os.path.join(TF_M_SOURCE_DIR, "cmake_build")
+        _prepare_build_dir(cmake_build_dir, args)
 
     if args.mcu:
         if args.toolchain:
@@ -645,7 +975,7 @@ def _build_tfm(args):
         else:
             tgt = _get_target_info(args.mcu)
 
-        _build_target(tgt, cmake_build_dir, args)
+        _build_in_workspace(tgt, cmake_build_dir, args)
 
     else:
         for tgt in _get_mbed_supported_tfm_targets():
@@ -662,7 +992,65 @@ def _build_tfm(args):
                 if args.toolchain:
                     tgt = _get_target_info(tgt[0], args.toolchain)
 
-                _build_target(tgt, cmake_build_dir, args)
+                _build_in_workspace(tgt, cmake_build_dir, args)
+
+
+def _prepare_build_dir(cmake_build_dir, args):
+    """
+    Start from an empty build folder, or check there is a build to copy
+    :param cmake_build_dir: Cmake build directory
+    :param args: Command-line arguments
+    """
+    if args.skip_build:
+        if not os.path.isdir(cmake_build_dir):
+            logging.critical(
+                "No existing TF-M build found in %s" % cmake_build_dir
+            )
+            sys.exit(1)
+    else:
+        if os.path.isdir(cmake_build_dir):
+            shutil.rmtree(
+                cmake_build_dir, onerror=handle_read_permission_error
+            )
+
+        os.mkdir(cmake_build_dir)
+
+
+def _build_in_workspace(tgt, cmake_build_dir, args):
+    """
+    Build a target in the given build folder, or in its workspace from
+    the pool which is kept for incremental builds
+
+    :param tgt: Target tuple, see _build_target()
+    :param cmake_build_dir: Cmake build directory, None to use the pool
+    :param args: Command-line arguments
+    """
+    if cmake_build_dir:
+        _build_target(tgt, cmake_build_dir, args)
+        return
+
+    tfm_commit = run_cmd_and_return(
+        ["git", "-C", TF_M_SOURCE_DIR, "rev-parse", "HEAD"], True
+    ).strip()
+    key = {
+        "dependencies": [_get_dependency_set(tgt[0]), tfm_commit],
+        "target": tgt[0],
+        "toolchain": tgt[2],
+        "config": args.config,
+        "suite": args.suite,
+        "profile": args.profile,
+        "debug": args.debug,
+    }
+    pool = WorkspacePool(args.workspace_budget)
+    if args.skip_build and pool.get_name(key) not in dict(pool.status()):
+        logging.critical("No existing TF-M build found in the workspace pool")
+        sys.exit(1)
+
+    workspace = pool.acquire(key)
+    try:
+        _build_target(tgt, workspace, args)
+    finally:
+        pool.release(workspace)
 
 
 def _get_parser():
@@ -679,9 +1067,8 @@ def _get_parser():
     parser.add_argument(
         "-m",
         "--mcu",
-        help="Build for the given MCU",
+        help="Build for the given MCU, see --list",
         default=None,
-        choices=get_tfm_regression_targets(),
     )
 
     hmsg = "Build for the given toolchain (default is tfm_default_toolchain)"
@@ -756,17 +1143,106 @@ def _get_parser():
         default=False,
     )
 
+    parser.add_argument(
+        "--clone-only",
+        help="Only clone/checkout TF-M dependencies",
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--update-lock",
+        help="Resolve the refs of dependencies.yaml again and pin their "
+        "commits, branches included, in dependencies.lock",
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--skip-build",
+        help="Copy the outputs of the existing TF-M build without rebuilding",
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of parallel compile jobs (default: chosen by Ninja)",
+        type=int,
+        default=None,
+    )
+
+    parser.add_argument(
+        "--workspace-pool",
+        help="Build in a workspace kept for this target, toolchain, config, "
+        "suite and profile instead of a fresh cmake_build folder",
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--workspace-budget",
+        help="Disk budget of the workspace pool, the least recently used "
+        "workspaces are deleted above it (default: %s)" % DEFAULT_BUDGET,
+        type=parse_size,
+        default=parse_size(DEFAULT_BUDGET),
+    )
+
+    parser.add_argument(
+        "--ccache",
+        help="Compile through ccache to reuse objects across builds",
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--ccache-dir",
+        help="Cache directory of ccache (default: ccache's own setting)",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--ccache-max-size",
+        help="Size limit of the cache, e.g. 5G (default: ccache's own "
+        "setting)",
+        default=None,
+    )
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        help="Log debug messages",
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--log-json",
+        help="Also append every log event to this file as JSON lines, with "
+        "its step, target and suite",
+        default=None,
+    )
+
     return parser
 
 
-def _main():
+def _main(argv=None):
     """
     Build TrustedFirmware-M (TF-M) image for supported targets
+    :param argv: Command-line arguments, defaults to sys.argv
     """
     global TF_M_BUILD_DIR
-    signal.signal(signal.SIGINT, exit_gracefully)
+    # Builds can also run in worker threads of test_psa_target.py, and the
+    # build server handles Ctrl+C itself
+    if (
+        not IN_PROCESS
+        and threading.current_thread() is threading.main_thread()
+    ):
+        signal.signal(signal.SIGINT, exit_gracefully)
     parser = _get_parser()
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    event_log.configure("Build-TF-M", args.verbose, args.log_json)
 
     if args.list:
         logging.info(
@@ -776,6 +1252,16 @@ def _main():
         )
         return
 
+    # Validated here rather than with choices, so --help does not need to
+    # read the targets
+    if args.mcu and args.mcu not in get_tfm_regression_targets():
+        parser.error(
+            "argument -m/--mcu: invalid choice: %r (see --list)" % args.mcu
+        )
+
+    if are_dependencies_installed() != 0:
+        sys.exit(1)
+
     if args.config not in SUPPORTED_TFM_CONFIGS:
         logging.info(
             "Supported TF-M configs are: {}".format(
@@ -793,6 +1279,20 @@ def _main():
             )
             return
 
+    if args.skip_build and (args.clean or args.skip_copy):
+        logging.info(
+            "Cannot skip the build together with --clean or --skip-copy"
+        )
+        return
+
+    if args.ccache and shutil.which("ccache") is None:
+        logging.critical('"ccache" is not installed')
+        sys.exit(1)
+
+    if args.skip_build:
+        # The outputs being copied belong to the current checkout
+        args.skip_clone = True
+
     if args.clean:
         if args.skip_clone:
             args.skip_clone = False
@@ -801,18 +1301,30 @@ def _main():
             )
 
         if os.path.isdir(TF_M_BUILD_DIR):
-            logging.info("Removing folder %s" % TF_M_BUILD_DIR)
+            logging.info("Removing folder %s", TF_M_BUILD_DIR)
             shutil.rmtree(TF_M_BUILD_DIR, onerror=handle_read_permission_error)
 
     if not os.path.isdir(TF_M_BUILD_DIR):
         os.mkdir(TF_M_BUILD_DIR)
 
-    logging.info("Using folder %s" % TF_M_BUILD_DIR)
-    _build_tfm(args)
+    logging.info("Using folder %s", TF_M_BUILD_DIR)
+    owns_rusage_log = start_rusage_log()
+    try:
+        with rusage_context(target=args.mcu, suite=args.suite):
+            if args.clone_only:
+                _clone_tfm_repo(args.mcu, args.commit, args.update_lock)
+            else:
+                _build_tfm(args)
+    finally:
+        if owns_rusage_log:
+            finish_rusage_log()
+        stats = get_write_stats()
+        logging.info(
+            "Generated files: %d written, %d unchanged",
+            stats["written"],
+            stats["unchanged"],
+        )
 
 
 if __name__ == "__main__":
-    if are_dependencies_installed() != 0:
-        sys.exit(1)
-    else:
-        _main()
+    _main()
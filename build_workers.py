@@ -0,0 +1,841 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2021 ARM Limited. All rights reserved.
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import sys
+import argparse
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+import queue
+import socket
+import socketserver
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+import event_log
+from atomic_write import file_sha256, write_file_atomically
+from artifact_bundle import (
+    blob_path,
+    check_manifest,
+    check_relative_path,
+    unpack_bundle,
+)
+from psa_builder import TC_DICT, get_tfm_regression_targets
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+
+# Bundle a worker packs its builds into, blobs are kept between cells so
+# only new ones are compressed and sent
+WORKER_BUNDLE = os.path.join(".cache", "worker_bundle")
+DEFAULT_PORT = 7733
+# Shared secret of the workers and coordinators, required by a worker
+# which listens on another interface than the loopback
+TOKEN_ENV = "BUILD_WORKERS_TOKEN"
+
+# Every message is a JSON header preceded by its size, a blob follows its
+# header as raw bytes.
+HEADER = struct.Struct(">I")
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+
+# A building worker sends a heartbeat this often, and is taken as lost
+# when nothing arrives for HEARTBEAT_TIMEOUT
+HEARTBEAT_INTERVAL = 5
+HEARTBEAT_TIMEOUT = 60
+CONNECT_TIMEOUT = 10
+# Failed health checks before a worker is dropped, and the wait between
+# them
+HEALTH_CHECKS = 3
+HEALTH_CHECK_DELAY = 5
+
+
+class ProtocolError(Exception):
+    """
+    A peer sent something unexpected or went away
+    """
+
+
+class Connection:
+    """
+    Length-prefixed JSON messages and blobs over a socket, safe to send
+    from several threads
+
+    :param sock: Connected socket
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.lock = threading.Lock()
+
+    def send(self, message, path=None):
+        """
+        :param message: JSON serializable dict, with a "type"
+        :param path: File sent after the message, its size must be in the
+                     message
+        """
+        data = json.dumps(message).encode("utf-8")
+        with self.lock:
+            self.sock.sendall(HEADER.pack(len(data)) + data)
+            if path:
+                with open(path, "rb") as f:
+                    self.sock.sendfile(f)
+
+    def _receive_exactly(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.sock.recv(min(size - len(data), CHUNK_SIZE))
+            if not chunk:
+                raise ProtocolError("Connection closed")
+            data += chunk
+        return bytes(data)
+
+    def receive(self, expected=None):
+        """
+        :param expected: Message type expected, None for any
+        :return: Message dict
+        """
+        (size,) = HEADER.unpack(self._receive_exactly(HEADER.size))
+        if size > MAX_MESSAGE_SIZE:
+            raise ProtocolError("Message of %d bytes is too large" % size)
+        message = json.loads(self._receive_exactly(size).decode("utf-8"))
+        if message.get("type") == "error":
+            raise ProtocolError(message["error"])
+        if expected and message.get("type") != expected:
+            raise ProtocolError(
+                "Expected %s, received %s" % (expected, message.get("type"))
+            )
+        return message
+
+    def receive_file(self, path, size, sha256):
+        """
+        Receive the bytes following a message into a file, which is only
+        written if they have the expected digest
+        :param path: Destination path, written atomically
+        :param size: Number of bytes
+        :param sha256: SHA-256 hex digest of the bytes
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        sha = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path), suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                remaining = size
+                while remaining:
+                    chunk = self._receive_exactly(min(remaining, CHUNK_SIZE))
+                    sha.update(chunk)
+                    f.write(chunk)
+                    remaining -= len(chunk)
+            if sha.hexdigest() != sha256:
+                raise ProtocolError("Corrupted transfer of %s" % path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+def _parse_address(address):
+    """
+    :param address: "host:port" or "host"
+    :return: (host, port)
+    """
+    host, __, port = address.rpartition(":")
+    if not host:
+        return port, DEFAULT_PORT
+    return host, int(port)
+
+
+def _is_loopback(host):
+    """
+    :param host: Address to listen on
+    :return: True if only this host can connect to it
+    """
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class Worker:
+    """
+    Build the cells sent by a coordinator in a checkout of this repository,
+    one cell at a time
+
+    :param root: Checkout to build in, with Mbed OS deployed
+    :param token: Token the requests must carry, None to accept any
+    """
+
+    def __init__(self, root=ROOT, token=None):
+        self.root = root
+        self.bundle = os.path.join(root, WORKER_BUNDLE)
+        self.busy = threading.Lock()
+        self.token = token
+
+    def handle(self, conn):
+        """
+        Answer one request of a coordinator
+        :param conn: Connection to the coordinator
+        """
+        message = conn.receive()
+        if self.token and not hmac.compare_digest(
+            str(message.get("token", "")), self.token
+        ):
+            conn.send({"type": "error", "error": "Invalid token"})
+            return
+        if message["type"] == "ping":
+            conn.send(
+                {
+                    "type": "pong",
+                    "busy": self.busy.locked(),
+                    "root": self.root,
+                    "cpus": os.cpu_count(),
+                }
+            )
+        elif message["type"] == "build":
+            if not self.busy.acquire(blocking=False):
+                conn.send({"type": "error", "error": "Worker is busy"})
+                return
+            try:
+                error = self._check_build(message)
+                if error:
+                    conn.send({"type": "error", "error": error})
+                else:
+                    self._build(conn, message)
+            finally:
+                self.busy.release()
+        else:
+            conn.send({"type": "error", "error": "Unknown request"})
+
+    def _run(self, conn, command):
+        """
+        Run a build, forwarding its output and sending heartbeats. The
+        build is stopped if the coordinator goes away.
+        :param conn: Connection to the coordinator
+        :param command: Command as a list of tokens
+        :return: Exit code of the build
+        """
+        popen_instance = subprocess.Popen(
+            command,
+            cwd=self.root,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        )
+        done = threading.Event()
+
+        def _heartbeat():
+            while not done.wait(HEARTBEAT_INTERVAL):
+                try:
+                    conn.send({"type": "heartbeat"})
+                except OSError:
+                    popen_instance.terminate()
+                    return
+
+        thread = threading.Thread(target=_heartbeat, daemon=True)
+        thread.start()
+        try:
+            for line in iter(popen_instance.stdout.readline, b""):
+                conn.send(
+                    {
+                        "type": "log",
+                        "line": line.decode("utf-8", "replace").rstrip("\n"),
+                    }
+                )
+        except OSError:
+            logging.error("Coordinator went away, stopping the build")
+            popen_instance.terminate()
+        finally:
+            popen_instance.stdout.close()
+            retcode = popen_instance.wait()
+            done.set()
+            thread.join()
+        return retcode
+
+    def _get_results(self, mcu, toolchain):
+        """
+        :param mcu: Target name
+        :param toolchain: Mbed OS toolchain name, e.g. GCC_ARM
+        :return: (dict of manifest path relative to the bundle to its
+                 content, test_spec.json build groups of the cell)
+        """
+        manifests = {}
+        manifests_dir = os.path.join(self.bundle, "manifests", mcu, toolchain)
+        for name in sorted(os.listdir(manifests_dir)):
+            path = os.path.join(manifests_dir, name)
+            # Sent with "/" so the coordinator may run on another host type
+            key = "/".join(["manifests", mcu, toolchain, name])
+            with open(path) as f:
+                manifests[key] = json.load(f)
+
+        builds = {}
+        with open(os.path.join(self.root, "test_spec.json")) as f:
+            for group, build in json.load(f)["builds"].items():
+                if (
+                    build["platform"] == mcu
+                    and build["toolchain"] == toolchain
+                ):
+                    builds[group] = build
+        return manifests, {"builds": builds}
+
+    @staticmethod
+    def _check_build(message):
+        """
+        :param message: Build request
+        :return: Why the request is refused, None if it is valid
+        """
+        if message.get("mcu") not in get_tfm_regression_targets():
+            return "Unknown target %r" % message.get("mcu")
+        if message.get("toolchain") not in TC_DICT:
+            return "Unknown toolchain %r" % message.get("toolchain")
+        args = message.get("args")
+        if not isinstance(args, list) or not all(
+            isinstance(arg, str) for arg in args
+        ):
+            return "Invalid arguments"
+        # The worker decides where its outputs go
+        if any(arg.startswith("--bundle") for arg in args):
+            return "--bundle cannot be passed to a worker"
+        return None
+
+    def _build(self, conn, message):
+        """
+        Build a cell and send its artifacts
+        :param conn: Connection to the coordinator
+        :param message: Build request
+        """
+        mcu = message["mcu"]
+        toolchain = message["toolchain"]
+        logging.info("Building %s with %s", mcu, toolchain)
+        command = [
+            sys.executable,
+            "test_psa_target.py",
+            "-b",
+            "-m",
+            mcu,
+            "-t",
+            toolchain,
+            "--bundle",
+            self.bundle,
+        ] + message["args"]
+        start = time.monotonic()
+        retcode = self._run(conn, command)
+        duration = time.monotonic() - start
+        if retcode:
+            logging.error("Building %s with %s failed", mcu, toolchain)
+            conn.send({"type": "result", "ok": False, "exit": retcode})
+            return
+
+        manifests, test_spec = self._get_results(mcu, TC_DICT[toolchain])
+        conn.send(
+            {
+                "type": "result",
+                "ok": True,
+                "duration": duration,
+                "manifests": manifests,
+                "test_spec": test_spec,
+            }
+        )
+
+        wanted = conn.receive("want")["blobs"]
+        for digest in wanted:
+            path = blob_path(self.bundle, digest)
+            conn.send(
+                {
+                    "type": "blob",
+                    "sha256": digest,
+                    "size": os.path.getsize(path),
+                    "transfer_sha256": file_sha256(path),
+                },
+                path,
+            )
+        conn.receive("done")
+        logging.info(
+            "Built %s with %s in %.0fs, sent %d blob(s)",
+            mcu,
+            toolchain,
+            duration,
+            len(wanted),
+        )
+
+
+def serve(worker, host, port):
+    """
+    Run a worker until interrupted
+    :param worker: Worker
+    :param host: Address to listen on
+    :param port: Port to listen on, 0 for any free port
+    """
+
+    class RequestHandler(socketserver.BaseRequestHandler):
+        def handle(self):
+            conn = Connection(self.request)
+            try:
+                worker.handle(conn)
+            except (OSError, ProtocolError) as e:
+                logging.error(
+                    "Request from %s failed: %s", self.client_address, e
+                )
+
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    server = socketserver.ThreadingTCPServer((host, port), RequestHandler)
+    server.daemon_threads = True
+    # Printed for whoever started the worker, e.g. with --local
+    print("%s:%d" % server.server_address, flush=True)
+    logging.info(
+        "Worker for %s listening on %s:%d", worker.root, *server.server_address
+    )
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+class Coordinator:
+    """
+    Send the cells of a build matrix to workers and collect their
+    artifacts into a bundle. A cell whose worker fails or goes away is
+    retried, on any worker.
+
+    :param workers: List of (host, port) of the workers
+    :param bundle: Bundle directory the artifacts are collected into
+    :param args: Additional test_psa_target.py arguments of every cell
+    :param retries: Number of times a failed cell is tried again
+    :param unpack: Restore the artifacts into this checkout and add the
+                   cells to test_spec.json, to run the tests from here
+    :param token: Token of the workers, None if they do not need one
+    """
+
+    def __init__(
+        self, workers, bundle, args=(), retries=1, unpack=False, token=None
+    ):
+        self.workers = workers
+        self.token = token
+        self.bundle = bundle
+        self.args = list(args)
+        self.retries = retries
+        self.unpack = unpack
+        self.cells = queue.Queue()
+        self.lock = threading.Lock()
+        self.remaining = 0
+        self.failed = []
+
+    def _ping(self, address):
+        """
+        :param address: (host, port) of the worker
+        :return: True if the worker answers and is idle
+        """
+        try:
+            with socket.create_connection(address, CONNECT_TIMEOUT) as sock:
+                sock.settimeout(CONNECT_TIMEOUT)
+                conn = Connection(sock)
+                conn.send({"type": "ping", "token": self.token})
+                return not conn.receive("pong")["busy"]
+        except (OSError, ValueError, ProtocolError):
+            return False
+
+    @staticmethod
+    def _check_manifests(cell, manifests):
+        """
+        Check the manifests sent by a worker only describe the cell and
+        only restore files inside the checkout
+        :param cell: (target, toolchain)
+        :param manifests: dict of manifest path relative to the bundle to
+                          its content
+        :raises ProtocolError: If a manifest is invalid
+        """
+        mcu, toolchain = cell
+        for path, manifest in manifests.items():
+            try:
+                check_relative_path(path)
+                check_manifest(manifest)
+            except (KeyError, AttributeError, ValueError) as e:
+                raise ProtocolError("Invalid manifest %s: %s" % (path, e))
+            expected = "/".join(
+                [
+                    "manifests",
+                    mcu,
+                    TC_DICT[toolchain],
+                    "%s.json" % manifest.get("suite"),
+                ]
+            )
+            if (
+                path != expected
+                or manifest.get("target") != mcu
+                or manifest.get("toolchain") != TC_DICT[toolchain]
+            ):
+                raise ProtocolError("Unexpected manifest %s" % path)
+
+    def _collect(self, conn, cell, result):
+        """
+        Receive the blobs missing from the bundle, then record the
+        manifests of a cell
+        :param conn: Connection to the worker
+        :param cell: (target, toolchain)
+        :param result: Result message of the cell
+        :return: Number of bytes received
+        """
+        self._check_manifests(cell, result["manifests"])
+        wanted = sorted(
+            {
+                entry["sha256"]
+                for manifest in result["manifests"].values()
+                for entry in manifest["files"].values()
+                if not os.path.isfile(blob_path(self.bundle, entry["sha256"]))
+            }
+        )
+        conn.send({"type": "want", "blobs": wanted})
+        received = 0
+        for __ in wanted:
+            header = conn.receive("blob")
+            if header["sha256"] not in wanted:
+                raise ProtocolError("Unexpected blob %s" % header["sha256"])
+            conn.receive_file(
+                blob_path(self.bundle, header["sha256"]),
+                header["size"],
+                header["transfer_sha256"],
+            )
+            received += header["size"]
+
+        # Manifests last, so a bundle never lists a missing blob
+        for path, manifest in result["manifests"].items():
+            write_file_atomically(
+                os.path.join(self.bundle, *path.split("/")),
+                json.dumps(manifest, indent=2, sort_keys=True),
+            )
+        conn.send({"type": "done"})
+        return received
+
+    def _install(self, result):
+        """
+        Restore the artifacts of a cell into this checkout
+        :param result: Result message of the cell
+        """
+        import test_psa_target
+
+        for manifest in result["manifests"].values():
+            unpack_bundle(
+                self.bundle,
+                manifest["target"],
+                manifest["suite"],
+                manifest["toolchain"],
+            )
+        test_psa_target._merge_test_spec(result["test_spec"])
+
+    def _build(self, address, cell):
+        """
+        Build a cell on a worker
+        :param address: (host, port) of the worker
+        :param cell: (target, toolchain)
+        :return: True if the cell was built and its artifacts collected
+        """
+        mcu, toolchain = cell
+        prefix = "[%s %s] " % cell
+        with socket.create_connection(address, CONNECT_TIMEOUT) as sock:
+            sock.settimeout(HEARTBEAT_TIMEOUT)
+            conn = Connection(sock)
+            conn.send(
+                {
+                    "type": "build",
+                    "token": self.token,
+                    "mcu": mcu,
+                    "toolchain": toolchain,
+                    "args": self.args,
+                }
+            )
+            while True:
+                message = conn.receive()
+                if message["type"] == "log":
+                    event_log.log_event(
+                        "output", "%s%s", prefix, message["line"]
+                    )
+                elif message["type"] == "result":
+                    break
+
+            if not message["ok"]:
+                logging.error(
+                    "%sfailed with exit code %s", prefix, message["exit"]
+                )
+                return False
+
+            received = self._collect(conn, cell, message)
+
+        logging.info(
+            "%sbuilt in %.0fs, received %d bytes of new blobs",
+            prefix,
+            message["duration"],
+            received,
+        )
+        if self.unpack:
+            self._install(message)
+        return True
+
+    def _finish(self, cell, attempt, ok):
+        """
+        Record the outcome of an attempt, queueing a failed cell again
+        while it has retries left
+        """
+        with self.lock:
+            if not ok and attempt < self.retries:
+                logging.info("Retrying %s %s", *cell)
+                self.cells.put((cell, attempt + 1))
+                return
+            if not ok:
+                self.failed.append(cell)
+            self.remaining -= 1
+
+    def _drive(self, address):
+        """
+        Feed cells to a worker until none are left or the worker is lost
+        :param address: (host, port) of the worker
+        """
+        name = "%s:%d" % address
+        strikes = 0
+        while True:
+            with self.lock:
+                if not self.remaining:
+                    return
+            try:
+                cell, attempt = self.cells.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            if not self._ping(address):
+                self.cells.put((cell, attempt))
+                strikes += 1
+                if strikes >= HEALTH_CHECKS:
+                    logging.error("Worker %s is lost", name)
+                    return
+                logging.info("Worker %s is unavailable", name)
+                time.sleep(HEALTH_CHECK_DELAY)
+                continue
+            strikes = 0
+
+            logging.info("Building %s %s on %s", cell[0], cell[1], name)
+            try:
+                with event_log.event_context(
+                    target=cell[0], toolchain=cell[1], worker=name
+                ):
+                    ok = self._build(address, cell)
+            except (OSError, ValueError, ProtocolError) as e:
+                logging.error("%s %s on %s: %s", cell[0], cell[1], name, e)
+                ok = False
+            self._finish(cell, attempt, ok)
+
+    def run(self, cells):
+        """
+        Build cells on the workers
+        :param cells: List of (target, toolchain)
+        :return: List of the cells which failed
+        """
+        self.remaining = len(cells)
+        for cell in cells:
+            self.cells.put((cell, 0))
+
+        threads = [
+            threading.Thread(target=self._drive, args=(address,), daemon=True)
+            for address in self.workers
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Left over if every worker was lost
+        while not self.cells.empty():
+            self.failed.append(self.cells.get()[0])
+        return sorted(self.failed)
+
+
+def _start_local_workers(roots):
+    """
+    Start a worker on this host for each checkout
+    :param roots: Checkouts of this repository
+    :return: (list of worker processes, list of (host, port))
+    """
+    processes = []
+    addresses = []
+    for root in roots:
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                os.path.join(ROOT, "build_workers.py"),
+                "worker",
+                "--listen",
+                "127.0.0.1:0",
+                "--root",
+                os.path.abspath(root),
+            ],
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+        )
+        processes.append(process)
+        address = process.stdout.readline().strip()
+        if not address:
+            logging.critical("Unable to start a worker in %s", root)
+            sys.exit(1)
+        addresses.append(_parse_address(address))
+    return processes, addresses
+
+
+def _get_parser():
+    parser = argparse.ArgumentParser(
+        description="Build the target and toolchain matrix on several hosts"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    worker = subparsers.add_parser(
+        "worker", help="Build the cells sent by a coordinator"
+    )
+    worker.add_argument(
+        "--listen",
+        help="Address to listen on, e.g. 0.0.0.0:%d to accept other hosts, "
+        "which requires %s (default: 127.0.0.1:%d)"
+        % (DEFAULT_PORT, TOKEN_ENV, DEFAULT_PORT),
+        default="127.0.0.1:%d" % DEFAULT_PORT,
+    )
+    worker.add_argument(
+        "--root",
+        help="Checkout to build in, one per worker (default: %s)" % ROOT,
+        default=ROOT,
+    )
+
+    run = subparsers.add_parser(
+        "run",
+        help="Build cells on workers, extra arguments are passed to "
+        "test_psa_target.py",
+    )
+    run.add_argument(
+        "-w",
+        "--worker",
+        help="Address of a worker, host[:port]",
+        action="append",
+        default=[],
+    )
+    run.add_argument(
+        "--local",
+        help="Start a worker on this host building in this checkout, can "
+        "be repeated",
+        action="append",
+        default=[],
+    )
+    run.add_argument(
+        "-m",
+        "--mcu",
+        help="Target to build, can be repeated (default: all)",
+        action="append",
+        default=[],
+    )
+    run.add_argument(
+        "-t",
+        "--toolchain",
+        help="Toolchain to build with, can be repeated (default: all)",
+        action="append",
+        choices=["ARMCLANG", "GNUARM"],
+        default=[],
+    )
+    run.add_argument(
+        "--bundle",
+        help="Bundle the artifacts are collected into",
+        required=True,
+    )
+    run.add_argument(
+        "--retries",
+        help="Times a failed cell is tried again (default: 1)",
+        type=int,
+        default=1,
+    )
+    run.add_argument(
+        "--unpack",
+        help="Restore the artifacts here and add them to test_spec.json",
+        action="store_true",
+    )
+    return parser
+
+
+def _main():
+    """
+    Run a worker, or build a matrix on workers
+    """
+    parser = _get_parser()
+    args, forwarded = parser.parse_known_args()
+    token = os.environ.get(TOKEN_ENV) or None
+
+    if args.command == "worker":
+        if forwarded:
+            parser.error("unrecognized arguments: " + " ".join(forwarded))
+        host, port = _parse_address(args.listen)
+        if not token and not _is_loopback(host):
+            logging.critical(
+                "Set a shared token in %s to accept builds from other hosts",
+                TOKEN_ENV,
+            )
+            sys.exit(1)
+        serve(Worker(os.path.abspath(args.root), token), host, port)
+        return
+
+    if not args.worker and not args.local:
+        parser.error("at least one --worker or --local is required")
+
+    if args.mcu:
+        targets = args.mcu
+    else:
+        targets = sorted(get_tfm_regression_targets())
+    toolchains = args.toolchain or ["ARMCLANG", "GNUARM"]
+    cells = [(mcu, toolchain) for mcu in targets for toolchain in toolchains]
+
+    processes, workers = _start_local_workers(args.local)
+    workers += [_parse_address(address) for address in args.worker]
+    try:
+        coordinator = Coordinator(
+            workers,
+            args.bundle,
+            forwarded,
+            args.retries,
+            args.unpack,
+            token,
+        )
+        failed = coordinator.run(cells)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    logging.info(
+        "Built %d of %d cell(s) on %d worker(s)",
+        len(cells) - len(failed),
+        len(cells),
+        len(workers),
+    )
+    if failed:
+        logging.critical(
+            "Failed: %s", ", ".join("%s %s" % cell for cell in failed)
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    event_log.configure("Build-Workers")
+    _main()
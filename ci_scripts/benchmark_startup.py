@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2021 ARM Limited. All rights reserved.
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import sys
+import argparse
+import json
+import logging
+import subprocess
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Entry point: commands which must not load the build machinery
+SCENARIOS = {
+    "build_tfm.py": [["--help"], ["--list"], ["-m", "NO_SUCH_TARGET"]],
+    "test_psa_target.py": [["--help"], ["--list"], ["-m", "NO_SUCH_TARGET"]],
+    "build_server.py": [["--help"]],
+}
+
+# Number of slowest imports recorded per command
+TOP_IMPORTS = 5
+
+
+def _parse_importtime(stderr):
+    """
+    Parse the output of python -X importtime
+    :param stderr: Standard error of the process
+    :return: (total import time in ms, list of (module, cumulative ms) of
+             the slowest top-level imports)
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        __, cumulative, name = line[len("import time:") :].split("|")
+        if not cumulative.strip().isdigit():
+            # Header line
+            continue
+        # Nested imports are indented, their time is part of their parent's
+        if not name.startswith("  "):
+            imports.append((name.strip(), int(cumulative) / 1000))
+
+    total = sum(ms for __, ms in imports)
+    slowest = sorted(imports, key=lambda item: -item[1])[:TOP_IMPORTS]
+    return total, slowest
+
+
+def measure(script, arguments, runs):
+    """
+    Time a command of an entry point
+    :param script: Entry point, relative to the repository root
+    :param arguments: Command-line arguments
+    :param runs: Number of runs, the fastest one is recorded
+    :return: dict with the wall and import times in ms, the slowest
+             imports and the exit code
+    """
+    best = None
+    for __ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", script] + arguments,
+            cwd=ROOT,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+        )
+        wall = (time.perf_counter() - start) * 1000
+        if best is None or wall < best["wall_ms"]:
+            imports, slowest = _parse_importtime(result.stderr)
+            best = {
+                "wall_ms": round(wall, 1),
+                "import_ms": round(imports, 1),
+                "slowest_imports": slowest,
+                "exit_code": result.returncode,
+            }
+    return best
+
+
+def compare(results, baseline, threshold, slack):
+    """
+    :param results: Results of this run, see measure()
+    :param baseline: Results of a previous run
+    :param threshold: Allowed slowdown as a fraction of the baseline
+    :param slack: Allowed slowdown in ms, absorbs the noise of fast commands
+    :return: List of the commands which became slower
+    """
+    regressions = []
+    for command, result in sorted(results.items()):
+        if command not in baseline:
+            continue
+        limit = baseline[command]["wall_ms"] * (1 + threshold) + slack
+        if result["wall_ms"] > limit:
+            regressions.append(command)
+            logging.error(
+                "%s: %.1f ms, baseline %.1f ms",
+                command,
+                result["wall_ms"],
+                baseline[command]["wall_ms"],
+            )
+    return regressions
+
+
+def _get_parser():
+    parser = argparse.ArgumentParser(
+        description="Measure the startup time of the entry points"
+    )
+    parser.add_argument(
+        "-n",
+        "--runs",
+        help="Runs per command, the fastest is recorded (default: 5)",
+        type=int,
+        default=5,
+    )
+    parser.add_argument(
+        "-o", "--output", help="Write the results to a JSON file"
+    )
+    parser.add_argument(
+        "--baseline",
+        help="Fail if a command is slower than in this JSON file",
+    )
+    parser.add_argument(
+        "--threshold",
+        help="Allowed slowdown compared to the baseline, in percent "
+        "(default: 25)",
+        type=float,
+        default=25.0,
+    )
+    parser.add_argument(
+        "--slack",
+        help="Allowed slowdown compared to the baseline, in ms "
+        "(default: 20)",
+        type=float,
+        default=20.0,
+    )
+    return parser
+
+
+def _main():
+    """
+    Time the commands which should start quickly and check them against
+    a baseline
+    """
+    args = _get_parser().parse_args()
+
+    results = {}
+    for script, scenarios in SCENARIOS.items():
+        for arguments in scenarios:
+            command = " ".join([script] + arguments)
+            results[command] = measure(script, arguments, args.runs)
+            logging.info(
+                "%-45s %7.1f ms, imports %6.1f ms (%s)",
+                command,
+                results[command]["wall_ms"],
+                results[command]["import_ms"],
+                ", ".join(
+                    "%s %.0f" % item
+                    for item in results[command]["slowest_imports"]
+                ),
+            )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold / 100, args.slack):
+            logging.critical("Startup time regressed")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[Benchmark-Startup] %(asctime)s: %(message)s.",
+        datefmt="%H:%M:%S",
+    )
+    _main()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2021 ARM Limited. All rights reserved.
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import sys
+import argparse
+import json
+import logging
+import re
+from atomic_write import write_file_atomically
+from test_timing import read_transcript
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+
+# Baselines of the throughputs, test/benchmark/<TARGET>/<TOOLCHAIN>.json
+BENCHMARK_DIR = os.path.join(ROOT, "test", "benchmark")
+
+# Allowed drop of throughput, as a fraction of the baseline
+DEFAULT_THRESHOLD = 0.1
+
+# Lines printed by the crypto benchmark of main.cpp
+RESULT = re.compile(r"BENCH (\S+) size=(\d+) iterations=(\d+) us=(\d+)\s*$")
+ERROR = re.compile(r"BENCH (\S+) size=(\d+) error=(-?\d+)")
+
+
+class BenchmarkParser:
+    """
+    Results of the PSA crypto benchmark, parsed from its serial output
+    """
+
+    def __init__(self):
+        self.results = {}
+
+    def feed(self, timestamp, line):
+        """
+        :param timestamp: Time the line was received, unused
+        :param line: Line of serial output
+        """
+        if "BENCH " not in line:
+            return
+
+        match = RESULT.search(line)
+        if match:
+            operation, size, iterations, usec = match.groups()
+            seconds = int(usec) / 1000000
+            ops = int(iterations) / seconds if seconds else 0
+            self.results["%s/%s" % (operation, size)] = {
+                "iterations": int(iterations),
+                "ops_per_second": round(ops, 2),
+                "bytes_per_second": round(ops * int(size)),
+            }
+            return
+
+        match = ERROR.search(line)
+        if match:
+            operation, size, status = match.groups()
+            self.results["%s/%s" % (operation, size)] = {"error": int(status)}
+
+    def get_results(self):
+        """
+        :return: dict of "<operation>/<payload size>" to its number of
+                 operations and bytes per second, or the PSA error status
+        """
+        return self.results
+
+
+def read_output(path):
+    """
+    :param path: host_runner.py --record transcript, Greentea output or
+                 raw serial output
+    :return: List of the lines of serial output
+    """
+    try:
+        return [line for __, line in read_transcript(path)]
+    except ValueError:
+        # No timestamps, raw serial output
+        with open(path, encoding="utf-8", errors="replace") as f:
+            return [line.rstrip("\r\n") for line in f]
+
+
+def get_baseline_path(target, toolchain):
+    """
+    :param target: Target name
+    :param toolchain: Toolchain, e.g. GCC_ARM
+    :return: Path of the baseline of the target built with the toolchain
+    """
+    return os.path.join(BENCHMARK_DIR, target, toolchain + ".json")
+
+
+def load_baseline(path):
+    """
+    :param path: Path of the baseline
+    :return: dict of "<operation>/<payload size>" to operations per second
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def update_baseline(path, results):
+    """
+    Record the throughput of the operations which succeeded as their
+    baseline, the baseline of the others is kept
+    :param path: Path of the baseline
+    :param results: Result of BenchmarkParser.get_results()
+    :return: Number of operations recorded
+    """
+    baseline = load_baseline(path)
+    count = 0
+    for name, result in results.items():
+        if "ops_per_second" in result:
+            baseline[name] = result["ops_per_second"]
+            count += 1
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_file_atomically(
+        path, json.dumps(baseline, indent=2, sort_keys=True) + "\n"
+    )
+    return count
+
+
+def compare(baseline, results, threshold=DEFAULT_THRESHOLD):
+    """
+    :param baseline: Result of load_baseline()
+    :param results: Result of BenchmarkParser.get_results()
+    :param threshold: Allowed drop of throughput as a fraction of the
+                      baseline
+    :return: List of (name, baseline ops/s, ops/s) of the operations which
+             became slower, an operation which failed has 0 ops/s
+    """
+    regressions = []
+    for name, before in sorted(baseline.items()):
+        if name not in results:
+            continue
+        after = results[name].get("ops_per_second", 0)
+        if after < before * (1 - threshold):
+            regressions.append((name, before, after))
+    return regressions
+
+
+def log_results(results):
+    """
+    :param results: Result of BenchmarkParser.get_results()
+    """
+    for name, result in sorted(results.items()):
+        if "error" in result:
+            logging.error("%-32s PSA error %d", name, result["error"])
+        else:
+            logging.info(
+                "%-32s %10.2f ops/s %10.1f KiB/s",
+                name,
+                result["ops_per_second"],
+                result["bytes_per_second"] / 1024,
+            )
+
+
+def _get_parser():
+    parser = argparse.ArgumentParser(
+        description="Parse the output of the PSA crypto benchmark"
+    )
+    parser.add_argument(
+        "output",
+        help="host_runner.py --record transcript, Greentea output or raw "
+        "serial output of the benchmark",
+    )
+    parser.add_argument(
+        "-b", "--baseline", help="Compare with this baseline", default=None
+    )
+    parser.add_argument(
+        "--threshold",
+        help="Allowed drop of throughput compared to the baseline, in "
+        "percent (default: %d)" % (DEFAULT_THRESHOLD * 100),
+        type=float,
+        default=DEFAULT_THRESHOLD * 100,
+    )
+    parser.add_argument(
+        "--update",
+        help="Record the throughputs as the baseline",
+        action="store_true",
+    )
+    return parser
+
+
+def _main():
+    """
+    Show the results of a benchmark run and compare them with a baseline
+    """
+    args = _get_parser().parse_args()
+
+    benchmark = BenchmarkParser()
+    try:
+        for line in read_output(args.output):
+            benchmark.feed(None, line)
+    except OSError as e:
+        logging.critical(str(e))
+        sys.exit(1)
+
+    results = benchmark.get_results()
+    if not results:
+        logging.critical("No benchmark results in %s", args.output)
+        sys.exit(1)
+    log_results(results)
+
+    if not args.baseline:
+        return
+    if args.update:
+        count = update_baseline(args.baseline, results)
+        logging.info("Recorded %d throughputs in %s", count, args.baseline)
+        return
+
+    regressions = compare(
+        load_baseline(args.baseline), results, args.threshold / 100
+    )
+    for name, before, after in regressions:
+        logging.error("%s: %.2f ops/s, baseline %.2f", name, after, before)
+    if regressions:
+        logging.critical("%d operations got slower", len(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[Crypto-Benchmark] %(asctime)s: %(message)s.",
+        datefmt="%H:%M:%S",
+    )
+    _main()
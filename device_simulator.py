@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2021 ARM Limited. All rights reserved.
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import sys
+import argparse
+import json
+import logging
+import selectors
+import threading
+import time
+
+try:
+    import pty
+    import tty
+except ImportError as e:
+    print(str(e) + " The device simulator needs a POSIX host.")
+    exit(1)
+
+from host_runner import KV_PATTERN
+
+# How long the simulator waits for the host to send what the transcript
+# expects, e.g. the Greentea sync
+HOST_TIMEOUT = 30
+
+
+def load_transcript(path):
+    """
+    :param path: JSON lines transcript written by host_runner.py --record,
+                 each entry has a time "t" and either the device output
+                 "rx" or the host input "tx"
+    :return: List of transcript entries
+    """
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class DeviceSimulator:
+    """
+    A pseudo-terminal behaving like the serial port of a board running a
+    test: it replays the device output of a transcript and waits for the
+    host input it recorded. Values the host chooses, like the sync UUID,
+    are substituted in the output that follows.
+
+    :param transcript: List of transcript entries, see load_transcript()
+    :param speed: Replay speed relative to the recording, 0 replays the
+                  output as fast as the host reads it
+    """
+
+    def __init__(self, transcript, speed=1.0):
+        self.transcript = transcript
+        self.speed = speed
+        self.master, self.slave = pty.openpty()
+        # The host opens the port raw, the simulator also keeps the slave
+        # open so the output is buffered until the host opens it.
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.thread = threading.Thread(target=self._replay, daemon=True)
+        self.error = None
+
+    def start(self):
+        """
+        Start replaying in the background
+        :return: Path of the serial port to open
+        """
+        self.thread.start()
+        return self.port
+
+    def wait(self, timeout=None):
+        """
+        Wait for the end of the replay
+        :param timeout: Timeout in seconds
+        :return: True if the replay has ended
+        """
+        self.thread.join(timeout)
+        return not self.thread.is_alive()
+
+    def close(self):
+        """
+        Close the pseudo-terminal, the host then sees the device go away
+        """
+        for fd in [self.master, self.slave]:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def _write(self, data):
+        while data:
+            written = os.write(self.master, data)
+            data = data[written:]
+
+    def _expect(self, selector, expected, pending):
+        """
+        Wait for the host to send a line with the Greentea keys of the
+        recorded one
+        :param selector: Selector of the master side
+        :param expected: Recorded host input
+        :param pending: Input received but not consumed yet
+        :return: (dict of recorded value to received value, pending input)
+        """
+        keys = [key for key, __ in KV_PATTERN.findall(expected)]
+        deadline = time.monotonic() + HOST_TIMEOUT
+        while True:
+            while b"\n" in pending:
+                raw, pending = pending.split(b"\n", 1)
+                received = KV_PATTERN.findall(raw.decode("utf-8", "replace"))
+                if [key for key, __ in received] == keys:
+                    recorded = [v for __, v in KV_PATTERN.findall(expected)]
+                    values = [v for __, v in received]
+                    return dict(zip(recorded, values)), pending
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise Exception("Timed out waiting for %r" % expected)
+            if selector.select(remaining):
+                pending += os.read(self.master, 4096)
+
+    def _replay(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self.master, selectors.EVENT_READ)
+        substitutions = {}
+        pending = b""
+        # Output is timed relative to the last input from the host, the
+        # time spent waiting for the host is not replayed.
+        base_time = time.monotonic()
+        base_t = 0
+        try:
+            for entry in self.transcript:
+                if "tx" in entry:
+                    recorded = [v for __, v in KV_PATTERN.findall(entry["tx"])]
+                    # A message the host sent again, e.g. a sync retry
+                    if recorded and all(v in substitutions for v in recorded):
+                        continue
+                    found, pending = self._expect(
+                        selector, entry["tx"], pending
+                    )
+                    substitutions.update(found)
+                    base_time = time.monotonic()
+                    base_t = entry["t"]
+                    continue
+
+                if self.speed:
+                    delay = (entry["t"] - base_t) / self.speed - (
+                        time.monotonic() - base_time
+                    )
+                    if delay > 0:
+                        time.sleep(delay)
+
+                text = entry["rx"]
+                for value, received in substitutions.items():
+                    text = text.replace(value, received)
+                self._write(text.encode("utf-8"))
+        except Exception as e:
+            self.error = e
+        finally:
+            selector.close()
+
+
+def _get_parser():
+    parser = argparse.ArgumentParser(
+        description="Replay a test transcript on a pseudo-terminal"
+    )
+    parser.add_argument(
+        "transcript", help="Transcript written by host_runner.py --record"
+    )
+    parser.add_argument(
+        "--speed",
+        help="Replay speed, 0 for as fast as possible (default: 1)",
+        type=float,
+        default=1.0,
+    )
+    parser.add_argument(
+        "--linger",
+        help="Seconds to keep the port open after the replay (default: 5)",
+        type=float,
+        default=5.0,
+    )
+    return parser
+
+
+def _main():
+    """
+    Replay a transcript until it ends, printing the port to pass to
+    host_runner.py --port
+    """
+    args = _get_parser().parse_args()
+    simulator = DeviceSimulator(load_transcript(args.transcript), args.speed)
+    print(simulator.start(), flush=True)
+    try:
+        simulator.wait()
+        time.sleep(args.linger)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator.close()
+
+    if simulator.error:
+        logging.critical(str(simulator.error))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[Device-Simulator] %(asctime)s: %(message)s.",
+        datefmt="%H:%M:%S",
+    )
+    _main()
@@ -0,0 +1,519 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2021 ARM Limited. All rights reserved.
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import sys
+import argparse
+import hashlib
+import logging
+import shutil
+import struct
+import tempfile
+import subprocess
+from atomic_write import write_file_atomically
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+CACHE_DIR = os.path.join(ROOT, ".cache", "elf_archive")
+# Bumped whenever the output of localize() changes for the same input,
+# so that stale cache entries are not reused.
+LOCALIZER_VERSION = 1
+
+AR_MAGIC = b"!<arch>\n"
+AR_HEADER_SIZE = 60
+ELF_MAGIC = b"\x7fELF"
+
+SHT_SYMTAB = 2
+SHT_RELA = 4
+SHT_REL = 9
+SHT_GROUP = 17
+SHT_SYMTAB_SHNDX = 18
+
+STB_LOCAL = 0
+SHN_UNDEF = 0
+
+SYM_SIZE = 16
+
+
+class Elf32:
+    """
+    Minimal view of an ELF32 relocatable object or executable held in a
+    bytearray
+    :param data: Content of the object, modified in place
+    """
+
+    def __init__(self, data):
+        if data[:4] != ELF_MAGIC or data[4] != 1:
+            raise Exception("Not an ELF32 object")
+        self.data = data
+        self.endian = "<" if data[5] == 1 else ">"
+        self.phoff, self.shoff = self._unpack("II", 28)
+        self.phentsize, self.phnum = self._unpack("HH", 42)
+        self.shentsize, self.shnum, self.shstrndx = self._unpack("HHH", 46)
+        if self.shnum == 0 and self.shoff:
+            raise Exception(
+                "Objects with extended section numbers are not supported"
+            )
+
+    def _unpack(self, fmt, offset):
+        return struct.unpack_from(self.endian + fmt, self.data, offset)
+
+    def _pack(self, fmt, offset, *values):
+        struct.pack_into(self.endian + fmt, self.data, offset, *values)
+
+    def sections(self):
+        """
+        :return: List of section headers as dictionaries
+        """
+        sections = []
+        for i in range(self.shnum):
+            offset = self.shoff + i * self.shentsize
+            fields = self._unpack("IIIIIIIIII", offset)
+            sections.append(
+                {
+                    "index": i,
+                    "header": offset,
+                    "name": fields[0],
+                    "type": fields[1],
+                    "flags": fields[2],
+                    "addr": fields[3],
+                    "offset": fields[4],
+                    "size": fields[5],
+                    "link": fields[6],
+                    "info": fields[7],
+                    "entsize": fields[9],
+                }
+            )
+        return sections
+
+    def segments(self):
+        """
+        :return: List of program headers as dictionaries
+        """
+        segments = []
+        for i in range(self.phnum):
+            offset = self.phoff + i * self.phentsize
+            fields = self._unpack("IIIIIIII", offset)
+            segments.append(
+                {
+                    "type": fields[0],
+                    "vaddr": fields[2],
+                    "paddr": fields[3],
+                    "filesz": fields[4],
+                    "memsz": fields[5],
+                }
+            )
+        return segments
+
+    def set_section_info(self, section, info):
+        """
+        Change the sh_info field of a section
+        """
+        self._pack("I", section["header"] + 28, info)
+        section["info"] = info
+
+    def string(self, section, offset):
+        """
+        Read a NUL terminated string from a string table section
+        """
+        start = section["offset"] + offset
+        end = self.data.index(b"\0", start)
+        return self.data[start:end].decode("utf-8", "replace")
+
+    def symbols(self, symtab, strtab):
+        """
+        :return: List of (name, binding, type, section index, value, size)
+        """
+        symbols = []
+        for i in range(symtab["size"] // SYM_SIZE):
+            name, value, size, info, __, shndx = self._unpack(
+                "IIIBBH", symtab["offset"] + i * SYM_SIZE
+            )
+            symbols.append(
+                (
+                    self.string(strtab, name),
+                    info >> 4,
+                    info & 0xF,
+                    shndx,
+                    value,
+                    size,
+                )
+            )
+        return symbols
+
+
+def localize_object(data, names):
+    """
+    Make the given global symbols of an ELF32 object local.
+
+    Local symbols must come first in the symbol table, so the table is
+    reordered and the symbol indices used by relocations, section groups
+    and the extended section index table are updated. The size of the
+    object does not change.
+
+    :param data: bytearray with the object, modified in place
+    :param names: Set of symbol names
+    :return: List of the names localized
+    """
+    elf = Elf32(data)
+    sections = elf.sections()
+    symtabs = [s for s in sections if s["type"] == SHT_SYMTAB]
+    if not symtabs:
+        return []
+    symtab = symtabs[0]
+    strtab = sections[symtab["link"]]
+    symbols = elf.symbols(symtab, strtab)
+
+    localized = []
+    locals_ = []
+    globals_ = []
+    for i, (name, binding, __, shndx, ___, ____) in enumerate(symbols):
+        if binding == STB_LOCAL:
+            locals_.append(i)
+        elif name in names and shndx != SHN_UNDEF:
+            localized.append(i)
+        else:
+            globals_.append(i)
+
+    if not localized:
+        return []
+
+    order = locals_ + localized + globals_
+    new_index = {old: new for new, old in enumerate(order)}
+
+    def _permute(section, entry_size):
+        start = section["offset"]
+        old = bytes(data[start : start + section["size"]])
+        for new, i in enumerate(order):
+            dst = start + new * entry_size
+            data[dst : dst + entry_size] = old[i * entry_size :][:entry_size]
+
+    _permute(symtab, SYM_SIZE)
+    for i in range(len(locals_), len(locals_) + len(localized)):
+        offset = symtab["offset"] + i * SYM_SIZE + 12
+        (info,) = elf._unpack("B", offset)
+        elf._pack("B", offset, (STB_LOCAL << 4) | (info & 0xF))
+    elf.set_section_info(symtab, len(locals_) + len(localized))
+
+    for section in sections:
+        if section["link"] != symtab["index"]:
+            continue
+        if section["type"] in (SHT_REL, SHT_RELA):
+            entry_size = section["entsize"] or (
+                8 if section["type"] == SHT_REL else 12
+            )
+            for offset in range(
+                section["offset"],
+                section["offset"] + section["size"],
+                entry_size,
+            ):
+                (info,) = elf._unpack("I", offset + 4)
+                elf._pack(
+                    "I",
+                    offset + 4,
+                    (new_index[info >> 8] << 8) | (info & 0xFF),
+                )
+        elif section["type"] == SHT_GROUP:
+            elf.set_section_info(section, new_index[section["info"]])
+
+    for section in sections:
+        if (
+            section["type"] == SHT_SYMTAB_SHNDX
+            and section["link"] == symtab["index"]
+        ):
+            _permute(section, 4)
+
+    return [symbols[i][0] for i in localized]
+
+
+def _parse_archive(data):
+    """
+    Split an ar archive into its members
+    :param data: Content of the archive
+    :return: List of [header, name, content]
+    """
+    members = []
+    offset = len(AR_MAGIC)
+    while offset < len(data):
+        header = bytearray(data[offset : offset + AR_HEADER_SIZE])
+        if len(header) < AR_HEADER_SIZE or header[58:60] != b"`\n":
+            raise Exception("Malformed archive member at offset %d" % offset)
+        size = int(header[48:58].decode("ascii"))
+        name = header[0:16].decode("ascii").rstrip()
+        start = offset + AR_HEADER_SIZE
+        members.append([header, name, bytearray(data[start : start + size])])
+        offset = start + size + (size % 2)
+    return members
+
+
+def _member_name(name, long_names):
+    """
+    Resolve the name of an archive member
+    :param name: Name field of the member header
+    :param long_names: Content of the "//" member
+    """
+    if name.startswith("/") and name[1:].isdigit():
+        start = int(name[1:])
+        end = long_names.index(b"/\n", start)
+        return long_names[start:end].decode("utf-8", "replace")
+    return name.rstrip("/")
+
+
+def localize(data, names):
+    """
+    Make the given global symbols local in an ar archive of ELF32 objects,
+    or in a single ELF32 object
+
+    :param data: Content of the archive or object
+    :param names: Symbol names
+    :return: tuple (new content, list of (member, symbol) localized)
+    """
+    names = set(names)
+    if data[:4] == ELF_MAGIC:
+        obj = bytearray(data)
+        return bytes(obj), [("", n) for n in localize_object(obj, names)]
+
+    if data[: len(AR_MAGIC)] != AR_MAGIC:
+        raise Exception("Not an ar archive or ELF object")
+
+    members = _parse_archive(data)
+    long_names = b""
+    for __, name, content in members:
+        if name == "//":
+            long_names = bytes(content)
+
+    localized = []
+    # Index of the members whose symbols were localized, by symbol name
+    removed = {}
+    for i, (__, name, content) in enumerate(members):
+        if name in ("/", "//", "/SYM64/") or content[:4] != ELF_MAGIC:
+            continue
+        for symbol in localize_object(content, names):
+            member = _member_name(name, long_names)
+            localized.append((member, symbol))
+            removed.setdefault(symbol, set()).add(i)
+
+    # The archive index lists the global symbols and the offset of the
+    # member defining them. Drop the symbols which are now local and
+    # recompute the offsets, which move with the size of the index.
+    old_offsets = []
+    offset = len(AR_MAGIC)
+    for __, ___, content in members:
+        old_offsets.append(offset)
+        offset += AR_HEADER_SIZE + len(content) + (len(content) % 2)
+    member_at = {o: i for i, o in enumerate(old_offsets)}
+
+    if members and members[0][1] == "/":
+        content = members[0][2]
+        (count,) = struct.unpack_from(">I", content, 0)
+        names_start = 4 + 4 * count
+        strings = bytes(content[names_start:]).split(b"\0")
+        entries = []
+        for n in range(count):
+            (member_offset,) = struct.unpack_from(">I", content, 4 + 4 * n)
+            symbol = strings[n].decode("utf-8", "replace")
+            index = member_at[member_offset]
+            if index not in removed.get(symbol, ()):
+                entries.append((index, strings[n]))
+
+        table_size = (
+            4 + 4 * len(entries) + sum(len(s) + 1 for __, s in entries)
+        )
+        shift = (table_size + table_size % 2) - (
+            len(content) + len(content) % 2
+        )
+        table = bytearray(struct.pack(">I", len(entries)))
+        for index, __ in entries:
+            table += struct.pack(">I", old_offsets[index] + shift)
+        for __, symbol in entries:
+            table += symbol + b"\0"
+        members[0][2] = table
+
+    out = bytearray(AR_MAGIC)
+    for header, __, content in members:
+        header[48:58] = ("%-10d" % len(content)).encode("ascii")
+        out += header + content
+        if len(content) % 2:
+            out += b"\n"
+
+    return bytes(out), localized
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def localize_file(src, dst, names, cache_dir=CACHE_DIR):
+    """
+    Write a copy of an archive or object with the given symbols localized.
+    The result is cached by input content, and dst is only rewritten when
+    its content changes.
+
+    :param src: Input archive or object
+    :param dst: Output path, may be the same as src
+    :param names: Symbol names
+    :param cache_dir: Cache directory, None to disable the cache
+    :return: True if dst was written
+    """
+    with open(src, "rb") as f:
+        data = f.read()
+
+    key = _sha256(
+        "\0".join(
+            [str(LOCALIZER_VERSION), _sha256(data)] + sorted(names)
+        ).encode("utf-8")
+    )
+    cached = os.path.join(cache_dir, key) if cache_dir else None
+    if cached and os.path.isfile(cached):
+        with open(cached, "rb") as f:
+            output = f.read()
+    else:
+        output, localized = localize(data, names)
+        for member, symbol in localized:
+            logging.info(
+                "Localized %s in %s", symbol, member or os.path.basename(src)
+            )
+        if cached:
+            write_file_atomically(cached, output)
+
+    return write_file_atomically(dst, output)
+
+
+def symbol_bindings(data):
+    """
+    List the symbols of an archive or object, to compare two of them
+    independently of the layout of their symbol tables
+
+    :param data: Content of the archive or object
+    :return: Set of (member, name, binding, type, value, size)
+    """
+    if data[:4] == ELF_MAGIC:
+        objects = [("", bytearray(data))]
+    else:
+        members = _parse_archive(data)
+        long_names = b""
+        for __, name, content in members:
+            if name == "//":
+                long_names = bytes(content)
+        objects = [
+            (_member_name(name, long_names), content)
+            for __, name, content in members
+            if content[:4] == ELF_MAGIC
+        ]
+
+    bindings = set()
+    for member, content in objects:
+        elf = Elf32(content)
+        sections = elf.sections()
+        for symtab in [s for s in sections if s["type"] == SHT_SYMTAB]:
+            for name, binding, typ, __, value, size in elf.symbols(
+                symtab, sections[symtab["link"]]
+            ):
+                bindings.add((member, name, binding, typ, value, size))
+    return bindings
+
+
+def verify_with_fromelf(src, output, names):
+    """
+    Compare the symbols of our output with the ones of fromelf --localize
+    :param src: Input archive or object
+    :param output: Content produced by localize()
+    :param names: Symbol names
+    :return: True if both agree
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        expected_path = os.path.join(tmp_dir, os.path.basename(src))
+        cmd = ["fromelf", "--elf"]
+        for name in names:
+            cmd.extend(["--localize", name])
+        cmd.extend([src, "-o", expected_path])
+        subprocess.check_call(cmd)
+        with open(expected_path, "rb") as f:
+            expected = symbol_bindings(f.read())
+
+    actual = symbol_bindings(output)
+    for symbol in sorted(expected - actual):
+        logging.info("Only in fromelf output: %s", symbol)
+    for symbol in sorted(actual - expected):
+        logging.info("Only in our output: %s", symbol)
+    return expected == actual
+
+
+def _get_parser():
+    parser = argparse.ArgumentParser(
+        description="Make global symbols of an ar archive or ELF32 object "
+        "local"
+    )
+    parser.add_argument("input", help="Archive or object file")
+    parser.add_argument(
+        "-o", "--output", help="Output file (default: in place)", default=None
+    )
+    parser.add_argument(
+        "-s",
+        "--symbol",
+        help="Symbol to localize, can be repeated",
+        action="append",
+        required=True,
+    )
+    parser.add_argument(
+        "--no-cache",
+        help="Do not use or fill the cache",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--verify-with-fromelf",
+        help="Check the result against fromelf --localize",
+        action="store_true",
+    )
+    return parser
+
+
+def _main():
+    """
+    Localize symbols of an archive or object
+    """
+    args = _get_parser().parse_args()
+    output = args.output or args.input
+
+    if args.verify_with_fromelf:
+        if shutil.which("fromelf") is None:
+            logging.critical('"fromelf" is not installed')
+            sys.exit(1)
+        with open(args.input, "rb") as f:
+            result, __ = localize(f.read(), args.symbol)
+        if not verify_with_fromelf(args.input, result, args.symbol):
+            logging.critical("Output differs from fromelf")
+            sys.exit(1)
+        logging.info("Output matches fromelf")
+
+    written = localize_file(
+        args.input,
+        output,
+        args.symbol,
+        None if args.no_cache else CACHE_DIR,
+    )
+    logging.info("%s %s", output, "written" if written else "unchanged")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[ELF-Archive] %(asctime)s: %(message)s.",
+        datefmt="%H:%M:%S",
+    )
+    _main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2021 ARM Limited. All rights reserved.
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import atexit
+import contextlib
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+
+TEXT_FORMAT = "[%s] %%(asctime)s: %%(message)s."
+DATE_FORMAT = "%H:%M:%S"
+
+# Fields added to the events of the current thread, e.g. step and target
+_CONTEXT = threading.local()
+
+_LOCK = threading.Lock()
+# Thread writing the log records, and the handlers it writes them to
+_LISTENER = None
+_TEXT_FORMATTER = None
+_JSON_PATHS = set()
+
+
+def get_context():
+    """
+    :return: dict of the fields added to the events of the current thread
+    """
+    return getattr(_CONTEXT, "fields", {})
+
+
+@contextlib.contextmanager
+def event_context(**fields):
+    """
+    Add fields, e.g. the step, target and suite, to the events logged by
+    the current thread, so concurrent builds can be told apart
+    """
+    saved = get_context()
+    _CONTEXT.fields = dict(saved, **fields)
+    try:
+        yield
+    finally:
+        _CONTEXT.fields = saved
+
+
+def log_event(event, msg, *args, level=logging.INFO, **fields):
+    """
+    Log an event. The message is only formatted if the level is enabled,
+    and then on the logging thread.
+
+    :param event: Name of the event, e.g. "copy"
+    :param msg: Message format string
+    :param args: Arguments of the format string
+    :param level: Logging level
+    :param fields: Values recorded as is by the JSON lines sink
+    """
+    logger = logging.getLogger()
+    if logger.isEnabledFor(level):
+        logger.log(level, msg, *args, extra={"event": event, "fields": fields})
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue records for the logging thread without formatting them, only
+    the context of the calling thread is captured
+    """
+
+    def prepare(self, record):
+        record.context = get_context()
+        return record
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Format a record as one JSON object with its event name, context and
+    fields
+    """
+
+    def format(self, record):
+        event = {
+            "time": round(record.created, 3),
+            "level": record.levelname,
+            "event": getattr(record, "event", "log"),
+            "message": record.getMessage(),
+        }
+        event.update(getattr(record, "context", {}))
+        event.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            event["exception"] = self.formatException(record.exc_info)
+        return json.dumps(event, default=str)
+
+
+def get_text_formatter():
+    """
+    :return: Formatter of the log lines written to stderr
+    """
+    return _TEXT_FORMATTER
+
+
+def configure(name, verbose=False, json_path=None):
+    """
+    Write the log records to stderr from a background thread, so logging
+    never blocks the calling thread on I/O. The first call sets up the
+    logging thread, later ones only change the level and add sinks, e.g.
+    once the command line is parsed.
+
+    :param name: Name of the script, put in front of every line
+    :param verbose: Log debug messages too
+    :param json_path: Also append the records to this file as JSON lines
+    """
+    global _LISTENER, _TEXT_FORMATTER
+
+    root = logging.getLogger()
+    root.setLevel(logging.DEBUG if verbose else logging.INFO)
+
+    with _LOCK:
+        if _LISTENER is None:
+            if root.handlers:
+                # Logging was set up by the script importing this one
+                return
+            _TEXT_FORMATTER = logging.Formatter(
+                TEXT_FORMAT % name, DATE_FORMAT
+            )
+            stream = logging.StreamHandler()
+            stream.setFormatter(_TEXT_FORMATTER)
+            records = queue.SimpleQueue()
+            root.addHandler(_QueueHandler(records))
+            _LISTENER = logging.handlers.QueueListener(records, stream)
+            _LISTENER.start()
+            # Write the queued records before the process exits
+            atexit.register(_LISTENER.stop)
+
+        if json_path and os.path.abspath(json_path) not in _JSON_PATHS:
+            _JSON_PATHS.add(os.path.abspath(json_path))
+            # Appended to, so the scripts a run starts can share the file
+            sink = logging.FileHandler(json_path, mode="a", encoding="utf-8")
+            sink.setFormatter(JsonLinesFormatter())
+            _LISTENER.stop()
+            _LISTENER.handlers += (sink,)
+            _LISTENER.start()
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2021 ARM Limited. All rights reserved.
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import argparse
+import errno
+import logging
+import select
+import struct
+import time
+
+try:
+    import ctypes
+    import ctypes.util
+
+    _libc = ctypes.CDLL(
+        ctypes.util.find_library("c") or "libc.so.6", use_errno=True
+    )
+    _libc.inotify_init1
+except (ImportError, OSError, AttributeError):
+    # Not Linux, changes are found by polling
+    _libc = None
+
+# Quiet period after the last change before the changes are reported
+DEFAULT_DEBOUNCE = 0.5
+# Changes are reported after this long even if files keep changing
+MAX_DELAY = 10
+# Interval between two scans when polling
+POLL_INTERVAL = 1.0
+
+# Directories never watched: build trees and version control
+IGNORED_DIRS = (".git", "__pycache__", "cmake_build", "BUILD")
+# Temporary files of editors
+IGNORED_SUFFIXES = ("~", ".swp", ".swx", ".tmp")
+IGNORED_PREFIXES = (".#",)
+
+# inotify(7)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+)
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def is_ignored(name):
+    """
+    :param name: File or directory name
+    :return: True if changes to it never matter to a build
+    """
+    return (
+        name in IGNORED_DIRS
+        or name.startswith("cmake_build")
+        or name.endswith(IGNORED_SUFFIXES)
+        or name.startswith(IGNORED_PREFIXES)
+    )
+
+
+class FileWatcher:
+    """
+    Report the files changed under a set of paths, with inotify on Linux
+    and by polling their modification times elsewhere, or when there are
+    more directories than inotify may watch
+
+    :param root: Directory the watched and reported paths are relative to
+    :param paths: Files and directories to watch, directories recursively
+    :param excluded: Paths whose changes are not reported, e.g. the outputs
+                     of the build
+    """
+
+    def __init__(self, root, paths, excluded=()):
+        self.root = root
+        self.paths = sorted({os.path.normpath(p) for p in paths})
+        self.excluded = [os.path.normpath(p) for p in excluded]
+        self.fd = None
+        # Watch descriptor to the directory it watches, relative to root
+        self.dirs = {}
+        self.snapshot = None
+
+        if _libc:
+            self.fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if self.fd < 0:
+                self.fd = None
+        if self.fd is not None:
+            try:
+                for path in self.paths:
+                    self._add_watches(path)
+            except OSError as e:
+                logging.warning(
+                    "Unable to watch with inotify (%s), polling instead", e
+                )
+                self.close()
+        if self.fd is None:
+            self.snapshot = self._scan()
+
+    def _is_reported(self, path):
+        """
+        :param path: Path relative to root
+        :return: True if the path is watched and not excluded
+        """
+        if any(is_ignored(part) for part in path.split(os.sep)):
+            return False
+        for excluded in self.excluded:
+            if path == excluded or path.startswith(excluded + os.sep):
+                return False
+        return any(
+            path == watched or path.startswith(watched + os.sep)
+            for watched in self.paths
+        )
+
+    def _walk(self, path):
+        """
+        :param path: Directory relative to root
+        :return: Generator of (directory, names of its files) for the
+                 directories under it which are watched, including itself,
+                 relative to root
+        """
+        for dirpath, dirnames, files in os.walk(os.path.join(self.root, path)):
+            dirnames[:] = [d for d in dirnames if not is_ignored(d)]
+            yield os.path.relpath(dirpath, self.root), files
+
+    def _add_watch(self, directory):
+        wd = _libc.inotify_add_watch(
+            self.fd,
+            os.fsencode(os.path.join(self.root, directory)),
+            WATCH_MASK,
+        )
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                return
+            raise OSError(error, os.strerror(error), directory)
+        self.dirs[wd] = directory
+
+    def _add_watches(self, path):
+        """
+        Watch a path: the directory containing a file, every directory
+        under a directory
+        :param path: Path relative to root
+        """
+        if os.path.isdir(os.path.join(self.root, path)):
+            for directory, __ in self._walk(path):
+                self._add_watch(directory)
+        else:
+            self._add_watch(os.path.dirname(path) or os.curdir)
+
+    def _scan(self):
+        """
+        :return: dict of every watched file to its modification time and
+                 size
+        """
+        snapshot = {}
+        for path in self.paths:
+            full_path = os.path.join(self.root, path)
+            files = [full_path]
+            if os.path.isdir(full_path):
+                files = []
+                for dirpath, dirnames, filenames in os.walk(full_path):
+                    dirnames[:] = [d for d in dirnames if not is_ignored(d)]
+                    files.extend(os.path.join(dirpath, f) for f in filenames)
+            for f in files:
+                try:
+                    st = os.stat(f)
+                except OSError:
+                    continue
+                snapshot[os.path.relpath(f, self.root)] = (
+                    st.st_mtime_ns,
+                    st.st_size,
+                )
+        return snapshot
+
+    def _scan_changes(self):
+        """
+        :return: Set of the paths changed since the previous scan, relative
+                 to root
+        """
+        snapshot = self._scan()
+        changed = {
+            path
+            for path in set(snapshot) | set(self.snapshot)
+            if snapshot.get(path) != self.snapshot.get(path)
+        }
+        self.snapshot = snapshot
+        return {p for p in changed if self._is_reported(p)}
+
+    def _read_events(self, timeout):
+        """
+        :param timeout: Seconds to wait for a change, None to wait forever
+        :return: Set of the changed paths, relative to root, empty if none
+                 changed before the timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None
+            if deadline is not None:
+                remaining = max(0, deadline - time.monotonic())
+
+            if self.fd is None:
+                changed = self._scan_changes()
+                if changed:
+                    return changed
+                if remaining == 0:
+                    return changed
+                time.sleep(min(POLL_INTERVAL, remaining or POLL_INTERVAL))
+                continue
+
+            readable, __, __ = select.select([self.fd], [], [], remaining)
+            if readable:
+                changed = self._read_inotify()
+                if changed:
+                    return changed
+            elif remaining is not None:
+                return set()
+
+    def _read_inotify(self):
+        """
+        :return: Set of the changed paths of the pending inotify events,
+                 relative to root
+        """
+        changed = set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, __, length = EVENT_HEADER.unpack_from(data, offset)
+            start = offset + EVENT_HEADER.size
+            offset = start + length
+            name = data[start:offset].rstrip(b"\0")
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, everything may have changed
+                changed.update(self.paths)
+                continue
+            directory = self.dirs.get(wd)
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+                continue
+            if directory is None or not name:
+                continue
+
+            path = os.path.normpath(os.path.join(directory, os.fsdecode(name)))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and not is_ignored(
+                    os.path.basename(path)
+                ):
+                    try:
+                        self._add_watches(path)
+                    except OSError as e:
+                        logging.warning(
+                            "Unable to watch %s (%s), polling instead", path, e
+                        )
+                        self.close()
+                        self.snapshot = self._scan()
+                        return set(self.paths)
+                    # Files written before the watch was added are missed
+                    for new_dir, files in self._walk(path):
+                        changed.update(os.path.join(new_dir, f) for f in files)
+                continue
+            changed.add(path)
+
+        return {p for p in changed if self._is_reported(p)}
+
+    def wait(self, debounce=DEFAULT_DEBOUNCE, timeout=None):
+        """
+        Wait for changes, and for files to stop changing: the changes made
+        in quick succession, e.g. by a checkout or an editor saving several
+        files, are reported together
+        :param debounce: Seconds without change after the last change
+        :param timeout: Seconds to wait for a first change, None to wait
+                        forever
+        :return: Set of the changed paths, relative to root, empty after
+                 the timeout
+        """
+        changed = self._read_events(timeout)
+        if not changed:
+            return changed
+
+        deadline = time.monotonic() + MAX_DELAY
+        while True:
+            quiet = min(debounce, deadline - time.monotonic())
+            if quiet <= 0:
+                break
+            more = self._read_events(quiet)
+            if not more:
+                break
+            changed |= more
+        return changed
+
+    def close(self):
+        """
+        Stop watching
+        """
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+            self.dirs = {}
+
+
+def _get_parser():
+    parser = argparse.ArgumentParser(
+        description="Print the files changed under a set of paths"
+    )
+    parser.add_argument("paths", help="Files and directories", nargs="+")
+    parser.add_argument(
+        "--debounce",
+        help="Seconds without change before reporting the changes "
+        "(default: %.1f)" % DEFAULT_DEBOUNCE,
+        type=float,
+        default=DEFAULT_DEBOUNCE,
+    )
+    parser.add_argument(
+        "--poll",
+        help="Poll the modification times instead of using inotify",
+        action="store_true",
+    )
+    return parser
+
+
+def _main():
+    """
+    Print the changes under the given paths until interrupted
+    """
+    global _libc
+    args = _get_parser().parse_args()
+    if args.poll:
+        _libc = None
+
+    watcher = FileWatcher(os.getcwd(), args.paths)
+    logging.info(
+        "Watching %s with %s",
+        ", ".join(watcher.paths),
+        "polling" if watcher.fd is None else "inotify",
+    )
+    try:
+        while True:
+            changed = watcher.wait(args.debounce)
+            logging.info("Changed: %s", ", ".join(sorted(changed)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[File-Watch] %(asctime)s: %(message)s.",
+        datefmt="%H:%M:%S",
+    )
+    _main()
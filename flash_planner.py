@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2021 ARM Limited. All rights reserved.
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import sys
+import argparse
+import hashlib
+import json
+import logging
+import uuid
+from atomic_write import write_file_atomically
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+
+# Sectors last flashed to each board, and the delta images
+STATE_DIR = os.path.join(ROOT, ".cache", "flash_state")
+
+# Identifies the states recorded by this process. Anything else may have
+# flashed a board since another process recorded it: Greentea, a manual
+# drag-n-drop or another checkout.
+SESSION = uuid.uuid4().hex
+
+# Granularity in bytes at which each target's DAPLink programs a partial
+# image, None if programming always erases the whole flash.
+PROGRAM_GRANULARITY = {
+    # Flashing is 64K-aligned for compatibility with QSPI, see
+    # _erase_flash_storage() in test_psa_target.py
+    "ARM_MUSCA_S1": 0x10000,
+    # Not verified on hardware that DAPLink programs a partial image
+    # without erasing the whole eFlash
+    "ARM_MUSCA_B1": None,
+    # Drag-n-drop flashing invokes a mass erase
+    "NU_M2354": None,
+}
+
+HEX_DATA = 0x00
+HEX_EOF = 0x01
+HEX_EXTENDED_SEGMENT_ADDRESS = 0x02
+HEX_EXTENDED_LINEAR_ADDRESS = 0x04
+HEX_RECORD_SIZE = 16
+# Value of erased flash, used for the bytes of a sector no image covers
+ERASED = 0xFF
+
+
+def read_hex(path):
+    """
+    Read the data of an Intel HEX file
+    :param path: Path of the HEX file
+    :return: List of (address, bytes) of the contiguous data, sorted by
+             address
+    """
+    segments = []
+    base = 0
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            if not line.startswith(":"):
+                raise ValueError("%s:%d is not a HEX record" % (path, number))
+
+            record = bytes.fromhex(line[1:])
+            if sum(record) & 0xFF or len(record) != record[0] + 5:
+                raise ValueError("%s:%d is corrupted" % (path, number))
+
+            rtype = record[3]
+            data = record[4:-1]
+            if rtype == HEX_DATA:
+                address = base + (record[1] << 8 | record[2])
+                end = segments[-1][0] + len(segments[-1][1]) if segments else 0
+                if segments and end == address:
+                    segments[-1][1].extend(data)
+                else:
+                    segments.append((address, bytearray(data)))
+            elif rtype == HEX_EXTENDED_LINEAR_ADDRESS:
+                base = int.from_bytes(data, "big") << 16
+            elif rtype == HEX_EXTENDED_SEGMENT_ADDRESS:
+                base = int.from_bytes(data, "big") << 4
+            elif rtype == HEX_EOF:
+                break
+
+    return sorted(segments)
+
+
+def _hex_record(rtype, address, data):
+    """
+    :param rtype: Record type
+    :param address: 16 bits address field
+    :param data: Record data
+    :return: Intel HEX record line
+    """
+    record = bytes([len(data), address >> 8, address & 0xFF, rtype]) + data
+    checksum = -sum(record) & 0xFF
+    return ":%s%02X\n" % (record.hex().upper(), checksum)
+
+
+def write_hex(path, segments):
+    """
+    Write data to an Intel HEX file
+    :param path: Path of the HEX file
+    :param segments: List of (address, bytes)
+    """
+    lines = []
+    upper = None
+    for address, data in sorted(segments):
+        offset = 0
+        while offset < len(data):
+            current = address + offset
+            if current >> 16 != upper:
+                upper = current >> 16
+                lines.append(
+                    _hex_record(
+                        HEX_EXTENDED_LINEAR_ADDRESS,
+                        0,
+                        upper.to_bytes(2, "big"),
+                    )
+                )
+            # Records do not cross a 64K boundary
+            size = min(
+                HEX_RECORD_SIZE,
+                len(data) - offset,
+                0x10000 - (current & 0xFFFF),
+            )
+            chunk = bytes(data[offset : offset + size])
+            lines.append(_hex_record(HEX_DATA, current & 0xFFFF, chunk))
+            offset += size
+    lines.append(_hex_record(HEX_EOF, 0, b""))
+    write_file_atomically(path, "".join(lines))
+
+
+def get_sectors(segments, sector_size):
+    """
+    Split image data into the sectors it covers
+    :param segments: List of (address, bytes)
+    :param sector_size: Sector size in bytes
+    :return: dict of sector address to its content, bytes not covered by
+             the image are erased
+    """
+    sectors = {}
+    for address, data in segments:
+        offset = 0
+        while offset < len(data):
+            current = address + offset
+            base = current - current % sector_size
+            size = min(len(data) - offset, base + sector_size - current)
+            if base not in sectors:
+                sectors[base] = bytearray([ERASED]) * sector_size
+            start = current - base
+            sectors[base][start : start + size] = data[offset : offset + size]
+            offset += size
+    return sectors
+
+
+class FlashPlanner:
+    """
+    Keep track of what was flashed to each board to program only the
+    sectors an image changes
+
+    :param state_dir: Directory of the state of the boards
+    """
+
+    def __init__(self, state_dir=STATE_DIR):
+        self.state_dir = state_dir
+
+    def _state_path(self, board_id):
+        return os.path.join(self.state_dir, board_id + ".json")
+
+    def _load_state(self, board_id):
+        try:
+            with open(self._state_path(board_id)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    @staticmethod
+    def _digests(sectors):
+        return {
+            "%08x" % base: hashlib.sha256(data).hexdigest()
+            for base, data in sectors.items()
+        }
+
+    def plan(self, board_id, target, image, trust=False):
+        """
+        Compare an image with the last one flashed to a board by this
+        process, the whole image is flashed if another process may have
+        flashed the board since. Sectors the image erases entirely are
+        always reprogrammed.
+
+        :param board_id: DAPLink unique ID of the board
+        :param target: Target name
+        :param image: Path of the HEX image
+        :param trust: If True also use a state recorded by another process,
+                      the caller knows nothing else flashed the board since
+        :return: dict with the mode ("full", "delta" or "skip"), the image
+                 to flash (None to skip flashing) and the number of changed
+                 and total sectors
+        """
+        granularity = PROGRAM_GRANULARITY.get(target)
+        plan = {"mode": "full", "image": image, "changed": None, "total": None}
+        if not granularity:
+            return plan
+
+        sectors = get_sectors(read_hex(image), granularity)
+        digests = self._digests(sectors)
+        plan["total"] = len(sectors)
+        state = self._load_state(board_id)
+        if (
+            not state
+            or (not trust and state.get("session") != SESSION)
+            or state["target"] != target
+            or state["granularity"] != granularity
+        ):
+            plan["changed"] = len(sectors)
+            return plan
+
+        erased = bytes([ERASED]) * granularity
+        changed = sorted(
+            base
+            for base in sectors
+            if state["sectors"].get("%08x" % base) != digests["%08x" % base]
+            # Erased ranges reset the storage the tests write to, so they
+            # are programmed every time
+            or sectors[base] == erased
+        )
+        plan["changed"] = len(changed)
+        if not changed:
+            plan.update({"mode": "skip", "image": None})
+            return plan
+        if len(changed) == len(sectors):
+            return plan
+
+        delta = os.path.join(self.state_dir, board_id + "-delta.hex")
+        write_hex(delta, [(base, sectors[base]) for base in changed])
+        plan.update({"mode": "delta", "image": delta})
+        return plan
+
+    def forget(self, board_id):
+        """
+        Forget what is on a board, e.g. before flashing it, as it is
+        unknown if flashing fails
+        :param board_id: DAPLink unique ID of the board
+        """
+        try:
+            os.unlink(self._state_path(board_id))
+        except FileNotFoundError:
+            pass
+
+    def forget_target(self, target):
+        """
+        Forget what is on every board of a target, before flashing them by
+        other means, e.g. with Greentea
+        :param target: Target name
+        """
+        try:
+            names = os.listdir(self.state_dir)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            board_id = os.path.splitext(name)[0]
+            state = self._load_state(board_id)
+            if state is None or state.get("target") == target:
+                self.forget(board_id)
+
+    def record(self, board_id, target, image):
+        """
+        Record an image as flashed to a board
+        :param board_id: DAPLink unique ID of the board
+        :param target: Target name
+        :param image: Path of the full HEX image
+        """
+        granularity = PROGRAM_GRANULARITY.get(target)
+        if not granularity:
+            return
+
+        sectors = get_sectors(read_hex(image), granularity)
+        state = {
+            "target": target,
+            "session": SESSION,
+            "granularity": granularity,
+            "image": os.path.abspath(image),
+            "sectors": self._digests(sectors),
+        }
+        write_file_atomically(
+            self._state_path(board_id),
+            json.dumps(state, indent=2, sort_keys=True),
+        )
+
+
+def _get_parser():
+    parser = argparse.ArgumentParser(
+        description="Flash only the sectors an image changes"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    for name, description in [
+        ("plan", "Compare an image with the last one flashed to a board"),
+        ("flash", "Flash the sectors of an image which changed"),
+    ]:
+        command = subparsers.add_parser(name, help=description)
+        command.add_argument("image", help="HEX image")
+        command.add_argument(
+            "-m",
+            "--mcu",
+            help="Target name",
+            required=True,
+            choices=sorted(PROGRAM_GRANULARITY),
+        )
+        command.add_argument(
+            "-d", "--mount", help="DAPLink mount point", required=True
+        )
+        command.add_argument(
+            "--trust",
+            help="Compare with what another process, e.g. a previous "
+            "flash_planner.py flash, recorded. Without it, the whole image "
+            "is always flashed, as the board may have been flashed since.",
+            action="store_true",
+        )
+        command.add_argument(
+            "--state-dir",
+            help="State directory (default: %s)" % STATE_DIR,
+            default=STATE_DIR,
+        )
+
+    subparsers.choices["flash"].add_argument(
+        "--full", help="Flash the whole image", action="store_true"
+    )
+    subparsers.choices["flash"].add_argument(
+        "--no-wait",
+        help="Do not wait for DAPLink to remount, e.g. for a test directory",
+        action="store_true",
+    )
+    return parser
+
+
+def _main():
+    """
+    Plan or flash an image
+    """
+    # Only needed on the command line, it needs termios which Windows lacks
+    import host_runner
+
+    args = _get_parser().parse_args()
+    board_id = host_runner.read_board_id(args.mount)
+    if not board_id:
+        logging.critical("%s is not a DAPLink drive", args.mount)
+        sys.exit(1)
+
+    planner = FlashPlanner(args.state_dir)
+    if args.command == "flash" and args.full:
+        planner.forget(board_id)
+    plan = planner.plan(board_id, args.mcu, args.image, args.trust)
+    if plan["total"] is None:
+        logging.info("%s cannot be partially programmed", args.mcu)
+    else:
+        logging.info(
+            "%s: %s, %d of %d sectors changed",
+            board_id,
+            plan["mode"],
+            plan["changed"],
+            plan["total"],
+        )
+    if args.command == "plan":
+        return
+
+    planner.forget(board_id)
+    if plan["image"]:
+        try:
+            host_runner.flash(plan["image"], args.mount, wait=not args.no_wait)
+        except Exception as e:
+            logging.critical(str(e))
+            sys.exit(1)
+    planner.record(board_id, args.mcu, args.image)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[Flash-Planner] %(asctime)s: %(message)s.",
+        datefmt="%H:%M:%S",
+    )
+    _main()
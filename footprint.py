@@ -0,0 +1,831 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2021 ARM Limited. All rights reserved.
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import sys
+import argparse
+import json
+import logging
+import operator
+import re
+from psa_builder import BUILD_REPORTS_DIR
+from elf_archive import Elf32
+
+REPORT_NAME = "footprint"
+
+# Memory regions of each image, as the (start, size) macros of
+# region_defs.h
+REGIONS = {
+    "secure": {
+        "flash": ("S_CODE_START", "S_CODE_SIZE"),
+        "ram": ("S_DATA_START", "S_DATA_SIZE"),
+    },
+    "non-secure": {
+        "flash": ("NS_CODE_START", "NS_CODE_SIZE"),
+        "ram": ("NS_DATA_START", "NS_DATA_SIZE"),
+    },
+    "bl2": {
+        "flash": ("BL2_CODE_START", "BL2_CODE_SIZE"),
+        "ram": ("BL2_DATA_START", "BL2_DATA_SIZE"),
+    },
+}
+# Usage of a region reported as nearly full
+FULL_PERCENT = 95
+
+# Number of largest symbols recorded
+TOP_SYMBOLS = 20
+
+SHF_WRITE = 0x1
+SHF_ALLOC = 0x2
+SHT_SYMTAB = 2
+SHT_NOBITS = 8
+PT_LOAD = 1
+SYMBOL_KINDS = {1: "object", 2: "func"}
+
+# Linker defined bounds of the execution regions, e.g.
+# Image$$TFM_SP_CRYPTO_LINKER$$RO$$Base
+IMAGE_SYMBOL = re.compile(
+    r"Image\$\$(\w+?)\$\$(?:(RO|RW|ZI)\$\$)?(Base|Limit)$"
+)
+# Secure partition of an execution region
+PARTITION = re.compile(r"(TFM_SP_\w+?)(?:_LINKER|_STACK|_DATA|_BSS)\w*$")
+
+_TOKEN = re.compile(
+    r"(?:0[xX][0-9a-fA-F]+|\d+)[uUlL]*|[A-Za-z_]\w*"
+    r"|<<|>>|<=|>=|==|!=|&&|\|\||\S"
+)
+_IDENTIFIER = re.compile(r"[A-Za-z_]\w*$")
+_DIRECTIVE = re.compile(r"\s*#\s*(\w+)\s*(.*)")
+_DEFINE = re.compile(r"(\w+)(\(([^)]*)\))?\s*(.*)")
+_INCLUDE = re.compile(r'"([^"]+)"')
+_COMMENT = re.compile(r"/\*.*?\*/|//[^\n]*", re.DOTALL)
+# Casts of the layout macros, e.g. (uint32_t)
+TYPE_NAMES = {
+    "char",
+    "short",
+    "int",
+    "long",
+    "signed",
+    "unsigned",
+    "size_t",
+    "uint8_t",
+    "uint16_t",
+    "uint32_t",
+    "uint64_t",
+    "int32_t",
+}
+
+# Binary operators of the preprocessor, by increasing precedence
+_BINARY = {
+    "||": (1, lambda a, b: int(bool(a or b))),
+    "&&": (2, lambda a, b: int(bool(a and b))),
+    "|": (3, operator.or_),
+    "^": (4, operator.xor),
+    "&": (5, operator.and_),
+    "==": (6, lambda a, b: int(a == b)),
+    "!=": (6, lambda a, b: int(a != b)),
+    "<": (7, lambda a, b: int(a < b)),
+    "<=": (7, lambda a, b: int(a <= b)),
+    ">": (7, lambda a, b: int(a > b)),
+    ">=": (7, lambda a, b: int(a >= b)),
+    "<<": (8, operator.lshift),
+    ">>": (8, operator.rshift),
+    "+": (9, operator.add),
+    "-": (9, operator.sub),
+    "*": (10, operator.mul),
+    "/": (10, lambda a, b: int(a / b)),
+    "%": (10, lambda a, b: a - b * int(a / b)),
+}
+
+
+def _tokenize(text):
+    """
+    :param text: C expression
+    :return: List of tokens, numbers are converted to int
+    """
+    tokens = []
+    for token in _TOKEN.findall(text):
+        if token[0].isdigit():
+            token = token.rstrip("uUlL")
+            if token[:2] in ("0x", "0X"):
+                token = int(token, 16)
+            elif len(token) > 1 and token[0] == "0":
+                token = int(token, 8)
+            else:
+                token = int(token)
+        tokens.append(token)
+    return tokens
+
+
+class _Parser:
+    """
+    Evaluate the integer expression of a preprocessor directive
+    :param tokens: Tokens with every macro expanded
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def parse(self):
+        value = self._ternary()
+        if self.pos != len(self.tokens):
+            raise ValueError("Unexpected %r" % self.tokens[self.pos])
+        return value
+
+    def _peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return None
+
+    def _next(self):
+        token = self._peek()
+        if token is None:
+            raise ValueError("Incomplete expression")
+        self.pos += 1
+        return token
+
+    def _ternary(self):
+        condition = self._binary(1)
+        if self._peek() != "?":
+            return condition
+        self.pos += 1
+        value = self._ternary()
+        if self._next() != ":":
+            raise ValueError("Expected :")
+        other = self._ternary()
+        return value if condition else other
+
+    def _binary(self, precedence):
+        left = self._unary()
+        while True:
+            op = self._peek()
+            if op not in _BINARY or _BINARY[op][0] < precedence:
+                return left
+            self.pos += 1
+            right = self._binary(_BINARY[op][0] + 1)
+            left = _BINARY[op][1](left, right)
+
+    def _unary(self):
+        token = self._next()
+        if isinstance(token, int):
+            return token
+        if token == "(":
+            value = self._ternary()
+            if self._next() != ")":
+                raise ValueError("Expected )")
+            return value
+        if token == "-":
+            return -self._unary()
+        if token == "+":
+            return self._unary()
+        if token == "~":
+            return ~self._unary()
+        if token == "!":
+            return int(not self._unary())
+        raise ValueError("Unexpected %r" % token)
+
+
+class Macros:
+    """
+    The macros of C headers, e.g. the memory layout of region_defs.h and
+    flash_layout.h, with enough of the preprocessor to follow their
+    conditionals, includes and function-like macros
+
+    :param defines: dict of the macros defined on the command line, e.g.
+                    {"BL2": "1"}
+    :param include_dirs: Directories searched for the included headers
+    """
+
+    def __init__(self, defines=None, include_dirs=()):
+        self.include_dirs = list(include_dirs)
+        # Name to (parameters or None, body tokens)
+        self.macros = {}
+        for name, value in (defines or {}).items():
+            self.macros[name] = (None, _tokenize(value))
+
+    def read(self, path):
+        """
+        Define the macros of a header and of the headers it includes
+        :param path: Path of the header
+        """
+        with open(path, encoding="utf-8", errors="replace") as f:
+            text = _COMMENT.sub(" ", f.read()).replace("\\\n", " ")
+
+        # Stack of (enclosing block active, a branch was taken)
+        stack = []
+        active = True
+        for line in text.splitlines():
+            match = _DIRECTIVE.match(line)
+            if not match:
+                continue
+            directive, rest = match.groups()
+
+            if directive in ("if", "ifdef", "ifndef"):
+                if not active:
+                    stack.append((False, True))
+                    continue
+                if directive == "if":
+                    taken = bool(self._evaluate_condition(rest))
+                else:
+                    defined = rest.split()[0] in self.macros
+                    taken = defined == (directive == "ifdef")
+                stack.append((True, taken))
+                active = taken
+            elif directive == "elif":
+                enclosing, taken = stack[-1]
+                active = (
+                    enclosing
+                    and not taken
+                    and bool(self._evaluate_condition(rest))
+                )
+                stack[-1] = (enclosing, taken or active)
+            elif directive == "else":
+                enclosing, taken = stack[-1]
+                active = enclosing and not taken
+                stack[-1] = (enclosing, True)
+            elif directive == "endif":
+                active = stack.pop()[0]
+            elif not active:
+                continue
+            elif directive == "define":
+                name, params, param_list, body = _DEFINE.match(rest).groups()
+                if params is not None:
+                    params = [p.strip() for p in param_list.split(",")]
+                self.macros[name] = (params, _tokenize(body))
+            elif directive == "undef":
+                self.macros.pop(rest.strip(), None)
+            elif directive == "include":
+                self._include(path, rest)
+
+    def _include(self, path, rest):
+        match = _INCLUDE.search(rest)
+        if not match:
+            # System headers do not define the layout
+            return
+        for directory in [os.path.dirname(path)] + self.include_dirs:
+            candidate = os.path.join(directory, match.group(1))
+            if os.path.isfile(candidate):
+                self.read(candidate)
+                return
+        logging.debug("%s: %s not found", path, match.group(1))
+
+    def _expand(self, tokens, condition, seen=frozenset()):
+        """
+        :param tokens: Tokens to expand
+        :param condition: If True, expand "defined" as in #if directives
+        :param seen: Macros being expanded, which are not expanded again
+        :return: List of tokens with every known macro expanded
+        """
+        expanded = []
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            i += 1
+            if not isinstance(token, str) or not _IDENTIFIER.match(token):
+                expanded.append(token)
+                continue
+            if condition and token == "defined":
+                if tokens[i] == "(":
+                    name = tokens[i + 1]
+                    i += 3
+                else:
+                    name = tokens[i]
+                    i += 1
+                expanded.append(int(name in self.macros))
+                continue
+            if token in seen or token not in self.macros:
+                expanded.append(token)
+                continue
+
+            params, body = self.macros[token]
+            if params is not None:
+                if i >= len(tokens) or tokens[i] != "(":
+                    expanded.append(token)
+                    continue
+                args, i = self._collect_args(tokens, i)
+                if len(args) != len([p for p in params if p]):
+                    raise ValueError("Wrong number of arguments of " + token)
+                body = [
+                    arg
+                    for t in body
+                    for arg in (args[params.index(t)] if t in params else [t])
+                ]
+            expanded.extend(self._expand(body, condition, seen | {token}))
+        return expanded
+
+    @staticmethod
+    def _collect_args(tokens, i):
+        """
+        :param tokens: Tokens of the expression
+        :param i: Index of the opening parenthesis of the arguments
+        :return: (list of the tokens of each argument, index after the
+                 closing parenthesis)
+        """
+        args = [[]]
+        depth = 0
+        for i in range(i, len(tokens)):
+            token = tokens[i]
+            if token == "(":
+                depth += 1
+                if depth == 1:
+                    continue
+            elif token == ")":
+                depth -= 1
+                if depth == 0:
+                    return [arg for arg in args if arg], i + 1
+            elif token == "," and depth == 1:
+                args.append([])
+                continue
+            args[-1].append(token)
+        raise ValueError("Unbalanced parentheses")
+
+    def _evaluate_tokens(self, tokens, condition):
+        tokens = self._expand(tokens, condition)
+        values = []
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            # Drop casts, e.g. (uint32_t)
+            if token == "(":
+                end = i + 1
+                while end < len(tokens) and tokens[end] in TYPE_NAMES:
+                    end += 1
+                if end > i + 1 and end < len(tokens) and tokens[end] == ")":
+                    i = end + 1
+                    continue
+            if isinstance(token, str) and _IDENTIFIER.match(token):
+                if not condition:
+                    raise ValueError("%s is not defined" % token)
+                # Unknown identifiers are 0 in #if directives
+                token = 0
+            values.append(token)
+            i += 1
+        return _Parser(values).parse()
+
+    def _evaluate_condition(self, expression):
+        try:
+            return self._evaluate_tokens(_tokenize(expression), True)
+        except (ValueError, ZeroDivisionError, IndexError) as e:
+            logging.debug("Unable to evaluate #if %s: %s", expression, e)
+            return 0
+
+    def evaluate(self, expression):
+        """
+        :param expression: C integer expression using the macros
+        :return: Its value
+        :raise ValueError: if it uses an unknown macro or is not an integer
+                           expression
+        """
+        try:
+            return self._evaluate_tokens(_tokenize(expression), False)
+        except (ZeroDivisionError, IndexError) as e:
+            raise ValueError(str(e))
+
+    def get(self, name):
+        """
+        :param name: Macro name
+        :return: Its value, None if it is not an integer known here
+        """
+        try:
+            return self.evaluate(name)
+        except ValueError as e:
+            logging.debug("Unable to evaluate %s: %s", name, e)
+            return None
+
+
+def get_limits(macros, image):
+    """
+    :param macros: Macros of region_defs.h
+    :param image: "secure", "non-secure" or "bl2"
+    :return: dict of "flash" and "ram" to the (start, size) of the region
+             the image is linked to, the regions not known are left out
+    """
+    limits = {}
+    for memory, names in REGIONS[image].items():
+        start, size = (macros.get(name) for name in names)
+        if start is not None and size is not None:
+            limits[memory] = (start, size)
+    return limits
+
+
+def _get_load_address(section, segments):
+    """
+    :param section: Allocated section
+    :param segments: Loadable segments of the image
+    :return: Address the section is stored at, e.g. in flash for the
+             initial values of .data
+    """
+    for segment in segments:
+        offset = section["addr"] - segment["vaddr"]
+        if 0 <= offset < segment["memsz"]:
+            return segment["paddr"] + offset
+    return section["addr"]
+
+
+def _get_partitions(symbols, sections):
+    """
+    :param symbols: Symbols of the image
+    :param sections: Allocated sections of the image
+    :return: dict of secure partition name to its "flash" and "ram" bytes,
+             from the bounds of the execution regions set by the linker
+    """
+    bounds = {}
+    for name, __, ___, ____, value, _____ in symbols:
+        match = IMAGE_SYMBOL.match(name)
+        if match:
+            region, part, bound = match.groups()
+            bounds.setdefault((region, part), {})[bound] = value
+
+    # Regions with RO, RW and ZI parts are counted by part
+    split = {region for region, part in bounds if part}
+    partitions = {}
+    for (region, part), bound in sorted(bounds.items()):
+        match = PARTITION.match(region) or PARTITION.match(region + "_LINKER")
+        if not match or (region in split and not part):
+            continue
+        if "Base" not in bound or "Limit" not in bound:
+            continue
+        size = bound["Limit"] - bound["Base"]
+        if size <= 0:
+            continue
+        memory = "flash"
+        for section in sections:
+            if 0 <= bound["Base"] - section["addr"] < section["size"]:
+                if section["kind"] != "code":
+                    memory = "ram"
+                break
+        partition = partitions.setdefault(
+            match.group(1), {"flash": 0, "ram": 0}
+        )
+        partition[memory] += size
+    return partitions
+
+
+def analyse_elf(path, limits=None, top=TOP_SYMBOLS):
+    """
+    :param path: Path of the ELF image, e.g. tfm_s.axf
+    :param limits: Result of get_limits(), None if the layout is not known
+    :param top: Number of the largest symbols recorded
+    :return: dict with the usage of each region, the flash and RAM totals,
+             the allocated sections, the secure partitions and the largest
+             symbols
+    """
+    with open(path, "rb") as f:
+        elf = Elf32(bytearray(f.read()))
+    all_sections = elf.sections()
+    names = all_sections[elf.shstrndx]
+    segments = [s for s in elf.segments() if s["type"] == PT_LOAD]
+
+    sections = []
+    # (address, size) of every copy of the sections in memory
+    placements = []
+    totals = {"flash": 0, "ram": 0}
+    for section in all_sections:
+        if not section["flags"] & SHF_ALLOC or not section["size"]:
+            continue
+        if section["type"] == SHT_NOBITS:
+            kind = "bss"
+        elif section["flags"] & SHF_WRITE:
+            kind = "data"
+        else:
+            kind = "code"
+        sections.append(
+            {
+                "name": elf.string(names, section["name"]),
+                "addr": section["addr"],
+                "size": section["size"],
+                "kind": kind,
+            }
+        )
+        placements.append((section["addr"], section["size"]))
+        if kind != "code":
+            totals["ram"] += section["size"]
+        if kind != "bss":
+            totals["flash"] += section["size"]
+            address = _get_load_address(section, segments)
+            if address != section["addr"]:
+                placements.append((address, section["size"]))
+
+    regions = {}
+    for memory, (start, size) in sorted((limits or {}).items()):
+        used = sum(
+            length
+            for address, length in placements
+            if start <= address < start + size
+        )
+        regions[memory] = {
+            "start": start,
+            "size": size,
+            "used": used,
+            "percent": round(100 * used / size, 1) if size else None,
+        }
+
+    symbols = []
+    for symtab in all_sections:
+        if symtab["type"] == SHT_SYMTAB:
+            symbols = elf.symbols(symtab, all_sections[symtab["link"]])
+            break
+    largest = [
+        {"name": name, "size": size, "kind": SYMBOL_KINDS[kind]}
+        for name, __, kind, ___, ____, size in symbols
+        if kind in SYMBOL_KINDS and size
+    ]
+    largest.sort(key=lambda symbol: -symbol["size"])
+
+    return {
+        "regions": regions,
+        "totals": totals,
+        "partitions": _get_partitions(symbols, sections),
+        "sections": sections,
+        "symbols": largest[:top],
+    }
+
+
+def read_layout(header_dirs, defines=None):
+    """
+    :param header_dirs: Directories of region_defs.h and the headers it
+                        includes, e.g. flash_layout.h
+    :param defines: dict of the macros defined when building, e.g. BL2
+    :return: Macros of region_defs.h, None if it is not found
+    """
+    macros = Macros(defines, header_dirs)
+    for directory in header_dirs:
+        path = os.path.join(directory, "region_defs.h")
+        if os.path.isfile(path):
+            macros.read(path)
+            return macros
+    return None
+
+
+def load_reports(reports_dir=BUILD_REPORTS_DIR):
+    """
+    :param reports_dir: Build reports directory
+    :return: List of the recorded footprints, oldest first
+    """
+    try:
+        with open(os.path.join(reports_dir, REPORT_NAME + ".jsonl")) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def diff(previous, current, sections=False):
+    """
+    :param previous: Earlier record of the same build
+    :param current: New record
+    :param sections: Also compare the sections
+    :return: List of (image, item, previous bytes, current bytes) of what
+             changed size
+    """
+    changes = []
+    for image, after in sorted(current["images"].items()):
+        before = previous["images"].get(image)
+        if not before:
+            continue
+        items = []
+        for memory in ("flash", "ram"):
+            items.append(
+                (memory, before["totals"][memory], after["totals"][memory])
+            )
+        for name in sorted(
+            set(before["partitions"]) | set(after["partitions"])
+        ):
+            for memory in ("flash", "ram"):
+                items.append(
+                    (
+                        "%s %s" % (name, memory),
+                        before["partitions"].get(name, {}).get(memory, 0),
+                        after["partitions"].get(name, {}).get(memory, 0),
+                    )
+                )
+        if sections:
+            sizes_before = {s["name"]: s["size"] for s in before["sections"]}
+            sizes_after = {s["name"]: s["size"] for s in after["sections"]}
+            for name in sorted(set(sizes_before) | set(sizes_after)):
+                items.append(
+                    (name, sizes_before.get(name, 0), sizes_after.get(name, 0))
+                )
+        for item, size_before, size_after in items:
+            if size_before != size_after:
+                changes.append((image, item, size_before, size_after))
+    return changes
+
+
+def log_footprint(image, analysis):
+    """
+    Log the usage of the regions of an image, warning when they are nearly
+    full or overflow
+    :param image: Name of the image
+    :param analysis: Result of analyse_elf()
+    """
+    if not analysis["regions"]:
+        logging.info(
+            "%s: %d bytes of flash, %d bytes of RAM",
+            image,
+            analysis["totals"]["flash"],
+            analysis["totals"]["ram"],
+        )
+    for memory, region in sorted(analysis["regions"].items()):
+        if region["percent"] is not None and region["percent"] > 100:
+            log = logging.error
+        elif (
+            region["percent"] is not None and region["percent"] >= FULL_PERCENT
+        ):
+            log = logging.warning
+        else:
+            log = logging.info
+        log(
+            "%s %s: %d of %d bytes used (%.1f%%)",
+            image,
+            memory,
+            region["used"],
+            region["size"],
+            region["percent"] or 0,
+        )
+
+
+def _select(reports, args):
+    """
+    :param reports: Result of load_reports()
+    :param args: Command-line arguments with the filters
+    :return: The reports matching the filters
+    """
+    return [
+        report
+        for report in reports
+        if (not args.mcu or report["target"] == args.mcu)
+        and (not args.toolchain or report["toolchain"] == args.toolchain)
+        and (not args.config or report["config"] == args.config)
+        and (not args.profile or report.get("profile") == args.profile)
+    ]
+
+
+def _get_parser():
+    parser = argparse.ArgumentParser(
+        description="Measure the flash and RAM used by the images"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    show = subparsers.add_parser("show", help="Analyse an ELF image")
+    show.add_argument("elf", help="ELF image, e.g. tfm_s.axf")
+    show.add_argument(
+        "-i",
+        "--image",
+        help="Regions of region_defs.h the image is linked to "
+        "(default: secure)",
+        choices=sorted(REGIONS),
+        default="secure",
+    )
+    show.add_argument(
+        "-I",
+        "--headers",
+        help="Directory of region_defs.h and the headers it includes",
+        action="append",
+        default=[],
+    )
+    show.add_argument(
+        "-D",
+        "--define",
+        help="Macro defined when building, e.g. BL2",
+        action="append",
+        default=[],
+    )
+    show.add_argument(
+        "--top",
+        help="Number of largest symbols shown (default: %d)" % TOP_SYMBOLS,
+        type=int,
+        default=TOP_SYMBOLS,
+    )
+
+    for name, help_text in (
+        ("history", "List the recorded footprints"),
+        ("diff", "Compare the last recorded footprint with an earlier one"),
+    ):
+        subparser = subparsers.add_parser(name, help=help_text)
+        subparser.add_argument("-m", "--mcu", help="Only this target")
+        subparser.add_argument("-t", "--toolchain", help="Only this toolchain")
+        subparser.add_argument("-c", "--config", help="Only this config")
+        subparser.add_argument("-p", "--profile", help="Only this profile")
+
+    subparsers.choices["diff"].add_argument(
+        "--from",
+        dest="version",
+        help="Compare with the last footprint of this TF-M version "
+        "(default: the previous footprint)",
+    )
+    subparsers.choices["diff"].add_argument(
+        "--sections", help="Also compare the sections", action="store_true"
+    )
+    return parser
+
+
+def _main():
+    """
+    Analyse an image, or list and compare the footprints recorded by
+    build_tfm.py and test_psa_target.py
+    """
+    args = _get_parser().parse_args()
+
+    if args.command == "show":
+        defines = dict(
+            (define.split("=", 1) + ["1"])[:2] for define in args.define
+        )
+        macros = read_layout(args.headers, defines) if args.headers else None
+        limits = get_limits(macros, args.image) if macros else None
+        try:
+            analysis = analyse_elf(args.elf, limits, args.top)
+        except Exception as e:
+            logging.critical("Unable to analyse %s: %s", args.elf, e)
+            sys.exit(1)
+        log_footprint(args.image, analysis)
+        for name, partition in sorted(analysis["partitions"].items()):
+            logging.info(
+                "  %-40s flash %7d  RAM %7d",
+                name,
+                partition["flash"],
+                partition["ram"],
+            )
+        logging.info("Largest symbols:")
+        for symbol in analysis["symbols"]:
+            logging.info(
+                "  %7d %-6s %s", symbol["size"], symbol["kind"], symbol["name"]
+            )
+        return
+
+    reports = _select(load_reports(), args)
+    if args.command == "history":
+        for report in reports:
+            print(
+                "%s  %-12s %-8s %-14s %-14s %-22s  %s"
+                % (
+                    report["time"],
+                    report["target"],
+                    report["toolchain"],
+                    report["config"],
+                    report.get("profile") or "-",
+                    report["tfm_version"],
+                    ", ".join(
+                        "%s %d/%d"
+                        % (image, a["totals"]["flash"], a["totals"]["ram"])
+                        for image, a in sorted(report["images"].items())
+                    ),
+                )
+            )
+        return
+
+    if not reports:
+        logging.critical("No footprint recorded for these filters")
+        sys.exit(1)
+    current = reports[-1]
+    earlier = [
+        report
+        for report in reports[:-1]
+        if not args.version or report["tfm_version"] == args.version
+    ]
+    if not earlier:
+        logging.critical("No earlier footprint to compare with")
+        sys.exit(1)
+    previous = earlier[-1]
+
+    logging.info(
+        "%s (%s) -> %s (%s)",
+        previous["tfm_version"],
+        previous["time"],
+        current["tfm_version"],
+        current["time"],
+    )
+    for image, item, before, after in diff(previous, current, args.sections):
+        logging.info(
+            "%-10s %-48s %8d -> %8d (%+d)",
+            image,
+            item,
+            before,
+            after,
+            after - before,
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[Footprint] %(asctime)s: %(message)s.",
+        datefmt="%H:%M:%S",
+    )
+    _main()
@@ -0,0 +1,522 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2021 ARM Limited. All rights reserved.
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import sys
+import argparse
+import contextlib
+import glob
+import json
+import logging
+import re
+import selectors
+import shutil
+import time
+import uuid
+
+try:
+    import termios
+    import tty
+except ImportError as e:
+    print(str(e) + " The lean runner needs a POSIX host, use mbedgt.")
+    exit(1)
+
+import event_log
+import test_timing
+from flash_planner import FlashPlanner
+
+# Bumped whenever a change of the runner may change test outcomes
+RUNNER_VERSION = "1"
+
+# Used until the device announces its own timeout with GREENTEA_SETUP()
+DEFAULT_TIMEOUT = 600
+# The sync is sent again until the device echoes it back, images built
+# without wait-for-sync never do and simply ignore it.
+SYNC_INTERVAL = 1
+SYNC_ATTEMPTS = 10
+# Time DAPLink takes to program the target after the copy and remount
+FLASH_TIMEOUT = 60
+
+# Greentea key-value messages, e.g. {{__sync;<uuid>}}
+KV_PATTERN = re.compile(r"\{\{([^;{}]+);([^{}]*)\}\}")
+
+
+def find_boards():
+    """
+    Find the DAPLink boards connected to this host, from their mass storage
+    mount points and the USB serial ports named after their unique ID
+
+    :return: List of dict with the board_id, mount and port of each board
+    """
+    boards = []
+    try:
+        with open("/proc/mounts") as f:
+            mounts = [line.split()[1] for line in f]
+    except FileNotFoundError:
+        mounts = glob.glob("/Volumes/*")
+
+    for mount in mounts:
+        mount = mount.replace("\\040", " ")
+        board_id = read_board_id(mount)
+        if not board_id:
+            continue
+
+        ports = glob.glob("/dev/serial/by-id/*%s*" % board_id)
+        ports += glob.glob("/dev/tty.usbmodem*%s*" % board_id[-4:])
+        boards.append(
+            {
+                "board_id": board_id,
+                "mount": mount,
+                "port": os.path.realpath(ports[0]) if ports else None,
+            }
+        )
+
+    return boards
+
+
+def read_board_id(mount):
+    """
+    :param mount: Mount point
+    :return: DAPLink unique ID, None if the mount point is not a DAPLink
+    """
+    try:
+        with open(os.path.join(mount, "DETAILS.TXT")) as f:
+            for line in f:
+                if line.startswith("Unique ID:"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+
+    try:
+        with open(os.path.join(mount, "MBED.HTM")) as f:
+            match = re.search(r"code=([0-9A-Fa-f]+)", f.read())
+            if match:
+                return match.group(1)
+    except OSError:
+        pass
+
+    return None
+
+
+def find_board(detect_codes):
+    """
+    :param detect_codes: Platform codes of a target, the first four
+                         characters of the unique ID of its boards
+    :return: First board of the target, see find_boards(), or None
+    """
+    for board in find_boards():
+        if board["board_id"][:4] in detect_codes and board["port"]:
+            return board
+    return None
+
+
+def flash(image, mount, timeout=FLASH_TIMEOUT, wait=True):
+    """
+    Program a target by copying its image to the DAPLink mount point, then
+    wait for DAPLink to remount once programming is done
+
+    :param image: Path of the HEX or binary image
+    :param mount: DAPLink mount point
+    :param timeout: Time to wait for the remount in seconds
+    :param wait: If False return once the image is copied
+    """
+    # What the board holds is unknown until the planner records it again
+    board_id = read_board_id(mount)
+    if board_id:
+        FlashPlanner().forget(board_id)
+
+    logging.info("Copying %s to %s", image, mount)
+    dst = os.path.join(mount, os.path.basename(image))
+    with open(image, "rb") as src, open(dst, "wb") as f:
+        shutil.copyfileobj(src, f)
+        f.flush()
+        os.fsync(f.fileno())
+    if not wait:
+        return
+
+    deadline = time.monotonic() + timeout
+    # The copied file vanishes when DAPLink remounts after programming
+    while os.path.exists(dst):
+        if time.monotonic() > deadline:
+            raise Exception("%s did not remount after programming" % mount)
+        time.sleep(0.2)
+    while not os.path.isdir(mount):
+        if time.monotonic() > deadline:
+            raise Exception("%s did not remount after programming" % mount)
+        time.sleep(0.2)
+
+    fail = os.path.join(mount, "FAIL.TXT")
+    if os.path.isfile(fail):
+        with open(fail) as f:
+            raise Exception("Programming failed: %s" % f.read().strip())
+
+
+class SerialPort:
+    """
+    Raw, non-blocking serial port, either a board's USB serial port or the
+    pseudo-terminal of device_simulator.py
+
+    :param path: Device path
+    :param baud_rate: Baud rate, ignored by pseudo-terminals
+    """
+
+    def __init__(self, path, baud_rate=115200):
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        tty.setraw(self.fd)
+        attrs = termios.tcgetattr(self.fd)
+        speed = getattr(termios, "B%d" % baud_rate)
+        attrs[2] |= termios.CLOCAL | termios.CREAD
+        attrs[4] = speed
+        attrs[5] = speed
+        termios.tcsetattr(self.fd, termios.TCSANOW, attrs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def fileno(self):
+        return self.fd
+
+    def read(self):
+        """
+        :return: Bytes available, b"" if there are none and None once the
+                 device is gone
+        """
+        try:
+            return os.read(self.fd, 65536) or None
+        except BlockingIOError:
+            return b""
+        except OSError:
+            # EIO once the other side of a pseudo-terminal is closed
+            return None
+
+    def write(self, data):
+        """
+        :param data: Bytes to send
+        """
+        while data:
+            try:
+                written = os.write(self.fd, data)
+                data = data[written:]
+            except BlockingIOError:
+                time.sleep(0.01)
+
+    def reset(self):
+        """
+        Drop the stale input and reset the target with a break, which
+        DAPLink turns into a reset
+        """
+        termios.tcflush(self.fd, termios.TCIFLUSH)
+        termios.tcsendbreak(self.fd, 0)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class CompareLog:
+    """
+    The expected output of a test: every pattern has to match a line of the
+    output, in order, as Greentea's compare_log does
+
+    :param path: Path of the compare log, one regular expression per line
+    """
+
+    def __init__(self, path):
+        with open(path) as f:
+            self.patterns = [
+                re.compile(line.rstrip("\r\n")) for line in f if line.strip()
+            ]
+        self.matched = 0
+
+    @property
+    def done(self):
+        return self.matched == len(self.patterns)
+
+    def feed(self, line):
+        """
+        :param line: Line of output
+        :return: True if the line matched the next pattern
+        """
+        if not self.done and self.patterns[self.matched].search(line):
+            self.matched += 1
+            return True
+        return False
+
+
+def run_test(
+    port,
+    compare_log,
+    image=None,
+    mount=None,
+    baud_rate=115200,
+    sync=True,
+    reset=True,
+    timeout=None,
+    record=None,
+    prefix="",
+    timer=None,
+):
+    """
+    Run one test image: program it, sync with it and match its output
+    against the compare log. Serial input is read as it arrives, the test
+    ends as soon as the last pattern matches.
+
+    :param port: Serial port of the board
+    :param compare_log: Path of the compare log
+    :param image: Image to program, None to run what is on the target
+    :param mount: DAPLink mount point, required with image
+    :param baud_rate: Baud rate of the serial port
+    :param sync: If True send the Greentea sync until the device echoes it
+    :param reset: If True reset the target once the port is open
+    :param timeout: Timeout in seconds, defaults to the one announced by
+                    the device, or DEFAULT_TIMEOUT
+    :param record: Path of a JSON lines transcript of the serial traffic,
+                   which device_simulator.py can replay
+    :param prefix: Text put in front of every logged line of output
+    :param timer: test_timing.TestTimer fed with every line of output and
+                  the time it was received
+    :return: dict with the result ("pass", "fail", "timeout" or
+             "disconnected") and statistics of the run
+    """
+    compare = CompareLog(compare_log)
+    start = time.monotonic()
+    if image:
+        flash(image, mount)
+
+    stats = {"lines": 0, "bytes": 0}
+    result = None
+    with contextlib.ExitStack() as stack:
+        serial = stack.enter_context(SerialPort(port, baud_rate))
+        transcript = stack.enter_context(open(record, "w")) if record else None
+        if reset:
+            serial.reset()
+        run_start = time.monotonic()
+        deadline = run_start + (timeout or DEFAULT_TIMEOUT)
+        token = uuid.uuid4().hex
+        synced = not sync
+        sync_sent = 0
+        next_sync = run_start
+        pending = b""
+
+        selector = selectors.DefaultSelector()
+        selector.register(serial, selectors.EVENT_READ)
+
+        def _log(direction, data):
+            if transcript:
+                transcript.write(
+                    json.dumps(
+                        {
+                            "t": round(time.monotonic() - run_start, 6),
+                            direction: data.decode("utf-8", "replace"),
+                        }
+                    )
+                    + "\n"
+                )
+
+        while result is None:
+            now = time.monotonic()
+            if not synced and sync_sent < SYNC_ATTEMPTS and now >= next_sync:
+                message = ("{{__sync;%s}}\n" % token).encode()
+                serial.write(message)
+                _log("tx", message)
+                sync_sent += 1
+                next_sync = now + SYNC_INTERVAL
+
+            wake = deadline
+            if not synced and sync_sent < SYNC_ATTEMPTS:
+                wake = min(wake, next_sync)
+            if now >= deadline:
+                result = "timeout"
+                break
+
+            if not selector.select(max(0, wake - now)):
+                continue
+            data = serial.read()
+            if data is None:
+                result = "disconnected"
+                break
+            if not data:
+                continue
+
+            _log("rx", data)
+            received = time.time()
+            stats["bytes"] += len(data)
+            lines = (pending + data).split(b"\n")
+            pending = lines.pop()
+            for raw in lines:
+                line = raw.decode("utf-8", "replace").rstrip("\r")
+                stats["lines"] += 1
+                logging.debug("%s%s", prefix, line)
+                if timer:
+                    timer.feed(received, line)
+
+                for key, value in KV_PATTERN.findall(line):
+                    if key == "__sync" and value == token:
+                        synced = True
+                    elif key == "__timeout" and not timeout:
+                        deadline = time.monotonic() + int(value)
+                    elif (key == "end" and value == "failure") or (
+                        key == "__exit" and value != "0"
+                    ):
+                        result = "fail"
+
+                if compare.feed(line):
+                    logging.info("%s%s", prefix, line)
+                if compare.done and result is None:
+                    result = "pass"
+                if result:
+                    break
+
+        selector.close()
+
+    duration = time.monotonic() - start
+    stats.update(
+        {
+            "result": result,
+            "passed": result == "pass",
+            "matched": compare.matched,
+            "expected": len(compare.patterns),
+            "duration": round(duration, 3),
+            "lines_per_second": round(stats["lines"] / max(duration, 1e-6)),
+        }
+    )
+    if result != "pass" and not compare.done:
+        stats["missing"] = compare.patterns[compare.matched].pattern
+    return stats
+
+
+def _get_parser():
+    parser = argparse.ArgumentParser(
+        description="Run a test image without Greentea"
+    )
+    parser.add_argument(
+        "-c",
+        "--compare-log",
+        help="Expected output, one regular expression per line",
+        required=True,
+    )
+    parser.add_argument(
+        "-p",
+        "--port",
+        help="Serial port (default: the port of the board at --mount)",
+        default=None,
+    )
+    parser.add_argument(
+        "-i", "--image", help="Image to program first", default=None
+    )
+    parser.add_argument(
+        "-d",
+        "--mount",
+        help="DAPLink mount point (default: the only board connected)",
+        default=None,
+    )
+    parser.add_argument(
+        "-b", "--baud-rate", help="Baud rate", type=int, default=115200
+    )
+    parser.add_argument(
+        "--no-sync",
+        help="Do not send the Greentea sync",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--no-reset",
+        help="Do not reset the target, e.g. for device_simulator.py",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--timeout",
+        help="Timeout in seconds (default: announced by the device, or %d)"
+        % DEFAULT_TIMEOUT,
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--record",
+        help="Write a transcript of the serial traffic to a file",
+        default=None,
+    )
+    parser.add_argument(
+        "-v", "--verbose", help="Log every line", action="store_true"
+    )
+    return parser
+
+
+def _main():
+    """
+    Run a test image and check its output
+    """
+    args = _get_parser().parse_args()
+    event_log.configure("Host-Runner", args.verbose)
+
+    if not args.port or (args.image and not args.mount):
+        boards = [
+            b
+            for b in find_boards()
+            if not args.mount or os.path.samefile(b["mount"], args.mount)
+        ]
+        if len(boards) != 1:
+            logging.critical(
+                "Found %d boards, pass --port and --mount", len(boards)
+            )
+            sys.exit(1)
+        args.port = args.port or boards[0]["port"]
+        args.mount = args.mount or boards[0]["mount"]
+
+    timer = test_timing.TestTimer()
+    try:
+        stats = run_test(
+            args.port,
+            args.compare_log,
+            args.image,
+            args.mount,
+            args.baud_rate,
+            not args.no_sync,
+            not args.no_reset,
+            args.timeout,
+            args.record,
+            timer=timer,
+        )
+    except Exception as e:
+        logging.critical(str(e))
+        sys.exit(1)
+
+    logging.info(
+        "Result: %s, %d/%d patterns matched, %d lines in %.3fs (%d lines/s)",
+        stats["result"],
+        stats["matched"],
+        stats["expected"],
+        stats["lines"],
+        stats["duration"],
+        stats["lines_per_second"],
+    )
+    test_timing.log_timings(timer.get_results())
+    if not stats["passed"]:
+        if "missing" in stats:
+            logging.error("Next expected: %s", stats["missing"])
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    event_log.configure("Host-Runner")
+    _main()
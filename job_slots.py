@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2021 ARM Limited. All rights reserved.
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import math
+import logging
+import threading
+import contextlib
+
+SIZE_UNITS = {"K": 1024, "M": 1024 * 1024, "G": 1024 * 1024 * 1024}
+
+# How often a build waiting for slots samples the load average again
+LOAD_POLL_INTERVAL = 5
+
+
+def parse_size(size):
+    """
+    Convert a size such as 512M or 16G to bytes
+    :param size: Number of bytes, optionally followed by K, M or G
+    :return: Size in bytes
+    """
+    size = size.strip().upper()
+    if size and size[-1] in SIZE_UNITS:
+        return int(float(size[:-1]) * SIZE_UNITS[size[-1]])
+    return int(size)
+
+
+def _get_load_average():
+    """
+    :return: One minute load average, 0 where it is not available
+    """
+    try:
+        return os.getloadavg()[0]
+    except (AttributeError, OSError):
+        return 0
+
+
+class JobSlotPool:
+    """
+    Divide a budget of parallel compile jobs between the builds running at
+    the same time. Each build is given an explicit job count for its
+    Ninja/Make invocation, out of the slots which are neither used by the
+    other builds nor taken by load from outside this pool.
+
+    :param total_jobs: Number of jobs all builds may run together,
+                       defaults to the number of CPUs
+    :param shares: Number of builds expected to run at once, each of them
+                   gets at most an equal share of total_jobs
+    :param mem_limit: Memory in bytes all builds may use together, None
+                      for no limit
+    :param mem_per_job: Memory in bytes used by one compile job
+    """
+
+    def __init__(
+        self, total_jobs=None, shares=1, mem_limit=None, mem_per_job=None
+    ):
+        self.total = total_jobs or os.cpu_count() or 1
+        if mem_limit and mem_per_job:
+            self.total = min(self.total, max(1, mem_limit // mem_per_job))
+        self.share = max(1, math.ceil(self.total / max(1, shares)))
+        self.in_use = 0
+        self.condition = threading.Condition()
+
+    def _free_slots(self):
+        """
+        :return: Number of slots which can be granted now
+        """
+        # The load average includes our own jobs, only the rest of it is
+        # load from outside the pool.
+        foreign_load = max(0, _get_load_average() - self.in_use)
+        return self.total - self.in_use - int(round(foreign_load))
+
+    @contextlib.contextmanager
+    def acquire(self, name):
+        """
+        Wait for free slots and hold them for the duration of a build
+        :param name: Name of the build, for logging
+        :return: Number of jobs the build may run
+        """
+        with self.condition:
+            while True:
+                free = self._free_slots()
+                # A build always gets one slot when nothing else from the
+                # pool runs, so a busy host slows the builds down but
+                # never stalls them.
+                if free >= 1 or self.in_use == 0:
+                    break
+                self.condition.wait(LOAD_POLL_INTERVAL)
+
+            jobs = max(1, min(free, self.share))
+            self.in_use += jobs
+
+        logging.info("%s runs %d parallel job(s)", name, jobs)
+        try:
+            yield jobs
+        finally:
+            with self.condition:
+                self.in_use -= jobs
+                self.condition.notify_all()
@@ -60,3 +60,167 @@ int main(void)
 }
 
 #endif //MBED_CONF_APP_PSA_COMPLIANCE_TEST
+
+#if MBED_CONF_APP_CRYPTO_BENCHMARK
+
+#include "psa/crypto.h"
+
+/* Every operation is timed on each payload size */
+static const size_t payload_sizes[] = {64, 256, 1024, 4096};
+
+/* An operation is repeated until it ran for this long, or this many times */
+#define BENCHMARK_MIN_DURATION_US 500000
+#define BENCHMARK_MAX_ITERATIONS 1000
+
+#define BENCHMARK_MAX_PAYLOAD 4096
+
+static uint8_t payload[BENCHMARK_MAX_PAYLOAD];
+static uint8_t output[BENCHMARK_MAX_PAYLOAD + 16];  /* GCM tag */
+static const uint8_t nonce[12] = {0};
+
+static psa_key_id_t aes_key;
+static psa_key_id_t hmac_key;
+static psa_key_id_t ecc_key;
+
+typedef psa_status_t (*operation_t)(size_t size);
+
+static psa_status_t hash_sha256(size_t size)
+{
+    size_t length;
+    return psa_hash_compute(PSA_ALG_SHA_256, payload, size,
+                            output, sizeof(output), &length);
+}
+
+static psa_status_t aead_aes128_gcm(size_t size)
+{
+    size_t length;
+    return psa_aead_encrypt(aes_key, PSA_ALG_GCM, nonce, sizeof(nonce),
+                            NULL, 0, payload, size,
+                            output, sizeof(output), &length);
+}
+
+static psa_status_t mac_hmac_sha256(size_t size)
+{
+    size_t length;
+    return psa_mac_compute(hmac_key, PSA_ALG_HMAC(PSA_ALG_SHA_256),
+                           payload, size, output, sizeof(output), &length);
+}
+
+static psa_status_t sign_ecdsa_p256(size_t size)
+{
+    uint8_t hash[PSA_HASH_MAX_SIZE];
+    size_t length;
+    psa_status_t status = psa_hash_compute(PSA_ALG_SHA_256, payload, size,
+                                           hash, sizeof(hash), &length);
+    if (status != PSA_SUCCESS) {
+        return status;
+    }
+    return psa_sign_hash(ecc_key, PSA_ALG_ECDSA(PSA_ALG_SHA_256),
+                         hash, length, output, sizeof(output), &length);
+}
+
+static const struct {
+    const char *name;
+    operation_t operation;
+} operations[] = {
+    {"hash-sha256", hash_sha256},
+    {"aead-aes128-gcm", aead_aes128_gcm},
+    {"mac-hmac-sha256", mac_hmac_sha256},
+    {"sign-ecdsa-p256", sign_ecdsa_p256},
+};
+
+static psa_status_t generate_key(psa_key_type_t type, size_t bits,
+                                 psa_key_usage_t usage, psa_algorithm_t alg,
+                                 psa_key_id_t *key)
+{
+    psa_key_attributes_t attributes = PSA_KEY_ATTRIBUTES_INIT;
+    psa_set_key_type(&attributes, type);
+    psa_set_key_bits(&attributes, bits);
+    psa_set_key_usage_flags(&attributes, usage);
+    psa_set_key_algorithm(&attributes, alg);
+    return psa_generate_key(&attributes, key);
+}
+
+/*
+ * Print one line per operation and payload size:
+ * BENCH <operation> size=<bytes> iterations=<count> us=<microseconds>
+ * or BENCH <operation> size=<bytes> error=<PSA status>
+ */
+static uint32_t run_benchmark(void)
+{
+    uint32_t failures = 0;
+    mbed::Timer timer;
+
+    for (size_t i = 0; i < sizeof(operations) / sizeof(operations[0]); i++) {
+        for (size_t j = 0; j < sizeof(payload_sizes) / sizeof(payload_sizes[0]); j++) {
+            size_t size = payload_sizes[j];
+            uint32_t iterations = 0;
+            psa_status_t status = PSA_SUCCESS;
+
+            timer.reset();
+            timer.start();
+            while (iterations < BENCHMARK_MAX_ITERATIONS
+                    && timer.elapsed_time().count() < BENCHMARK_MIN_DURATION_US) {
+                status = operations[i].operation(size);
+                if (status != PSA_SUCCESS) {
+                    break;
+                }
+                iterations++;
+            }
+            timer.stop();
+
+            if (status != PSA_SUCCESS) {
+                printf("BENCH %s size=%u error=%ld\r\n", operations[i].name,
+                       (unsigned int)size, (long)status);
+                failures++;
+            } else {
+                printf("BENCH %s size=%u iterations=%lu us=%lu\r\n",
+                       operations[i].name, (unsigned int)size,
+                       (unsigned long)iterations,
+                       (unsigned long)timer.elapsed_time().count());
+            }
+        }
+    }
+
+    return failures;
+}
+
+int main(void)
+{
+#if MBED_CONF_APP_WAIT_FOR_SYNC
+    printf("Waiting for Greentea host\r\n");
+    GREENTEA_SETUP(600, "default_auto");
+#endif
+
+    printf("Starting PSA crypto benchmark\r\n");
+
+    for (size_t i = 0; i < sizeof(payload); i++) {
+        payload[i] = (uint8_t)i;
+    }
+
+    uint32_t failures = 0;
+    if (psa_crypto_init() != PSA_SUCCESS
+            || generate_key(PSA_KEY_TYPE_AES, 128, PSA_KEY_USAGE_ENCRYPT,
+                            PSA_ALG_GCM, &aes_key) != PSA_SUCCESS
+            || generate_key(PSA_KEY_TYPE_HMAC, 256, PSA_KEY_USAGE_SIGN_MESSAGE,
+                            PSA_ALG_HMAC(PSA_ALG_SHA_256), &hmac_key) != PSA_SUCCESS
+            || generate_key(PSA_KEY_TYPE_ECC_KEY_PAIR(PSA_ECC_FAMILY_SECP_R1), 256,
+                            PSA_KEY_USAGE_SIGN_HASH, PSA_ALG_ECDSA(PSA_ALG_SHA_256),
+                            &ecc_key) != PSA_SUCCESS) {
+        printf("PSA crypto benchmark setup FAILED\r\n");
+        failures++;
+    } else {
+        failures = run_benchmark();
+    }
+
+    psa_destroy_key(aes_key);
+    psa_destroy_key(hmac_key);
+    psa_destroy_key(ecc_key);
+
+    printf("PSA crypto benchmark %s\r\n", failures ? "FAILED" : "PASSED");
+    TEST_ASSERT_EQUAL_UINT32(0, failures);
+
+    return 0;
+}
+
+#endif //MBED_CONF_APP_CRYPTO_BENCHMARK
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2021 ARM Limited. All rights reserved.
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import sys
+import argparse
+import hashlib
+import json
+import logging
+import re
+from psa_builder import BUILD_REPORTS_DIR
+
+NINJA_LOG = ".ninja_log"
+# Bytes at the end of the log compared to detect a recompaction
+TAIL_SIZE = 4096
+REPORT_NAME = "ninja_stats"
+
+# TF-M component of a build output, the first match wins
+COMPONENTS = [
+    ("mbedcrypto", re.compile(r"mbedcrypto|mbedtls")),
+    ("psa-arch-tests", re.compile(r"psa[-_]arch[-_]tests|psa_api_test")),
+    ("partition:", re.compile(r"secure_fw/partitions/([^/]+)/")),
+    ("spm", re.compile(r"secure_fw/spm/")),
+    ("tfm-tests", re.compile(r"(^|/)(test|tf-m-tests)/")),
+    ("bl2", re.compile(r"(^|/)bl2/|mcuboot")),
+    ("platform", re.compile(r"(^|/)platform/")),
+]
+# Outputs of link and archive steps, which other steps wait for
+LINK_OUTPUTS = (".axf", ".elf", ".a", ".bin", ".hex")
+
+# Number of slowest steps reported
+TOP_STEPS = 10
+# Component growth reported when comparing with the previous build
+GROWTH_THRESHOLD = 0.2
+GROWTH_MIN_SECONDS = 5
+
+
+def get_component(output):
+    """
+    :param output: Path of a build output, relative to the build directory
+    :return: Name of the TF-M component the output belongs to
+    """
+    output = output.replace("\\", "/")
+    for name, pattern in COMPONENTS:
+        match = pattern.search(output)
+        if match:
+            if name.endswith(":"):
+                return name + match.group(1)
+            return name
+    return "other"
+
+
+def _get_tail_digest(data):
+    """
+    :param data: Content of a Ninja log
+    :return: Digest of its end, which changes if Ninja recompacts the log
+    """
+    return hashlib.sha256(data[-TAIL_SIZE:]).hexdigest()
+
+
+def get_log_offset(build_dir):
+    """
+    :param build_dir: Ninja build directory
+    :return: (size of its log, digest of the end of the log), to read only
+             the steps of the next build, None if there is no log
+    """
+    try:
+        with open(os.path.join(build_dir, NINJA_LOG), "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    return len(data), _get_tail_digest(data)
+
+
+def _get_last_run(entries):
+    """
+    :param entries: Entries of a Ninja log, in the order they were logged
+    :return: The entries of the last build. Ninja logs the steps of a build
+             as they finish, with times relative to its start, so the end
+             times only decrease where a build starts.
+    """
+    first = len(entries) - 1
+    while first > 0 and entries[first - 1][1] <= entries[first][1]:
+        first -= 1
+    first = max(first, 0)
+    return entries[first:]
+
+
+def read_ninja_log(path, offset=None):
+    """
+    Read the steps of a Ninja log
+    :param path: Path of the .ninja_log
+    :param offset: Result of get_log_offset() before the build, only the
+                   steps logged after it are read. Without an offset, or if
+                   Ninja recompacted the log since, the steps of the last
+                   build are read: the log accumulates every build.
+    :return: List of dict with the "output", "start" and "end" in seconds
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    header, __, log = data.partition(b"\n")
+    if not header.startswith(b"# ninja log v"):
+        raise ValueError("%s is not a Ninja log" % path)
+
+    last_run = True
+    if offset:
+        size, tail = offset
+        if size <= len(data) and _get_tail_digest(data[:size]) == tail:
+            log = data[size:]
+            last_run = False
+
+    entries = []
+    for line in log.decode("utf-8", "replace").split("\n"):
+        fields = line.split("\t")
+        if len(fields) != 5 or line.startswith("#"):
+            continue
+        start, end, __, output, command_hash = fields
+        entries.append((int(start), int(end), output, command_hash))
+    if last_run:
+        entries = _get_last_run(entries)
+
+    steps = {}
+    for start, end, output, command_hash in entries:
+        # A step with several outputs is logged once per output
+        key = (start, end, command_hash)
+        if key in steps:
+            continue
+        steps[key] = {
+            "output": output,
+            "start": start / 1000,
+            "end": end / 1000,
+        }
+    return sorted(steps.values(), key=lambda step: step["start"])
+
+
+def _exclusive_times(steps):
+    """
+    :param steps: Steps from read_ninja_log()
+    :return: List of the time each step ran with no other step running
+    """
+    events = sorted(
+        [(step["start"], 1, i) for i, step in enumerate(steps)]
+        + [(step["end"], -1, i) for i, step in enumerate(steps)]
+    )
+    exclusive = [0.0] * len(steps)
+    running = set()
+    last = None
+    for time, change, i in events:
+        if len(running) == 1 and last is not None:
+            exclusive[next(iter(running))] += time - last
+        if change > 0:
+            running.add(i)
+        else:
+            running.discard(i)
+        last = time
+    return exclusive
+
+
+def analyse(steps, top=TOP_STEPS):
+    """
+    :param steps: Steps from read_ninja_log()
+    :param top: Number of slowest steps and links reported
+    :return: dict with the build duration, CPU-seconds in total and per
+             component, the slowest steps, and the links which ran alone
+             the longest
+    """
+    if not steps:
+        return None
+
+    wall = max(s["end"] for s in steps) - min(s["start"] for s in steps)
+    cpu = sum(s["end"] - s["start"] for s in steps)
+    components = {}
+    for step in steps:
+        name = get_component(step["output"])
+        component = components.setdefault(name, {"seconds": 0, "steps": 0})
+        component["seconds"] += step["end"] - step["start"]
+        component["steps"] += 1
+    for component in components.values():
+        component["seconds"] = round(component["seconds"], 1)
+
+    slowest = sorted(steps, key=lambda s: s["start"] - s["end"])[:top]
+    # Links the other steps had to wait for
+    links = []
+    for step, alone in zip(steps, _exclusive_times(steps)):
+        if step["output"].endswith(LINK_OUTPUTS) and alone > 0:
+            links.append(
+                {
+                    "output": step["output"],
+                    "seconds": round(step["end"] - step["start"], 1),
+                    "alone_seconds": round(alone, 1),
+                }
+            )
+
+    links.sort(key=lambda link: -link["alone_seconds"])
+    return {
+        "steps": len(steps),
+        "wall_seconds": round(wall, 1),
+        "cpu_seconds": round(cpu, 1),
+        "parallelism": round(cpu / wall, 2) if wall else None,
+        "components": components,
+        "slowest": [
+            {
+                "output": s["output"],
+                "component": get_component(s["output"]),
+                "seconds": round(s["end"] - s["start"], 1),
+            }
+            for s in slowest
+        ],
+        "serial_links": links[:top],
+    }
+
+
+def load_reports(reports_dir=BUILD_REPORTS_DIR):
+    """
+    :param reports_dir: Build reports directory
+    :return: List of the recorded analyses, oldest first
+    """
+    try:
+        with open(os.path.join(reports_dir, REPORT_NAME + ".jsonl")) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def compare(previous, current):
+    """
+    :param previous: Earlier analysis of the same build
+    :param current: New analysis
+    :return: List of (component, previous seconds, current seconds) of the
+             components which got notably slower
+    """
+    growth = []
+    for name, component in sorted(current["components"].items()):
+        before = previous["components"].get(name, {"seconds": 0})["seconds"]
+        after = component["seconds"]
+        limit = max(
+            before * (1 + GROWTH_THRESHOLD), before + GROWTH_MIN_SECONDS
+        )
+        if after > limit:
+            growth.append((name, before, after))
+    return growth
+
+
+def log_analysis(analysis):
+    """
+    :param analysis: Result of analyse()
+    """
+    logging.info(
+        "%d steps, %.1f CPU-seconds in %.1fs (parallelism %.1f)",
+        analysis["steps"],
+        analysis["cpu_seconds"],
+        analysis["wall_seconds"],
+        analysis["parallelism"] or 0,
+    )
+    for name, component in sorted(
+        analysis["components"].items(), key=lambda item: -item[1]["seconds"]
+    ):
+        logging.info(
+            "  %-32s %8.1fs %5d steps",
+            name,
+            component["seconds"],
+            component["steps"],
+        )
+    logging.info("Slowest steps:")
+    for step in analysis["slowest"]:
+        logging.info(
+            "  %8.1fs %-24s %s",
+            step["seconds"],
+            step["component"],
+            step["output"],
+        )
+    if analysis["serial_links"]:
+        logging.info("Links the build waited for:")
+        for link in analysis["serial_links"]:
+            logging.info(
+                "  %8.1fs alone of %.1fs %s",
+                link["alone_seconds"],
+                link["seconds"],
+                link["output"],
+            )
+
+
+def _get_parser():
+    parser = argparse.ArgumentParser(
+        description="Analyse where the time of a Ninja build goes"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    show = subparsers.add_parser(
+        "show", help="Analyse the last build of a Ninja log"
+    )
+    show.add_argument(
+        "log",
+        help="Ninja log, or the build directory containing it",
+    )
+    show.add_argument(
+        "--top",
+        help="Number of slowest steps shown (default: %d)" % TOP_STEPS,
+        type=int,
+        default=TOP_STEPS,
+    )
+
+    history = subparsers.add_parser(
+        "history", help="Show the CPU-seconds of the recorded TF-M builds"
+    )
+    history.add_argument("-m", "--mcu", help="Only this target")
+    history.add_argument("-s", "--suite", help="Only this suite")
+    return parser
+
+
+def _main():
+    """
+    Analyse a Ninja log or show the analyses recorded by build_tfm.py
+    """
+    args = _get_parser().parse_args()
+
+    if args.command == "show":
+        path = args.log
+        if os.path.isdir(path):
+            path = os.path.join(path, NINJA_LOG)
+        try:
+            analysis = analyse(read_ninja_log(path), args.top)
+        except (OSError, ValueError) as e:
+            logging.critical(str(e))
+            sys.exit(1)
+        if analysis:
+            log_analysis(analysis)
+        return
+
+    for report in load_reports():
+        if args.mcu and report["target"] != args.mcu:
+            continue
+        if args.suite and report["suite"] != args.suite:
+            continue
+        top = sorted(
+            report["components"].items(), key=lambda item: -item[1]["seconds"]
+        )[:3]
+        print(
+            "%s  %-12s %-8s %-14s %-24s %-22s %7.0f CPU-s  %s"
+            % (
+                report["time"],
+                report["target"],
+                report["toolchain"],
+                report["config"],
+                report["suite"] or "-",
+                report["tfm_version"],
+                report["cpu_seconds"],
+                ", ".join("%s %.0f" % (n, c["seconds"]) for n, c in top),
+            )
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[Ninja-Log] %(asctime)s: %(message)s.",
+        datefmt="%H:%M:%S",
+    )
+    _main()
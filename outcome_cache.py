@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2021 ARM Limited. All rights reserved.
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import argparse
+import hashlib
+import json
+import logging
+import time
+from atomic_write import file_sha256, write_file_atomically
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+
+OUTCOMES_DIR = os.path.join(ROOT, ".cache", "outcomes")
+
+
+class OutcomeCache:
+    """
+    Outcomes of test runs, keyed by everything which decides the outcome:
+    the image, the target, the expected output and the runner. A suite
+    whose image and expectations already passed does not need to run again.
+
+    :param root: Directory of the outcomes, one file per key
+    """
+
+    def __init__(self, root=OUTCOMES_DIR):
+        self.root = root
+
+    @staticmethod
+    def get_key(image, target, compare_log, runner):
+        """
+        :param image: Path of the test image
+        :param target: Target name
+        :param compare_log: Path of the compare log
+        :param runner: Name and version of the test runner
+        :return: Key of the outcome of the test
+        """
+        data = json.dumps(
+            [
+                file_sha256(image),
+                target,
+                file_sha256(compare_log),
+                runner,
+            ]
+        )
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root, key + ".json")
+
+    def lookup(self, key):
+        """
+        :param key: Key from get_key()
+        :return: Recorded outcome, None if there is none
+        """
+        try:
+            with open(self._path(key)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def store(self, key, outcome):
+        """
+        Record the outcome of a test run
+        :param key: Key from get_key()
+        :param outcome: dict with at least "passed", "target" and "suite"
+        """
+        outcome = dict(outcome, recorded=time.time())
+        write_file_atomically(
+            self._path(key), json.dumps(outcome, indent=2, sort_keys=True)
+        )
+
+    def list(self):
+        """
+        :return: List of (key, outcome), oldest first
+        """
+        outcomes = []
+        if os.path.isdir(self.root):
+            for name in os.listdir(self.root):
+                if name.endswith(".json"):
+                    key = name[: -len(".json")]
+                    outcome = self.lookup(key)
+                    if outcome:
+                        outcomes.append((key, outcome))
+        return sorted(outcomes, key=lambda item: item[1]["recorded"])
+
+    def invalidate(self, target=None, suite=None):
+        """
+        Forget recorded outcomes
+        :param target: Only forget the outcomes of this target
+        :param suite: Only forget the outcomes of this suite
+        :return: Number of outcomes forgotten
+        """
+        count = 0
+        for key, outcome in self.list():
+            if target and outcome.get("target") != target:
+                continue
+            if suite and outcome.get("suite", "").lower() != suite.lower():
+                continue
+            os.unlink(self._path(key))
+            count += 1
+        return count
+
+
+def _get_parser():
+    parser = argparse.ArgumentParser(
+        description="Manage the recorded test outcomes"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("list", help="List the recorded outcomes")
+
+    invalidate = subparsers.add_parser(
+        "invalidate", help="Forget recorded outcomes so the tests run again"
+    )
+    invalidate.add_argument(
+        "-m", "--mcu", help="Only the outcomes of a target", default=None
+    )
+    invalidate.add_argument(
+        "-s", "--suite", help="Only the outcomes of a suite", default=None
+    )
+
+    return parser
+
+
+def _main():
+    """
+    List or forget recorded test outcomes
+    """
+    args = _get_parser().parse_args()
+    cache = OutcomeCache()
+
+    if args.command == "list":
+        for key, outcome in cache.list():
+            print(
+                "%s  %s  %-12s %-24s %-4s %6.1fs  %s"
+                % (
+                    key[:12],
+                    time.strftime(
+                        "%Y-%m-%d %H:%M", time.localtime(outcome["recorded"])
+                    ),
+                    outcome["target"],
+                    outcome["suite"],
+                    "pass" if outcome["passed"] else "fail",
+                    outcome.get("duration") or 0,
+                    outcome["runner"],
+                )
+            )
+    else:
+        count = cache.invalidate(args.mcu, args.suite)
+        logging.info("Forgot %d outcome(s)", count)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[Outcome-Cache] %(asctime)s: %(message)s.",
+        datefmt="%H:%M:%S",
+    )
+    _main()
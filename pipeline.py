@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2021 ARM Limited. All rights reserved.
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import sys
+import time
+import logging
+from event_log import log_event, event_context
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Task kinds, each kind has its own concurrency limit
+CPU = "cpu"
+IO = "io"
+
+
+def _contains(path, other):
+    """
+    :param path: File or directory
+    :param other: Another path
+    :return: True if other is path or is under it
+    """
+    path = os.path.normpath(path)
+    return other == path or other.startswith(path + os.sep)
+
+
+class Task:
+    """
+    A step of the pipeline with its dependencies, inputs and outputs
+
+    :param name: Unique task name
+    :param action: Callable run without arguments, fails by raising or
+                   calling sys.exit() with a non-zero code
+    :param deps: Names of the tasks which must complete first
+    :param inputs: Paths read by the task
+    :param outputs: Paths written by the task
+    :param kind: CPU or IO
+    :param cost: Estimated duration in seconds, used for planning
+    :param checkpoint: Whether the task is recorded in the run journal and
+                       skipped on resume, False for cheap tasks whose side
+                       effects are not files, which always run
+    """
+
+    def __init__(
+        self, name, action, deps, inputs, outputs, kind, cost, checkpoint
+    ):
+        self.name = name
+        self.action = action
+        self.deps = list(deps)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.kind = kind
+        self.cost = cost
+        self.checkpoint = checkpoint
+
+
+class Pipeline:
+    """
+    A graph of tasks which runs every task as soon as its dependencies
+    have completed, within separate limits for CPU and I/O bound tasks
+    """
+
+    def __init__(self):
+        self.tasks = {}
+
+    def add(
+        self,
+        name,
+        action,
+        deps=(),
+        inputs=(),
+        outputs=(),
+        kind=CPU,
+        cost=1,
+        checkpoint=True,
+    ):
+        """
+        Declare a task
+        :return: Name of the task, to be used in the deps of other tasks
+        """
+        if name in self.tasks:
+            raise Exception("Duplicate task %s" % name)
+        for dep in deps:
+            if dep not in self.tasks:
+                raise Exception("Task %s depends on unknown %s" % (name, dep))
+
+        self.tasks[name] = Task(
+            name, action, deps, inputs, outputs, kind, cost, checkpoint
+        )
+        return name
+
+    def topological_order(self):
+        """
+        :return: Task names, every task after its dependencies
+        """
+        # Tasks can only depend on tasks declared before them, so the
+        # declaration order is already a topological order.
+        return list(self.tasks)
+
+    def affected_tasks(self, paths):
+        """
+        Find the tasks to run again after some paths changed: the tasks
+        reading one of the paths, then the tasks reading what these write.
+        Dependencies which only order the tasks do not make a task run.
+
+        :param paths: Changed paths, relative like the task inputs
+        :return: Names of the affected tasks, every task after its
+                 dependencies
+        """
+        changed = {os.path.normpath(p) for p in paths}
+        affected = []
+        for name in self.topological_order():
+            task = self.tasks[name]
+            if any(_contains(i, p) for i in task.inputs for p in changed):
+                affected.append(name)
+                changed.update(os.path.normpath(p) for p in task.outputs)
+        return affected
+
+    def _bottom_levels(self):
+        """
+        Length of the most expensive path from each task to the end of the
+        pipeline, including the task itself
+
+        :return: tuple (dict of levels, dict of next task on that path)
+        """
+        levels = {}
+        successor = {}
+        dependents = {name: [] for name in self.tasks}
+        for task in self.tasks.values():
+            for dep in task.deps:
+                dependents[dep].append(task.name)
+
+        for name in reversed(self.topological_order()):
+            best = None
+            for d in dependents[name]:
+                if best is None or levels[d] > levels[best]:
+                    best = d
+            successor[name] = best
+            levels[name] = self.tasks[name].cost + (
+                levels[best] if best else 0
+            )
+
+        return levels, successor
+
+    def critical_path(self):
+        """
+        :return: tuple (task names on the critical path, estimated seconds)
+        """
+        if not self.tasks:
+            return [], 0
+
+        levels, successor = self._bottom_levels()
+        name = max(self.topological_order(), key=lambda n: levels[n])
+        total = levels[name]
+        path = []
+        while name:
+            path.append(name)
+            name = successor[name]
+        return path, total
+
+    def print_plan(self):
+        """
+        Log the task graph and its critical path
+        """
+        for name in self.topological_order():
+            task = self.tasks[name]
+            logging.info(
+                "%s [%s, ~%ds] <- %s",
+                name,
+                task.kind,
+                task.cost,
+                ", ".join(task.deps) if task.deps else "(none)",
+            )
+            for path in task.inputs:
+                logging.info("    in:  %s", path)
+            for path in task.outputs:
+                logging.info("    out: %s", path)
+
+        path, total = self.critical_path()
+        logging.info("Critical path (~%ds): %s", total, " -> ".join(path))
+
+    def _run_task(self, task, journal=None, fingerprint=None):
+        """
+        Run a task in a worker thread
+        :param journal: Optional RunJournal to record the task in
+        :param fingerprint: Input fingerprint of the task for the journal
+        :return: True if the task succeeded
+        """
+        log_event("task", "Starting %s", task.name, status="started")
+        start = time.monotonic()
+        try:
+            with event_context(step=task.name):
+                task.action()
+        except SystemExit as e:
+            if e.code:
+                return False
+        except Exception:
+            logging.exception("Task %s failed", task.name)
+            return False
+
+        duration = time.monotonic() - start
+        if journal and task.checkpoint:
+            journal.record(task, fingerprint, duration)
+        log_event(
+            "task",
+            "Finished %s in %.1fs",
+            task.name,
+            duration,
+            status="finished",
+            duration=duration,
+        )
+        return True
+
+    def run(
+        self, cpu_jobs=1, io_jobs=1, journal=None, resume=False, tasks=None
+    ):
+        """
+        Run every task, exits if any of them fails
+        :param cpu_jobs: Maximum number of CPU bound tasks run at once
+        :param io_jobs: Maximum number of I/O bound tasks run at once
+        :param journal: Optional RunJournal recording the completed tasks
+        :param resume: Skip the tasks the journal records as complete and
+                       still valid, otherwise the journal starts afresh
+        :param tasks: Only run these tasks, the others are taken as
+                      complete
+        """
+        limits = {CPU: cpu_jobs, IO: io_jobs}
+        active = {CPU: 0, IO: 0}
+        levels, __ = self._bottom_levels()
+        # Start the tasks with the longest remaining path first
+        pending = sorted(self.topological_order(), key=lambda n: -levels[n])
+        done = set()
+        if tasks is not None:
+            done = set(self.tasks) - set(tasks)
+            pending = [n for n in pending if n not in done]
+        fingerprints = {}
+
+        if journal:
+            fingerprints = journal.fingerprints(self)
+            if resume:
+                journal.load()
+                completed = journal.completed_tasks(self, fingerprints)
+                done |= completed
+                pending = [n for n in pending if n not in done]
+                for name in self.topological_order():
+                    if name in completed:
+                        logging.info("Skipping %s, already complete", name)
+            else:
+                journal.reset()
+
+        failed = []
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=cpu_jobs + io_jobs) as executor:
+            while pending or running:
+                # Stop starting tasks after a failure, but let the running
+                # ones finish.
+                if not failed:
+                    for name in list(pending):
+                        task = self.tasks[name]
+                        if active[task.kind] >= limits[task.kind]:
+                            continue
+                        if all(d in done for d in task.deps):
+                            pending.remove(name)
+                            active[task.kind] += 1
+                            future = executor.submit(
+                                self._run_task,
+                                task,
+                                journal,
+                                fingerprints.get(name),
+                            )
+                            running[future] = task
+
+                if not running:
+                    break
+
+                finished, __ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    task = running.pop(future)
+                    active[task.kind] -= 1
+                    if future.result():
+                        done.add(task.name)
+                    else:
+                        failed.append(task.name)
+
+        if failed:
+            logging.critical(
+                "Failed: %s, %d task(s) not run",
+                ", ".join(failed),
+                len(pending),
+            )
+            sys.exit(1)
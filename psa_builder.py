@@ -22,42 +22,33 @@ import sys
 import subprocess
 import logging
 import stat
+import functools
+import json
+import time
+import threading
+import contextlib
+import re
+from concurrent.futures import ThreadPoolExecutor
 
 try:
-    import yaml
-except ImportError as e:
-    print(str(e) + " To install it, type:")
-    print("python3 -m pip install PyYAML")
-    exit(1)
-
-dependencies = {
-    "released-tfm": {
-        "trusted-firmware-m": [
-            "https://git.trustedfirmware.org/TF-M/trusted-firmware-m.git",
-            "TF-Mv1.4.0",
-        ],
-    },
-    "latest-tfm": {
-        "trusted-firmware-m": [
-            "https://git.trustedfirmware.org/TF-M/trusted-firmware-m.git",
-            "master",
-        ],
-    },
-    "nuvoton-tfm": {
-        "trusted-firmware-m": [
-            "https://github.com/OpenNuvoton/trusted-firmware-m",
-            "nuvoton_mbed_m2354_tfm-1.4",
-        ],
-    },
-}
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+from atomic_write import write_file_atomically, get_write_stats
+from event_log import log_event, event_context
 
 TC_DICT = {"ARMCLANG": "ARM", "GNUARM": "GCC_ARM"}
 
 SUPPORTED_TFM_PSA_CONFIGS = ["PsaApiTestIPC"]
+SUPPORTED_TFM_BENCHMARK_CONFIGS = ["BenchmarkIPC"]
 SUPPORTED_TFM_CONFIGS = [
     "CoreIPC",  # Default config
     "RegressionIPC",
 ] + SUPPORTED_TFM_PSA_CONFIGS
+SUPPORTED_TFM_CONFIGS += SUPPORTED_TFM_BENCHMARK_CONFIGS
 
 PSA_SUITE_CHOICES = [
     "CRYPTO",
@@ -73,12 +64,55 @@ mbed_path = os.path.join(ROOT, "mbed-os")
 TF_M_RELATIVE_PATH = "platform/FEATURE_EXPERIMENTAL_API/FEATURE_PSA/TARGET_TFM/TARGET_TFM_LATEST"
 sys.path.insert(0, mbed_path)
 TF_M_BUILD_DIR = os.path.join(ROOT, "tfm", "repos")
-POPEN_INSTANCE = None
+BUILD_REPORTS_DIR = os.path.join(ROOT, "build_reports")
+# Repositories of each dependency set, and the commits they resolved to
+DEPENDENCIES_MANIFEST = os.path.join(ROOT, "dependencies.yaml")
+DEPENDENCIES_LOCK = os.path.join(ROOT, "dependencies.lock")
+# Repositories resolved or fetched at the same time
+FETCH_JOBS = 4
+# Child processes currently running, terminated on Ctrl+C
+POPEN_INSTANCES = set()
+
+# Resource usage of child processes is appended to the JSON lines file
+# named by this variable, which is shared with the child build scripts.
+RUSAGE_LOG_ENV = "TFM_RUSAGE_LOG"
+# Tags of the records, inherited by the child build scripts
+RUSAGE_CONTEXT_ENV = "TFM_RUSAGE_CONTEXT"
+RUSAGE_DEPTH_ENV = "TFM_RUSAGE_DEPTH"
+RUSAGE_FIELDS = [
+    "wall",
+    "user",
+    "sys",
+    "max_rss",
+    "inblock",
+    "oublock",
+    "nvcsw",
+    "nivcsw",
+]
+_RUSAGE_CONTEXT = threading.local()
+_RUSAGE_LOCK = threading.Lock()
+# Heavy modules, the Mbed OS tools and PyYAML, are only imported by the
+# functions which need them, so --help and argument errors stay fast.
+TARGETS_JSON = os.path.join(mbed_path, "targets", "targets.json")
+
 
-from tools.targets import Target, TARGET_MAP, TARGET_NAMES
+# Set once all tools are found, until clear_caches(). A missing tool is
+# looked for again on every check, so it can be installed while the build
+# server runs.
+_dependencies_found = False
 
 
 def are_dependencies_installed():
+    """
+    Check the tools the scripts run are installed. Success is cached for
+    the life of the process, e.g. the build server's.
+
+    :return: errorcode
+    """
+    global _dependencies_found
+    if _dependencies_found:
+        return 0
+
     def _is_cmake_installed():
         """
         Check if Cmake is installed
@@ -135,6 +169,7 @@ def are_dependencies_installed():
         logging.error('"mbedgt" is not installed. Exiting..')
         return -1
     else:
+        _dependencies_found = True
         return 0
 
 
@@ -150,19 +185,24 @@ def run_cmd_and_return(command, output=False):
     :return: Return either output from child process or error code
     """
 
-    global POPEN_INSTANCE
     with open(os.devnull, "w") as fnull:
+        start = time.monotonic()
         try:
-            POPEN_INSTANCE = subprocess.Popen(
-                command, stdout=subprocess.PIPE, stderr=fnull
+            popen_instance = subprocess.Popen(
+                command,
+                stdout=subprocess.PIPE,
+                stderr=fnull,
+                env=_get_child_env(None),
             )
         except FileNotFoundError:
-            logging.error("Command not found: " + command[0])
+            logging.error("Command not found: %s", command[0])
             return -1
 
-        std_out, __ = POPEN_INSTANCE.communicate()
-        retcode = POPEN_INSTANCE.returncode
-        POPEN_INSTANCE = None
+        POPEN_INSTANCES.add(popen_instance)
+        std_out = popen_instance.stdout.read()
+        popen_instance.stdout.close()
+        retcode = _wait_and_record(popen_instance, command, start)
+        POPEN_INSTANCES.discard(popen_instance)
 
         if output:
             return std_out.decode("utf-8")
@@ -170,7 +210,9 @@ def run_cmd_and_return(command, output=False):
             return retcode
 
 
-def run_cmd_output_realtime(command, cmake_build_dir):
+def run_cmd_output_realtime(
+    command, cmake_build_dir, env=None, prefix="", on_line=None
+):
     """
     Run the command in the system and print output in realtime.
     Commands are passed as a list of tokens.
@@ -179,109 +221,434 @@ def run_cmd_output_realtime(command, cmake_build_dir):
 
     :param command: System command as a list of tokens
     :param cmake_build_dir: Cmake build directory
+    :param env: Environment of the child process, defaults to ours
+    :param prefix: Text put in front of every line of output
+    :param on_line: Function called with the time each line of output is
+                    received and the line
     :return: Return the error code from child process
     """
-    global POPEN_INSTANCE
-    POPEN_INSTANCE = subprocess.Popen(
+    start = time.monotonic()
+    popen_instance = subprocess.Popen(
         command,
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT,
         cwd=cmake_build_dir,
+        env=_get_child_env(env),
     )
-    for line in iter(POPEN_INSTANCE.stdout.readline, b""):
-        logging.info(line.decode("utf-8").strip("\n"))
-
-    POPEN_INSTANCE.communicate()
-    retcode = POPEN_INSTANCE.returncode
-    POPEN_INSTANCE = None
+    POPEN_INSTANCES.add(popen_instance)
+    for line in iter(popen_instance.stdout.readline, b""):
+        line = line.decode("utf-8").strip("\n")
+        if on_line:
+            on_line(time.time(), line)
+        log_event("output", "%s%s", prefix, line)
+
+    popen_instance.stdout.close()
+    retcode = _wait_and_record(popen_instance, command, start)
+    POPEN_INSTANCES.discard(popen_instance)
     return retcode
 
 
-def check_and_clone_repo(name, deps, dir):
+def _get_rusage_context():
     """
-    Check if the repositories are already cloned. If not clone them
-    :param name: Name of the git repository
-    :param deps: Dictionary containing dependency details
-    :param dir: Directory to perform cloning
+    :return: Tags of the resource usage records of the current thread
     """
+    if not hasattr(_RUSAGE_CONTEXT, "tags"):
+        _RUSAGE_CONTEXT.tags = json.loads(
+            os.environ.get(RUSAGE_CONTEXT_ENV, "{}")
+        )
+    return _RUSAGE_CONTEXT.tags
 
-    gitref = dependencies[deps].get(name)[1]
-    tfm_dir = os.path.join(dir, name)
-    if not os.path.isdir(tfm_dir):
-        logging.info("Cloning %s repo", name)
-        cmd = [
-            "git",
-            "-C",
-            dir,
-            "clone",
-            "-o",
-            deps,
-            "-b",
-            gitref,
-            dependencies[deps].get(name)[0],
-        ]
-        ret = run_cmd_and_return(cmd)
-        if ret != 0:
-            logging.critical("Failed to clone %s repo, error: %d", name, ret)
-            sys.exit(1)
 
-        logging.info("Cloned %s repo successfully", name)
+@contextlib.contextmanager
+def rusage_context(**tags):
+    """
+    Tag the resource usage of the child processes started in this thread,
+    e.g. with the pipeline phase, target and suite
+    """
+    saved = _get_rusage_context()
+    _RUSAGE_CONTEXT.tags = dict(saved, **tags)
+    try:
+        # Log events carry the same tags
+        with event_context(**tags):
+            yield
+    finally:
+        _RUSAGE_CONTEXT.tags = saved
+
+
+def _get_child_env(env):
+    """
+    Return the environment of a child process, with the resource usage
+    tags of the current thread
+    :param env: Environment requested by the caller, None for ours
+    """
+    if RUSAGE_LOG_ENV not in os.environ:
+        return env
+
+    env = dict(os.environ if env is None else env)
+    env[RUSAGE_CONTEXT_ENV] = json.dumps(_get_rusage_context())
+    env[RUSAGE_DEPTH_ENV] = str(int(os.environ.get(RUSAGE_DEPTH_ENV, 0)) + 1)
+    return env
+
+
+def _wait_and_record(popen_instance, command, start):
+    """
+    Wait for a child process and log its resource usage
+    :param popen_instance: Child process
+    :param command: Command of the child process
+    :param start: time.monotonic() when the child was started
+    :return: Exit code of the child process
+    """
+    if not hasattr(os, "wait4") or RUSAGE_LOG_ENV not in os.environ:
+        return popen_instance.wait()
+
+    __, status, rusage = os.wait4(popen_instance.pid, 0)
+    if os.WIFSIGNALED(status):
+        popen_instance.returncode = -os.WTERMSIG(status)
     else:
-        logging.info(
-            "%s repo exists, fetching latest from remote %s", name, deps
+        popen_instance.returncode = os.WEXITSTATUS(status)
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    max_rss = rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    # The program and its first argument, e.g. "cmake --build"
+    name = [os.path.basename(command[0])] + list(command[1:2])
+    record = dict(
+        _get_rusage_context(),
+        command=" ".join(name),
+        exit=popen_instance.returncode,
+        depth=int(os.environ.get(RUSAGE_DEPTH_ENV, 0)),
+        wall=round(time.monotonic() - start, 3),
+        user=round(rusage.ru_utime, 3),
+        sys=round(rusage.ru_stime, 3),
+        max_rss=max_rss,
+        inblock=rusage.ru_inblock,
+        oublock=rusage.ru_oublock,
+        nvcsw=rusage.ru_nvcsw,
+        nivcsw=rusage.ru_nivcsw,
+    )
+    with _RUSAGE_LOCK, open(os.environ[RUSAGE_LOG_ENV], "a") as f:
+        f.write(json.dumps(record, sort_keys=True) + "\n")
+
+    return popen_instance.returncode
+
+
+def start_rusage_log():
+    """
+    Start logging the resource usage of child processes, unless a parent
+    build script already does
+    :return: True if this process owns the log and writes its summary
+    """
+    if RUSAGE_LOG_ENV in os.environ:
+        return False
+
+    if not os.path.isdir(BUILD_REPORTS_DIR):
+        os.makedirs(BUILD_REPORTS_DIR, exist_ok=True)
+    os.environ[RUSAGE_LOG_ENV] = os.path.join(
+        BUILD_REPORTS_DIR, time.strftime("rusage-%Y%m%d-%H%M%S.jsonl")
+    )
+    return True
+
+
+def finish_rusage_log():
+    """
+    Stop logging the resource usage and summarize the log of this run per
+    phase and command, next to the log
+    :return: Path of the summary, None if no process was logged
+    """
+    log_path = os.environ.pop(RUSAGE_LOG_ENV)
+    if not os.path.isfile(log_path):
+        return None
+    with open(log_path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+
+    def _add(groups, name, record):
+        group = groups.setdefault(
+            name, dict({field: 0 for field in RUSAGE_FIELDS}, count=0)
         )
-        cmd = [
-            "git",
-            "-C",
-            tfm_dir,
-            "remote",
-            "get-url",
-            deps,
-        ]
-        ret = run_cmd_and_return(cmd)
-        if ret != 0:
-            logging.info("%s is not a remote, adding it", deps)
-            cmd = [
-                "git",
-                "-C",
-                tfm_dir,
-                "remote",
-                "add",
-                deps,
-                dependencies[deps].get(name)[0],
+        group["count"] += 1
+        for field in RUSAGE_FIELDS:
+            if field == "max_rss":
+                group[field] = max(group[field], record[field])
+            else:
+                group[field] = round(group[field] + record[field], 3)
+
+    # Children of child build scripts are already counted in the usage
+    # of the script, so only the top level adds up to the run's total.
+    total = {}
+    phases = {}
+    commands = {}
+    for record in records:
+        if record["depth"] == 0:
+            _add(total, "all", record)
+            _add(phases, record.get("phase") or "other", record)
+        _add(commands, record["command"], record)
+
+    summary = {
+        "log": os.path.basename(log_path),
+        "processes": len(records),
+        "total": total.get("all"),
+        "phases": phases,
+        "commands": commands,
+    }
+    summary_path = os.path.splitext(log_path)[0] + "-summary.json"
+    write_file_atomically(
+        summary_path, json.dumps(summary, indent=2, sort_keys=True)
+    )
+    logging.info("Resource usage summary written to %s", summary_path)
+    return summary_path
+
+
+def _resolve_ref(url, ref):
+    """
+    Find the commit a git reference points to in a remote repository
+    :param url: URL or path of the repository
+    :param ref: Branch, tag or commit SHA
+    :return: Tuple of the commit SHA and whether the ref is a branch
+    """
+    if re.fullmatch("[0-9a-f]{40}", ref):
+        return ref, False
+
+    output = run_cmd_and_return(
+        ["git", "ls-remote", url, ref, ref + "^{}"], True
+    )
+    if not isinstance(output, str):
+        raise Exception("Failed to run git ls-remote")
+
+    refs = {}
+    for line in output.splitlines():
+        sha, name = line.split("\t", 1)
+        refs[name] = sha
+
+    # An annotated tag is peeled to the commit it points to
+    for name in [
+        "refs/tags/%s^{}" % ref,
+        "refs/tags/%s" % ref,
+        "refs/heads/%s" % ref,
+        ref,
+    ]:
+        if name in refs:
+            return refs[name], name.startswith("refs/heads/")
+
+    raise Exception("Failed to resolve %s in %s" % (ref, url))
+
+
+def _load_lock(lock_path):
+    """
+    :param lock_path: Path of the lockfile
+    :return: dict of dependency set to {repository: {url, ref, sha}}
+    """
+    try:
+        with open(lock_path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+@functools.lru_cache(maxsize=None)
+def load_dependencies(manifest=DEPENDENCIES_MANIFEST):
+    """
+    Load the dependency manifest. The result is cached, call clear_caches()
+    when the file has changed.
+
+    :param manifest: Path of the manifest
+    :return: dict of dependency set to {repository: {url, ref}}
+    """
+    with open(manifest) as f:
+        return _load_yaml(f)
+
+
+def resolve_dependencies(
+    deps,
+    update_lock=False,
+    manifest=DEPENDENCIES_MANIFEST,
+    lock_path=DEPENDENCIES_LOCK,
+):
+    """
+    Find the commits of the repositories of a dependency set. The commits
+    pinned in the lockfile are used as long as the URL and ref of their
+    repository are unchanged in the manifest, the others are resolved from
+    the remotes concurrently and added to the lockfile. A branch follows
+    its remote on every run unless it was pinned with update_lock.
+
+    :param deps: Name of the dependency set
+    :param update_lock: If True resolve all refs again and pin branches
+    :param manifest: Path of the manifest
+    :param lock_path: Path of the lockfile
+    :return: dict of repository name to {url, ref, sha}
+    """
+    repos = load_dependencies(manifest).get(deps)
+    if not repos:
+        logging.critical("Unknown dependency set %s in %s", deps, manifest)
+        sys.exit(1)
+
+    lock = _load_lock(lock_path)
+    locked = lock.get(deps, {})
+    resolved = {}
+    unresolved = []
+    for name, repo in repos.items():
+        entry = locked.get(name, {})
+        if (
+            not update_lock
+            and entry.get("url") == repo["url"]
+            and entry.get("ref") == repo["ref"]
+            and (entry.get("pinned") or not entry.get("branch"))
+        ):
+            resolved[name] = entry
+        else:
+            unresolved.append(name)
+
+    if unresolved:
+        logging.info("Resolving %s", ", ".join(unresolved))
+        with ThreadPoolExecutor(max_workers=FETCH_JOBS) as executor:
+            futures = [
+                executor.submit(
+                    _resolve_ref, repos[name]["url"], repos[name]["ref"]
+                )
+                for name in unresolved
             ]
-            ret = run_cmd_and_return(cmd)
-            if ret != 0:
-                logging.critical("Failed to add remote %s", deps)
+        for name, future in zip(unresolved, futures):
+            try:
+                sha, branch = future.result()
+            except Exception as e:
+                logging.critical("%s: %s", name, str(e))
                 sys.exit(1)
+            resolved[name] = dict(repos[name], sha=sha)
+            if branch:
+                resolved[name].update(branch=True, pinned=update_lock)
+
+    if locked != resolved:
+        lock[deps] = resolved
+        write_file_atomically(
+            lock_path, json.dumps(lock, indent=2, sort_keys=True) + "\n"
+        )
+        logging.info("Updated %s", lock_path)
+
+    return resolved
+
 
-        cmd = ["git", "-C", tfm_dir, "fetch", deps]
-        ret = run_cmd_and_return(cmd)
-        if ret != 0:
-            logging.critical(
-                "Failed to fetch the latest %s, error: %d", name, ret
+def _git(args, error):
+    """
+    Run a git command, raising an exception if it fails
+    :param args: Arguments of git
+    :param error: Message of the exception
+    """
+    ret = run_cmd_and_return(["git"] + args)
+    if ret != 0:
+        raise Exception("%s, error: %d" % (error, ret))
+
+
+def _checkout_repo(name, deps, entry, dir):
+    """
+    Clone a repository if needed and check out its locked commit, fetching
+    from the remote only when the commit is not present yet
+
+    :param name: Name of the git repository
+    :param deps: Name of the dependency set, used as the remote name
+    :param entry: Lock entry of the repository
+    :param dir: Directory to perform cloning
+    """
+    repo_dir = os.path.join(dir, name)
+    sha = entry["sha"]
+    if not os.path.isdir(repo_dir):
+        logging.info("Cloning %s repo", name)
+        _git(
+            ["-C", dir, "clone", "--no-checkout", "-o", deps]
+            + [entry["url"], name],
+            "Failed to clone %s repo" % name,
+        )
+    else:
+        url = run_cmd_and_return(
+            ["git", "-C", repo_dir, "remote", "get-url", deps], True
+        )
+        if not url:
+            logging.info("%s is not a remote of %s, adding it", deps, name)
+            _git(
+                ["-C", repo_dir, "remote", "add", deps, entry["url"]],
+                "Failed to add remote %s to %s" % (deps, name),
             )
-            sys.exit(1)
-
-        logging.info("Checking out %s..", gitref)
-        # try gitref as a remote branch
-        head = deps + "/" + gitref
-        cmd = ["git", "-C", tfm_dir, "checkout", "-B", gitref, head]
-        ret = run_cmd_and_return(cmd)
-        if ret != 0:
-            logging.info(
-                "%s is not a remote branch, trying %s directly", head, gitref
+        elif url.strip() != entry["url"]:
+            _git(
+                ["-C", repo_dir, "remote", "set-url", deps, entry["url"]],
+                "Failed to set the URL of remote %s of %s" % (deps, name),
+            )
+
+        head = run_cmd_and_return(
+            ["git", "-C", repo_dir, "rev-parse", "HEAD"], True
+        )
+        if head.strip() == sha:
+            logging.info("%s is already at %s", name, sha[:12])
+            return
+
+    cmd = ["git", "-C", repo_dir, "cat-file", "-e", sha + "^{commit}"]
+    if run_cmd_and_return(cmd) != 0:
+        logging.info("Fetching %s from remote %s", name, deps)
+        _git(
+            ["-C", repo_dir, "fetch", "--tags", deps],
+            "Failed to fetch %s" % name,
+        )
+        if run_cmd_and_return(cmd) != 0:
+            # The commit is not on a branch or tag of the remote
+            _git(
+                ["-C", repo_dir, "fetch", deps, sha],
+                "Failed to fetch %s of %s" % (sha, name),
             )
-            # gitref might be a tag or SHA1 which we checkout directly
-            cmd = ["git", "-C", tfm_dir, "checkout", gitref]
-            ret = run_cmd_and_return(cmd)
-            if ret != 0:
-                logging.critical(
-                    "Failed to checkout %s, error: %d", gitref, ret
-                )
-                sys.exit(1)
 
-        logging.info("Checked out %s successfully", gitref)
+    logging.info("Checking out %s of %s (%s)", sha[:12], name, entry["ref"])
+    _git(
+        ["-C", repo_dir, "checkout", "--detach", sha],
+        "Failed to checkout %s of %s" % (sha, name),
+    )
+
+
+def check_and_clone_repos(
+    deps,
+    dir,
+    update_lock=False,
+    manifest=DEPENDENCIES_MANIFEST,
+    lock_path=DEPENDENCIES_LOCK,
+):
+    """
+    Clone or update all repositories of a dependency set concurrently and
+    check out the commits pinned in the lockfile
+
+    :param deps: Name of the dependency set in the manifest
+    :param dir: Directory to perform cloning
+    :param update_lock: If True resolve all refs again
+    :param manifest: Path of the manifest
+    :param lock_path: Path of the lockfile
+    :return: dict of repository name to {url, ref, sha}
+    """
+    resolved = resolve_dependencies(deps, update_lock, manifest, lock_path)
+
+    with ThreadPoolExecutor(max_workers=FETCH_JOBS) as executor:
+        futures = [
+            (name, executor.submit(_checkout_repo, name, deps, entry, dir))
+            for name, entry in sorted(resolved.items())
+        ]
+
+    failed = False
+    for name, future in futures:
+        try:
+            future.result()
+        except Exception as e:
+            logging.critical(str(e))
+            failed = True
+    if failed:
+        sys.exit(1)
+
+    logging.info("Checked out %s successfully", ", ".join(sorted(resolved)))
+    return resolved
+
+
+def terminate_children():
+    """
+    Terminate the child processes still running and wait for them
+    """
+    for popen_instance in list(POPEN_INSTANCES):
+        try:
+            popen_instance.terminate()
+            popen_instance.wait()
+        except:
+            pass
 
 
 def exit_gracefully(signum, frame):
@@ -290,26 +657,108 @@ def exit_gracefully(signum, frame):
     :param signum: Signal number
     :param frame:  Current stack frame object
     """
-    logging.info("Received signal %s, exiting.." % signum)
-    global POPEN_INSTANCE
-    try:
-        if POPEN_INSTANCE:
-            POPEN_INSTANCE.terminate()
-            while not POPEN_INSTANCE.poll():
-                continue
-    except:
-        pass
+    logging.info("Received signal %s, exiting..", signum)
+    terminate_children()
 
     sys.exit(0)
 
 
+def _load_yaml(stream):
+    """
+    :param stream: YAML file object
+    :return: Parsed content
+    """
+    try:
+        import yaml
+    except ImportError as e:
+        print(str(e) + " To install it, type:")
+        print("python3 -m pip install PyYAML")
+        exit(1)
+
+    return yaml.safe_load(stream)
+
+
+def get_target(name):
+    """
+    :param name: Target name
+    :return: Mbed OS Target, the Mbed OS tools are loaded on first use
+    """
+    from tools.targets import TARGET_MAP
+
+    return TARGET_MAP[name]
+
+
+@functools.lru_cache(maxsize=None)
+def _load_targets_json():
+    """
+    Load Mbed OS targets.json. The result is cached, call clear_caches()
+    when the file has changed.
+
+    :return: dict of target name to its JSON data
+    """
+    try:
+        with open(TARGETS_JSON) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        logging.critical("%s not found, is Mbed OS deployed?", TARGETS_JSON)
+        sys.exit(1)
+
+
 def get_tfm_secure_targets():
     """
     Creates a list of TF-M secure targets from Mbed OS targets.json.
 
+    Like the is_TFM_target property of the Mbed OS tools, a target is a
+    TF-M target if it or one of the targets it inherits from sets
+    tfm_target_name. Reading targets.json directly avoids loading the
+    Mbed OS tools just to list or validate targets.
+
     :return: List of TF-M secure targets.
     """
-    return [str(t) for t in TARGET_NAMES if Target.get_target(t).is_TFM_target]
+    targets = _load_targets_json()
+
+    def _is_tfm_target(name):
+        # Depth-first, like the resolution order of the Mbed OS tools
+        pending = [name]
+        while pending:
+            data = targets.get(pending.pop(0), {})
+            if "tfm_target_name" in data:
+                return bool(data["tfm_target_name"])
+            pending = list(data.get("inherits", [])) + pending
+        return False
+
+    return [t for t in targets if _is_tfm_target(t)]
+
+
+@functools.lru_cache(maxsize=None)
+def load_ns_import_yaml():
+    """
+    Load tfm_ns_import.yaml. The result is cached, call clear_caches()
+    when the file has changed.
+
+    :return: Parsed content of tfm_ns_import.yaml
+    """
+    with open(
+        os.path.join(os.path.dirname(__file__), "tfm_ns_import.yaml")
+    ) as ns_import:
+        return _load_yaml(ns_import)
+
+
+def clear_caches():
+    """
+    Drop the cached Mbed OS targets, tfm_ns_import.yaml and dependency
+    manifest content so they are reloaded on next use, and check the
+    installed tools again
+    """
+    global _dependencies_found
+    _dependencies_found = False
+    load_ns_import_yaml.cache_clear()
+    load_dependencies.cache_clear()
+    _load_targets_json.cache_clear()
+    if "tools.targets" in sys.modules:
+        from tools.targets import set_targets_json_location
+
+        set_targets_json_location()
 
 
 def get_tfm_regression_targets():
@@ -320,17 +769,56 @@ def get_tfm_regression_targets():
 
     :return: List of supported TF-M regression targets.
     """
-    with open(
-        os.path.join(os.path.dirname(__file__), "tfm_ns_import.yaml")
-    ) as ns_import:
-        yaml_data = yaml.safe_load(ns_import)
-        mbed_os_data = yaml_data["mbed-os"]
+    mbed_os_data = load_ns_import_yaml()["mbed-os"]
 
-        regression_targets = list(
-            set(get_tfm_secure_targets()) & set(mbed_os_data)
-        )
+    regression_targets = list(
+        set(get_tfm_secure_targets()) & set(mbed_os_data)
+    )
+
+    return regression_targets
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """
+    Hold an exclusive lock on a file for the duration of a block, waiting
+    while another process holds it. The lock file is created if needed.
+
+    :param path: Path of the lock file
+    """
+    with open(path, "a+") as f:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after 10 seconds
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def append_build_report(name, record):
+    """
+    Append a record to a JSON lines report in the build reports directory
+    :param name: Report name, the file is build_reports/<name>.jsonl
+    :param record: JSON serializable dictionary
+    """
+    if not os.path.isdir(BUILD_REPORTS_DIR):
+        os.makedirs(BUILD_REPORTS_DIR, exist_ok=True)
 
-        return regression_targets
+    with open(os.path.join(BUILD_REPORTS_DIR, name + ".jsonl"), "a") as f:
+        f.write(json.dumps(record, sort_keys=True) + "\n")
 
 
 def handle_read_permission_error(func, path, exc_info):
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2021 ARM Limited. All rights reserved.
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import sys
+import argparse
+import json
+import logging
+import shutil
+from atomic_write import file_sha256
+from psa_builder import (
+    ROOT,
+    TC_DICT,
+    PSA_SUITE_CHOICES,
+    mbed_path,
+    TF_M_RELATIVE_PATH,
+    write_file_atomically,
+)
+
+# Kept out of the Mbed CLI 1 build by .mbedignore: blobs must only be
+# linked through the libraries activated in test/lib/TOOLCHAIN_*.
+STORE_DIR = os.path.join(ROOT, "test", "lib", "store")
+
+
+def get_tfm_version():
+    """
+    Return the TF-M version the Mbed OS TF-M files were last built from
+    :return: Version read from VERSION.txt, "unknown" if there is none
+    """
+    version_file = os.path.join(mbed_path, TF_M_RELATIVE_PATH, "VERSION.txt")
+    try:
+        with open(version_file) as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        version = ""
+
+    return version.replace("/", "_") or "unknown"
+
+
+def _get_store_dir(target, toolchain, tfm_version):
+    """
+    :param target: Target name
+    :param toolchain: ARMCLANG or GNUARM
+    :param tfm_version: TF-M version
+    :return: Store directory of the target, toolchain and TF-M version
+    """
+    return os.path.join(STORE_DIR, target, toolchain, tfm_version)
+
+
+def _load_index(store_dir):
+    """
+    :param store_dir: Store directory
+    :return: dict of suite to {library name: digest}
+    """
+    try:
+        with open(os.path.join(store_dir, "index.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def store_libs(libs, target, toolchain, suite, tfm_version=None):
+    """
+    Add the PSA compliance libraries of a suite to the store. Each content
+    is only stored once, so the libraries shared by the suites take no
+    extra space.
+
+    :param libs: dict of library name to the path of the built library
+    :param target: Target name
+    :param toolchain: ARMCLANG or GNUARM
+    :param suite: PSA test suite
+    :param tfm_version: TF-M version, defaults to the current one
+    """
+    store_dir = _get_store_dir(
+        target, toolchain, tfm_version or get_tfm_version()
+    )
+    blobs_dir = os.path.join(store_dir, "blobs")
+    if not os.path.isdir(blobs_dir):
+        os.makedirs(blobs_dir)
+
+    entries = {}
+    for name, src in sorted(libs.items()):
+        digest = file_sha256(src)
+        blob = os.path.join(blobs_dir, digest)
+        if not os.path.isfile(blob):
+            logging.info("Storing %s for %s as %s", name, suite, digest[:12])
+            shutil.copyfile(src, blob + ".tmp")
+            os.replace(blob + ".tmp", blob)
+        entries[name] = digest
+
+    index = _load_index(store_dir)
+    if index.get(suite) != entries:
+        index[suite] = entries
+        write_file_atomically(
+            os.path.join(store_dir, "index.json"),
+            json.dumps(index, indent=2, sort_keys=True),
+        )
+
+
+def activate_libs(target, toolchain, suite, tfm_version=None):
+    """
+    Make the stored libraries of a suite the ones Mbed OS links with.
+    Libraries already matching are left untouched so the link step does
+    not see a new input; the others are copied with a new timestamp.
+
+    :param target: Target name
+    :param toolchain: ARMCLANG or GNUARM
+    :param suite: PSA test suite
+    :param tfm_version: TF-M version, defaults to the current one
+    :return: Number of libraries replaced
+    """
+    store_dir = _get_store_dir(
+        target, toolchain, tfm_version or get_tfm_version()
+    )
+    entries = _load_index(store_dir).get(suite)
+    if not entries:
+        raise Exception(
+            "No libraries stored for %s %s %s in %s"
+            % (target, toolchain, suite, store_dir)
+        )
+
+    output_dir = os.path.join(
+        ROOT, "test", "lib", "TOOLCHAIN_" + TC_DICT[toolchain]
+    )
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    replaced = 0
+    for name, digest in sorted(entries.items()):
+        dst = os.path.join(output_dir, name)
+        if os.path.isfile(dst) and file_sha256(dst) == digest:
+            logging.info("%s is up to date", name)
+            continue
+
+        logging.info("Activating %s of %s", name, suite)
+        # A copy rather than a link: the build tools compare timestamps,
+        # and the blob's may be older than the last link.
+        shutil.copyfile(os.path.join(store_dir, "blobs", digest), dst + ".tmp")
+        os.replace(dst + ".tmp", dst)
+        replaced += 1
+
+    return replaced
+
+
+def list_store():
+    """
+    :return: List of (target, toolchain, TF-M version, suite) stored
+    """
+    stored = []
+    if not os.path.isdir(STORE_DIR):
+        return stored
+
+    for target in sorted(os.listdir(STORE_DIR)):
+        for toolchain in sorted(os.listdir(os.path.join(STORE_DIR, target))):
+            toolchain_dir = os.path.join(STORE_DIR, target, toolchain)
+            for version in sorted(os.listdir(toolchain_dir)):
+                store_dir = os.path.join(toolchain_dir, version)
+                for suite in sorted(_load_index(store_dir)):
+                    stored.append((target, toolchain, version, suite))
+    return stored
+
+
+def _get_parser():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    activate = subparsers.add_parser(
+        "activate", help="Link the stored libraries of a suite"
+    )
+    activate.add_argument("-m", "--mcu", help="Target name", required=True)
+    activate.add_argument(
+        "-t",
+        "--toolchain",
+        help="Toolchain",
+        required=True,
+        choices=["ARMCLANG", "GNUARM"],
+    )
+    activate.add_argument(
+        "-s",
+        "--suite",
+        help="PSA test suite",
+        required=True,
+        choices=PSA_SUITE_CHOICES,
+    )
+    activate.add_argument(
+        "--tfm-version",
+        help="TF-M version (default: the version of the last TF-M build)",
+        default=None,
+    )
+
+    subparsers.add_parser("list", help="List the stored suites")
+
+    return parser
+
+
+def _main():
+    """
+    Manage the store of PSA compliance test libraries
+    """
+    parser = _get_parser()
+    args = parser.parse_args()
+
+    if args.command == "activate":
+        try:
+            activate_libs(
+                args.mcu, args.toolchain, args.suite, args.tfm_version
+            )
+        except Exception as e:
+            logging.critical(str(e))
+            sys.exit(1)
+    else:
+        for stored in list_store():
+            print(" ".join(stored))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[PSA-Lib-Store] %(asctime)s: %(message)s.",
+        datefmt="%H:%M:%S",
+    )
+    _main()
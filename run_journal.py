@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2021 ARM Limited. All rights reserved.
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from atomic_write import file_sha256
+from psa_builder import run_cmd_and_return, write_file_atomically
+
+JOURNAL_VERSION = 1
+
+
+def path_digest(path):
+    """
+    Fingerprint a file or directory
+
+    Files are hashed by content. Git checkouts are identified by their
+    HEAD, the status of their files and the content of the files which
+    differ from HEAD or are untracked and not ignored, other directories by
+    the names, sizes and modification times of their files.
+
+    :param path: Path of the file or directory
+    :return: Hex digest, or None if the path does not exist
+    """
+    if os.path.isfile(path):
+        return file_sha256(path)
+
+    sha = hashlib.sha256()
+    if os.path.isdir(os.path.join(path, ".git")):
+        head = run_cmd_and_return(
+            ["git", "-C", path, "rev-parse", "HEAD"], True
+        )
+        status = run_cmd_and_return(
+            ["git", "-C", path, "status", "--porcelain", "-uall"], True
+        )
+        sha.update(str((head, status)).encode("utf-8"))
+        # Editing a file which is already modified leaves the status as is
+        dirty = set()
+        for command in [
+            ["diff", "HEAD", "--name-only", "-z"],
+            ["ls-files", "--others", "--exclude-standard", "-z"],
+        ]:
+            output = run_cmd_and_return(["git", "-C", path] + command, True)
+            if isinstance(output, str):
+                dirty.update(name for name in output.split("\0") if name)
+        for name in sorted(dirty):
+            file_path = os.path.join(path, name)
+            if os.path.isfile(file_path):
+                sha.update(str((name, file_sha256(file_path))).encode("utf-8"))
+    elif os.path.isdir(path):
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for f in sorted(filenames):
+                file_path = os.path.join(dirpath, f)
+                st = os.stat(file_path)
+                sha.update(
+                    str(
+                        (
+                            os.path.relpath(file_path, path),
+                            st.st_size,
+                            st.st_mtime_ns,
+                        )
+                    ).encode("utf-8")
+                )
+    else:
+        return None
+
+    return sha.hexdigest()
+
+
+class RunJournal:
+    """
+    Persistent record of the pipeline tasks completed by a run, so that a
+    failed run can be resumed from the first incomplete or invalid task
+
+    :param path: Path of the journal file
+    :param params: Parameters identifying the run, e.g. target and
+                   toolchain. Records of a run with other parameters are
+                   never reused.
+    :param root: Directory the task inputs and outputs are relative to
+    """
+
+    def __init__(self, path, params, root):
+        self.path = path
+        self.params = params
+        self.root = root
+        self.records = {}
+        self.lock = threading.Lock()
+
+    def load(self):
+        """
+        Load the records of the previous run if it had the same parameters
+        """
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+
+        if (
+            data.get("version") == JOURNAL_VERSION
+            and data.get("params") == self.params
+        ):
+            self.records = data["tasks"]
+        else:
+            logging.info("Journal %s is for another run, ignoring", self.path)
+
+    def _save(self):
+        write_file_atomically(
+            self.path,
+            json.dumps(
+                {
+                    "version": JOURNAL_VERSION,
+                    "params": self.params,
+                    "tasks": self.records,
+                },
+                indent=2,
+                sort_keys=True,
+            ),
+        )
+
+    def reset(self):
+        """
+        Drop all records, for a run which starts from scratch
+        """
+        with self.lock:
+            self.records = {}
+            self._save()
+
+    def fingerprints(self, pipeline):
+        """
+        Compute the input fingerprint of every task.
+
+        A task's fingerprint covers its name, the run parameters, the
+        fingerprints of its dependencies and the content of its inputs
+        which are not produced by another task of the pipeline.
+
+        :param pipeline: Pipeline
+        :return: dict of task name to fingerprint
+        """
+        produced = set()
+        for task in pipeline.tasks.values():
+            produced.update(task.outputs)
+
+        fingerprints = {}
+        for name in pipeline.topological_order():
+            task = pipeline.tasks[name]
+            sources = [
+                (p, path_digest(os.path.join(self.root, p)))
+                for p in task.inputs
+                if p not in produced
+            ]
+            data = [
+                name,
+                self.params,
+                [fingerprints[d] for d in task.deps],
+                sources,
+            ]
+            fingerprints[name] = hashlib.sha256(
+                json.dumps(data, sort_keys=True).encode("utf-8")
+            ).hexdigest()
+
+        return fingerprints
+
+    def completed_tasks(self, pipeline, fingerprints):
+        """
+        Find the tasks which do not need to run again.
+
+        A task is complete when it is recorded with the same fingerprint and
+        either its outputs are unchanged, or they have since been replaced
+        by later tasks but every task consuming them is complete. A task is
+        only skipped if all its checkpointed dependencies are skipped too.
+
+        :param pipeline: Pipeline
+        :param fingerprints: Result of fingerprints()
+        :return: Set of task names to skip
+        """
+        order = pipeline.topological_order()
+        dependents = {name: [] for name in order}
+        for task in pipeline.tasks.values():
+            for dep in task.deps:
+                if pipeline.tasks[dep].checkpoint and task.checkpoint:
+                    dependents[dep].append(task.name)
+
+        valid = {}
+        for name in reversed(order):
+            task = pipeline.tasks[name]
+            record = self.records.get(name)
+            if not task.checkpoint or not record:
+                valid[name] = False
+                continue
+            if record["fingerprint"] != fingerprints[name]:
+                valid[name] = False
+                continue
+
+            outputs_unchanged = all(
+                path_digest(os.path.join(self.root, p)) == digest
+                for p, digest in record["outputs"].items()
+            )
+            valid[name] = outputs_unchanged or (
+                bool(dependents[name])
+                and all(valid[d] for d in dependents[name])
+            )
+
+        skipped = set()
+        for name in order:
+            task = pipeline.tasks[name]
+            if valid[name] and all(
+                d in skipped for d in task.deps if pipeline.tasks[d].checkpoint
+            ):
+                skipped.add(name)
+
+        return skipped
+
+    def record(self, task, fingerprint, duration):
+        """
+        Record a completed task
+        :param task: Task
+        :param fingerprint: Input fingerprint of the task
+        :param duration: Duration of the task in seconds
+        """
+        outputs = {
+            p: path_digest(os.path.join(self.root, p)) for p in task.outputs
+        }
+        with self.lock:
+            self.records[task.name] = {
+                "fingerprint": fingerprint,
+                "outputs": outputs,
+                "duration": round(duration, 1),
+                "completed": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            }
+            self._save()
@@ -25,13 +25,48 @@ import signal
 import logging
 import json
 import shutil
+import time
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from psa_builder import *
-
-logging.basicConfig(
-    level=logging.INFO,
-    format="[Test-Target] %(asctime)s: %(message)s.",
-    datefmt="%H:%M:%S",
-)
+import event_log
+from pipeline import Pipeline, CPU, IO
+from run_journal import RunJournal
+from job_slots import JobSlotPool, parse_size
+from workspace_pool import DEFAULT_BUDGET
+from flash_planner import FlashPlanner
+from outcome_cache import OutcomeCache
+import test_timing
+import crypto_benchmark
+import footprint
+from file_watch import FileWatcher, DEFAULT_DEBOUNCE
+
+event_log.configure("Test-Target")
+
+# Set by build_server.py so TF-M builds run in the server process
+IN_PROCESS = False
+
+# Job slots shared by the TF-M and Mbed OS builds, set up by _main()
+JOB_SLOTS = None
+
+JOURNAL_DIR = join(ROOT, ".journal")
+
+# Build groups of all targets and toolchains built, merged by every run
+TEST_SPEC_FILE = "test_spec.json"
+# Single group test specs, one per Greentea run
+TEST_SPECS_DIR = join(ROOT, ".cache", "test_specs")
+
+# Rough duration of each kind of build task in seconds, used by --plan to
+# find the critical path and to start the longest chains first
+TASK_COSTS = {
+    "clone": 60,
+    "config": 1,
+    "tfm": 300,
+    "mbed-os": 240,
+    "image": 2,
+    "bundle": 20,
+    "spec": 1,
+}
 
 
 def _get_baud_rate():
@@ -45,47 +80,252 @@ def _get_baud_rate():
     return json_object["target_overrides"]["*"]["platform.stdio-baud-rate"]
 
 
-def _set_json_param(regression, compliance, sync):
+def _get_variant(regression, compliance, benchmark, sync):
+    """
+    Return the name of the Mbed OS build variant for the given config
+    :param regression: regression build
+    :param compliance: compliance build
+    :param benchmark: crypto benchmark build
+    :param sync: waiting for sync from Greentea host
+    :return: variant name, also used as its build directory name
+    """
+    if regression:
+        variant = "regression"
+    elif compliance:
+        variant = "compliance"
+    elif benchmark:
+        variant = "benchmark"
+    else:
+        variant = "default"
+
+    if not sync:
+        variant += "-nosync"
+
+    return variant
+
+
+def _get_variant_dir(args, variant):
+    """
+    Return the directory holding all the Mbed OS builds of a variant,
+    relative to ROOT
+    :param args: Command-line arguments
+    :param variant: Build variant
+    """
+    return join("BUILD" if args.cli == 1 else "cmake_build", variant)
+
+
+def _write_config_overlay(
+    args, variant, regression, compliance, benchmark, sync
+):
     """
-    Set json parameter required for Mbed OS build
+    Generate the application config of a build variant from mbed_app.json.
+    mbed_app.json itself is left untouched, and the overlay is only
+    rewritten when its content changes so the variant's build stays
+    incremental.
+
+    :param args: Command-line arguments
+    :param variant: Build variant
     :param regression: set regression build
     :param compliance: set compliance build
+    :param benchmark: set crypto benchmark build
     :param sync: set waiting for sync from Greentea host
+    :return: path of the generated config, relative to ROOT
     """
-    with open("mbed_app.json", "r") as json_file:
+    with open(join(ROOT, "mbed_app.json"), "r") as json_file:
         json_object = json.load(json_file)
-        json_file.close()
 
     json_object["config"]["regression-test"] = regression
     json_object["config"]["psa-compliance-test"] = compliance
+    json_object["config"]["crypto-benchmark"] = benchmark
     json_object["config"]["wait-for-sync"] = sync
+    content = json.dumps(json_object, indent=4)
 
-    with open("mbed_app.json", "w") as json_file:
-        json.dump(json_object, json_file, indent=4)
-        json_file.close()
+    overlay = join(_get_variant_dir(args, variant), "mbed_app.json")
+    write_file_atomically(join(ROOT, overlay), content)
+    return overlay
 
 
-def _build_mbed_os(args):
+def _build_mbed_os(args, variant):
     """
     Build Mbed OS
     :param args: Command-line arguments
+    :param variant: Build variant
+    """
+    with JOB_SLOTS.acquire("mbed-os:" + variant) as jobs:
+        _run_mbed_os_build(args, variant, jobs)
+
+
+def _run_mbed_os_build(args, variant, jobs):
+    """
+    Run the Mbed OS build commands
+    :param args: Command-line arguments
+    :param variant: Build variant
+    :param jobs: Number of parallel compile jobs
+    """
+    app_config = join(_get_variant_dir(args, variant), "mbed_app.json")
+    build_dir = _get_mbed_os_build_dir(args, variant)
+
+    if args.cli == 1:
+        cmds = [
+            [
+                "mbed",
+                "compile",
+                "-m",
+                args.mcu,
+                "-t",
+                TC_DICT.get(args.toolchain),
+                "--app-config",
+                app_config,
+                "--build",
+                build_dir,
+                "-j",
+                str(jobs),
+            ]
+        ]
+    else:
+        # `mbedtools compile` always builds in cmake_build/, so configure
+        # the variant's build directory and drive CMake directly.
+        cmds = [
+            [
+                "mbedtools",
+                "configure",
+                "-m",
+                args.mcu,
+                "-t",
+                TC_DICT.get(args.toolchain),
+                "--app-config",
+                app_config,
+                "-o",
+                build_dir,
+            ],
+            [
+                "cmake",
+                "-S",
+                ".",
+                "-B",
+                build_dir,
+                "-GNinja",
+                "-DCMAKE_BUILD_TYPE=develop",
+            ],
+            ["cmake", "--build", build_dir, "-j", str(jobs)],
+        ]
+
+    for cmd in cmds:
+        retcode = run_cmd_output_realtime(cmd, ROOT)
+        if retcode:
+            logging.critical("Unable to build Mbed OS target - %s", args.mcu)
+            sys.exit(1)
+
+    _report_footprint(args, variant, build_dir)
+
+
+def _report_footprint(args, variant, build_dir):
+    """
+    Measure the flash and RAM used by the non-secure image against the
+    non-secure regions of the target and append the footprint to
+    build_reports/footprint.jsonl
+    :param args: Command-line arguments
+    :param variant: Build variant
+    :param build_dir: Mbed OS build directory, relative to ROOT
+    """
+    path = join(ROOT, build_dir, "mbed-os-tf-m-regression-tests.elf")
+    if not os.path.isfile(path):
+        logging.info("No ELF image in %s, footprint not measured", build_dir)
+        return
+
+    target_dir = join(
+        TF_M_BUILD_DIR,
+        "trusted-firmware-m",
+        "platform",
+        "ext",
+        "target",
+        get_target(args.mcu).tfm_target_name,
+    )
+    defines = {}
+    if get_target(args.mcu).tfm_bootloader_supported:
+        defines["BL2"] = "1"
+    try:
+        macros = footprint.read_layout(
+            [join(target_dir, "partition"), target_dir], defines
+        )
+        limits = footprint.get_limits(macros, "non-secure") if macros else None
+        analysis = footprint.analyse_elf(path, limits)
+    except (OSError, ValueError) as e:
+        logging.info("Unable to measure the footprint: %s", e)
+        return
+
+    footprint.log_footprint("non-secure", analysis)
+    try:
+        # Version of the TF-M release the image is linked with
+        with open(join(mbed_path, TF_M_RELATIVE_PATH, "VERSION.txt")) as f:
+            tfm_version = f.read().strip()
+    except OSError:
+        tfm_version = None
+    append_build_report(
+        footprint.REPORT_NAME,
+        {
+            "target": args.mcu,
+            "toolchain": TC_DICT.get(args.toolchain),
+            "config": variant,
+            "profile": None,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "tfm_version": tfm_version,
+            "images": {"non-secure": analysis},
+        },
+    )
+
+
+def _run_build_tfm(args, options):
+    """
+    Run build_tfm.py for the target
+    :param args: Command-line arguments
+    :param options: Additional build_tfm.py options
     """
-    build_tool = "mbed" if args.cli == 1 else "mbedtools"
     cmd = [
-        build_tool,
-        "compile",
+        # On Windows, python3 interpreter can be python.exe instead of python3.exe.
+        "python3" if shutil.which("python3") is not None else "python",
+        "build_tfm.py",
         "-m",
         args.mcu,
         "-t",
-        TC_DICT.get(args.toolchain),
-    ]
-
-    retcode = run_cmd_output_realtime(cmd, ROOT)
+        args.toolchain,
+    ] + options
+    if args.verbose:
+        cmd.append("--verbose")
+    if args.log_json:
+        cmd += ["--log-json", args.log_json]
+
+    if IN_PROCESS:
+        # Running inside the build server: reuse its warm state
+        # instead of starting a new interpreter.
+        import build_tfm
+
+        try:
+            build_tfm._main(cmd[2:])
+            retcode = 0
+        except SystemExit as e:
+            retcode = e.code
+    else:
+        retcode = run_cmd_output_realtime(cmd, ROOT)
     if retcode:
-        logging.critical("Unable to build Mbed OS target - %s", args.mcu)
+        logging.critical("Unable to build TF-M for target - %s", args.mcu)
         sys.exit(1)
 
 
+def _clone_tfm(args):
+    """
+    Clone or update TF-M once for all the builds
+    :param args: Command-line arguments
+    """
+    options = ["--clone-only"]
+    if args.clean:
+        options.append("--clean")
+    if args.update_lock:
+        options.append("--update-lock")
+
+    _run_build_tfm(args, options)
+
+
 def _build_tfm(args, config, suite=None):
     """
     Build TF-M regression test
@@ -93,60 +333,93 @@ def _build_tfm(args, config, suite=None):
     :param config: Config type
     :param suite: Test suite for PSA compliance
     """
-    cmd = [
-        # On Windows, python3 interpreter can be python.exe instead of python3.exe.
-        "python3" if shutil.which("python3") is not None else "python",
-        "build_tfm.py",
-        "-m",
-        args.mcu,
-        "-t",
-        args.toolchain,
-        "-c",
-        config,
-    ]
+    options = ["-c", config, "--skip-clone"]
 
     if config in SUPPORTED_TFM_PSA_CONFIGS:
-        cmd.append("-s")
-        cmd.append(suite)
+        options.append("-s")
+        options.append(suite)
 
-    if args.clean:
-        cmd.append("--clean")
+    if args.workspace_pool:
+        options.extend(
+            ["--workspace-pool", "--workspace-budget", args.workspace_budget]
+        )
 
-    if args.skip_clone:
-        cmd.append("--skip-clone")
+    if args.ccache:
+        options.append("--ccache")
+        if args.ccache_dir:
+            options.extend(["--ccache-dir", args.ccache_dir])
+        if args.ccache_max_size:
+            options.extend(["--ccache-max-size", args.ccache_max_size])
 
-    retcode = run_cmd_output_realtime(cmd, ROOT)
-    if retcode:
-        logging.critical("Unable to build TF-M for target - %s", args.mcu)
-        sys.exit(1)
+    with JOB_SLOTS.acquire("tfm:" + (suite or config)) as jobs:
+        _run_build_tfm(args, options + ["-j", str(jobs)])
 
 
-def _erase_flash_storage(args, suite):
+def _get_mbed_os_build_dir(args, variant):
     """
-    Creates a target specific binary which has its ITS erased
+    Return the Mbed OS build output directory, relative to ROOT
     :param args: Command-line arguments
-    :param suite: Test suite
-    :return: return binary name generated
+    :param variant: Build variant
     """
     if args.cli == 1:
-        mbed_os_dir = join(
-            ROOT, "BUILD", args.mcu, TC_DICT.get(args.toolchain)
+        return join(
+            _get_variant_dir(args, variant),
+            args.mcu,
+            TC_DICT.get(args.toolchain),
         )
     else:
-        mbed_os_dir = join(
-            ROOT,
-            "cmake_build",
+        return join(
+            _get_variant_dir(args, variant),
             args.mcu,
             "develop",
             TC_DICT.get(args.toolchain),
         )
 
-    cmd = []
 
-    binary_name = "mbed-os-tf-m-regression-tests-reset-flash-{}.hex".format(
-        suite
+def _pack_bundle(args, variant, suite):
+    """
+    Pack the build outputs of a suite into the artifact bundle
+    :param args: Command-line arguments
+    :param variant: Build variant
+    :param suite: Test suite
+    """
+    from artifact_bundle import pack_bundle
+
+    paths = [
+        _get_mbed_os_build_dir(args, variant),
+        join("test", "lib", "TOOLCHAIN_" + TC_DICT.get(args.toolchain)),
+        relpath(
+            join(mbed_path, "targets", get_target(args.mcu).tfm_delivery_dir),
+            ROOT,
+        ),
+    ]
+    pack_bundle(
+        args.bundle, paths, args.mcu, suite, TC_DICT.get(args.toolchain)
     )
 
+
+def _get_binary_name(suite):
+    """
+    Return the name of the image with flash storage erased for a suite
+    :param suite: Test suite
+    """
+    return "mbed-os-tf-m-regression-tests-reset-flash-{}.hex".format(suite)
+
+
+def _erase_flash_storage(args, variant, suite):
+    """
+    Creates a target specific binary which has its ITS erased
+    :param args: Command-line arguments
+    :param variant: Build variant
+    :param suite: Test suite
+    :return: return binary name generated
+    """
+    mbed_os_dir = join(ROOT, _get_mbed_os_build_dir(args, variant))
+
+    cmd = []
+
+    binary_name = _get_binary_name(suite)
+
     if args.mcu == "ARM_MUSCA_B1":
         cmd = [
             "srec_cat",
@@ -207,19 +480,474 @@ def _erase_flash_storage(args, suite):
     return binary_name
 
 
-def _execute_test():
+def _load_test_spec():
+    """
+    :return: Content of test_spec.json, empty if there is none
+    """
+    try:
+        with open(TEST_SPEC_FILE) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"builds": {}}
+
+
+def _merge_test_spec(test_spec, reset=False):
+    """
+    Add the suites of test_spec to test_spec.json, keeping the build groups
+    of the other targets and toolchains. The file is locked so that
+    concurrent runs for different targets do not lose each other's groups.
+
+    :param test_spec: test specification dictionary
+    :param reset: If True drop the groups already in test_spec.json
+    """
+    with file_lock(TEST_SPEC_FILE + ".lock"):
+        merged = {"builds": {}} if reset else _load_test_spec()
+        for test_group, build in test_spec["builds"].items():
+            if test_group in merged["builds"]:
+                merged["builds"][test_group]["tests"].update(build["tests"])
+            else:
+                merged["builds"][test_group] = build
+
+        write_file_atomically(TEST_SPEC_FILE, json.dumps(merged, indent=2))
+
+    logging.info(
+        "%s has %d build group(s)", TEST_SPEC_FILE, len(merged["builds"])
+    )
+
+
+def _get_group_test_spec(test_group, build):
     """
-    Execute greentea runs test as specified in test_spec.json
+    Make a test specification with a single build group, with absolute
+    paths so it can be stored anywhere
+    :param test_group: Test group name
+    :param build: Build group from test_spec.json
+    :return: test specification dictionary
     """
-    if not os.path.isfile("test_spec.json"):
+    base_path = os.path.abspath(build["base_path"])
+    tests = {}
+    for suite, test in build["tests"].items():
+        binaries = []
+        for binary in test["binaries"]:
+            binaries.append(
+                dict(
+                    binary,
+                    path=join(base_path, binary["path"]),
+                    compare_log=os.path.abspath(binary["compare_log"]),
+                )
+            )
+        tests[suite] = {"binaries": binaries}
+
+    build = dict(build, base_path=base_path, tests=tests)
+    return {"builds": {test_group: build}}
+
+
+def _get_runner_version(runner):
+    """
+    :param runner: mbedgt, or lean for host_runner.py
+    :return: Name and version of the test runner
+    """
+    if runner == "lean":
+        import host_runner
+
+        return "lean-" + host_runner.RUNNER_VERSION
+
+    version = run_cmd_and_return(["mbedgt", "--version"], True)
+    return "mbedgt-" + str(version).strip()
+
+
+def _run_test_groups(platform, test_groups, args):
+    """
+    Run build groups of one platform, one after the other as they share
+    the boards. With --reuse-results, suites whose image already passed
+    with the same compare log and runner are skipped.
+
+    :param platform: Target name
+    :param test_groups: dict of test group name to its test specification
+    :param args: Command-line arguments
+    :return: List of the groups which failed
+    """
+    cache = None
+    if args.reuse_results or args.force_rerun:
+        cache = OutcomeCache()
+        runner = _get_runner_version(args.runner)
+
+    failed = []
+    for test_group, test_spec in sorted(test_groups.items()):
+        build = test_spec["builds"][test_group]
+        keys = {}
+        for suite, test in sorted(build["tests"].items()):
+            if not cache:
+                break
+            binary = test["binaries"][0]
+            keys[suite] = cache.get_key(
+                binary["path"], platform, binary["compare_log"], runner
+            )
+            outcome = cache.lookup(keys[suite])
+            if args.force_rerun or not outcome or not outcome["passed"]:
+                continue
+            logging.info(
+                "[%s %s] Skipping, the same image passed on %s",
+                test_group,
+                suite,
+                time.strftime(
+                    "%Y-%m-%d %H:%M", time.localtime(outcome["recorded"])
+                ),
+            )
+            del build["tests"][suite]
+
+        if not build["tests"]:
+            continue
+
+        toolchain = build["toolchain"]
+        timer = test_timing.TestTimer()
+        benchmark = crypto_benchmark.BenchmarkParser()
+        output = _TestOutput(timer, benchmark)
+        # A group runs all its suites in one process, so its usage is
+        # tagged with the group rather than a suite
+        with rusage_context(
+            phase="test",
+            target=platform,
+            toolchain=toolchain,
+            test_group=test_group,
+        ):
+            if args.runner == "lean":
+                outcomes = _run_lean_test_group(
+                    platform, test_group, test_spec, args.full_flash, output
+                )
+            else:
+                outcomes = _run_greentea_test_group(
+                    test_group, test_spec, output
+                )
+
+        slower = _check_timing(platform, toolchain, test_group, timer, args)
+        if _check_benchmark(platform, toolchain, test_group, benchmark, args):
+            slower = True
+
+        for suite, outcome in sorted(outcomes.items()):
+            # Errors of the runner or the board say nothing of the image
+            if cache and outcome["result"] != "error":
+                # A group which got slower is not reused, so that the
+                # slowdown is reported again by the next run
+                outcome = dict(
+                    outcome,
+                    passed=outcome["passed"] and not slower,
+                    target=platform,
+                    toolchain=toolchain,
+                    suite=suite,
+                    runner=runner,
+                )
+                cache.store(keys[suite], outcome)
+        if slower or not all(o["passed"] for o in outcomes.values()):
+            failed.append(test_group)
+
+    return failed
+
+
+class _TestOutput:
+    """
+    Parsers of the serial output of the tests, each fed with every line and
+    the time it was received
+    """
+
+    def __init__(self, *parsers):
+        self.parsers = parsers
+
+    def feed(self, timestamp, line):
+        for parser in self.parsers:
+            parser.feed(timestamp, line)
+
+
+def _check_benchmark(platform, toolchain, test_group, benchmark, args):
+    """
+    Record the results of the crypto benchmark in
+    build_reports/crypto_benchmark.jsonl, and compare the throughputs with
+    the baseline of the platform and toolchain in test/benchmark
+
+    :param platform: Target name
+    :param toolchain: Toolchain of the build group, e.g. GCC_ARM
+    :param test_group: Test group name
+    :param benchmark: crypto_benchmark.BenchmarkParser fed with the output
+                      of the tests
+    :param args: Command-line arguments
+    :return: True if an operation got slower than the baseline allows
+    """
+    results = benchmark.get_results()
+    if not results:
+        return False
+
+    crypto_benchmark.log_results(results)
+    append_build_report(
+        "crypto_benchmark",
+        {
+            "target": platform,
+            "toolchain": toolchain,
+            "test_group": test_group,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "results": results,
+        },
+    )
+
+    path = crypto_benchmark.get_baseline_path(platform, toolchain)
+    if args.update_benchmark_baseline:
+        count = crypto_benchmark.update_baseline(path, results)
+        logging.info("[%s] Recorded %d throughputs", test_group, count)
+        return False
+
+    regressions = crypto_benchmark.compare(
+        crypto_benchmark.load_baseline(path),
+        results,
+        args.benchmark_threshold / 100,
+    )
+    for name, before, after in regressions:
+        logging.error(
+            "[%s] %s: %.2f ops/s, %.2f in the baseline",
+            test_group,
+            name,
+            after,
+            before,
+        )
+    return bool(regressions)
+
+
+def _check_timing(platform, toolchain, test_group, timer, args):
+    """
+    Record how long the suites and tests of a build group took on the
+    target in build_reports/test_timing.jsonl, and compare the durations
+    with the baseline of the platform and toolchain in test/timing
+
+    :param platform: Target name
+    :param toolchain: Toolchain of the build group, e.g. GCC_ARM
+    :param test_group: Test group name
+    :param timer: test_timing.TestTimer fed with the output of the tests
+    :param args: Command-line arguments
+    :return: True if a suite or test got slower than the baseline allows
+    """
+    timings = timer.get_results()
+    if not timings["suites"]:
+        return False
+
+    record = dict(
+        timings,
+        target=platform,
+        toolchain=toolchain,
+        test_group=test_group,
+        time=time.strftime("%Y-%m-%dT%H:%M:%S"),
+    )
+    append_build_report("test_timing", record)
+
+    path = test_timing.get_baseline_path(platform, toolchain)
+    if args.update_timing_baseline:
+        count = test_timing.update_baseline(path, timings)
+        logging.info("[%s] Recorded %d durations", test_group, count)
+        return False
+
+    regressions = test_timing.compare(
+        test_timing.load_baseline(path),
+        timings,
+        args.timing_threshold / 100,
+        args.timing_slack,
+    )
+    for name, before, after in regressions:
+        logging.error(
+            "[%s] %s took %.1fs on the target, %.1fs in the baseline",
+            test_group,
+            name,
+            after,
+            before,
+        )
+    return bool(regressions)
+
+
+def _run_greentea_test_group(test_group, test_spec, timer=None):
+    """
+    Run a build group with Greentea
+    :param test_group: Test group name
+    :param test_spec: test specification dictionary of the group
+    :param timer: Parser fed with the serial output of the tests and the
+                  time mbedhtrun received it, see _TestOutput
+    :return: dict of suite to its outcome
+    """
+
+    def _on_line(received, line):
+        received, line = test_timing.split_htrun_line(line)
+        if received is not None:
+            timer.feed(received, line)
+
+    # Greentea flashes whole images, what the lean runner recorded of the
+    # boards no longer holds
+    platform = test_spec["builds"][test_group]["platform"]
+    FlashPlanner().forget_target(platform)
+
+    spec_path = join(TEST_SPECS_DIR, test_group + ".json")
+    report_path = join(TEST_SPECS_DIR, test_group + "-report.json")
+    write_file_atomically(spec_path, json.dumps(test_spec, indent=2))
+    if os.path.isfile(report_path):
+        os.unlink(report_path)
+    cmd = [
+        "mbedgt",
+        "--test-spec",
+        spec_path,
+        "--polling-timeout",
+        "600",
+        "--report-json",
+        report_path,
+        "-V",
+    ]
+    start = time.monotonic()
+    retcode = run_cmd_output_realtime(
+        cmd,
+        os.getcwd(),
+        prefix="[%s] " % test_group,
+        on_line=_on_line if timer else None,
+    )
+    duration = time.monotonic() - start
+
+    try:
+        with open(report_path) as f:
+            report = json.load(f)
+    except (FileNotFoundError, ValueError):
+        report = {}
+
+    # The report has the results of each test under the name of its build
+    results = {}
+    for tests in report.values():
+        results.update(tests)
+
+    outcomes = {}
+    for suite in test_spec["builds"][test_group]["tests"]:
+        result = results.get(suite)
+        if result is None:
+            outcomes[suite] = {
+                "passed": False,
+                "result": "error",
+                "exit_code": retcode,
+                "duration": round(duration, 3),
+            }
+            continue
+
+        outcomes[suite] = {
+            "passed": result.get("single_test_result") == "OK",
+            "result": result.get("single_test_result"),
+            "duration": result.get("elapsed_time"),
+        }
+
+    return outcomes
+
+
+def _run_lean_test_group(
+    platform, test_group, test_spec, full_flash=False, timer=None
+):
+    """
+    Run a build group with host_runner.py on the first board of the platform.
+    Only the sectors which differ from the last image flashed to the board
+    are programmed, see flash_planner.py.
+
+    :param platform: Target name
+    :param test_group: Test group name
+    :param test_spec: test specification dictionary of the group
+    :param full_flash: If True program whole images
+    :param timer: Parser fed with the output of the tests, see _TestOutput
+    :return: dict of suite to its outcome
+    """
+    # Only imported when used, it needs termios which Windows lacks
+    import host_runner
+
+    build = test_spec["builds"][test_group]
+    board = host_runner.find_board(get_target(platform).detect_code)
+    if not board:
+        logging.error("No %s board is connected", platform)
+        return {
+            suite: {"passed": False, "result": "error"}
+            for suite in build["tests"]
+        }
+
+    planner = FlashPlanner()
+    outcomes = {}
+    for suite, test in sorted(build["tests"].items()):
+        for binary in test["binaries"]:
+            prefix = "[%s %s] " % (test_group, suite)
+            if full_flash:
+                planner.forget(board["board_id"])
+            plan = planner.plan(board["board_id"], platform, binary["path"])
+            if plan["mode"] != "full":
+                logging.info(
+                    "%sFlashing %d of %d sectors",
+                    prefix,
+                    plan["changed"],
+                    plan["total"],
+                )
+            planner.forget(board["board_id"])
+            try:
+                stats = host_runner.run_test(
+                    board["port"],
+                    binary["compare_log"],
+                    plan["image"],
+                    board["mount"],
+                    build["baud_rate"],
+                    prefix=prefix,
+                    timer=timer,
+                )
+            except Exception as e:
+                logging.error("%s%s", prefix, str(e))
+                outcomes[suite] = {"passed": False, "result": "error"}
+                continue
+
+            planner.record(board["board_id"], platform, binary["path"])
+
+            logging.info(
+                "%s%s in %.1fs, %d/%d patterns matched",
+                prefix,
+                stats["result"],
+                stats["duration"],
+                stats["matched"],
+                stats["expected"],
+            )
+            outcomes[suite] = stats
+
+    return outcomes
+
+
+def _execute_test(args):
+    """
+    Run the tests of test_spec.json with Greentea or host_runner.py. The build
+    groups of different platforms are run at the same time, each on its
+    own boards.
+    :param args: Command-line arguments
+    """
+    if not os.path.isfile(TEST_SPEC_FILE):
         logging.critical(
             "test_spec.json is not found, please build the tests first"
         )
         sys.exit(1)
 
-    cmd = ["mbedgt", "--polling-timeout", "600", "-V"]
+    with file_lock(TEST_SPEC_FILE + ".lock"):
+        builds = _load_test_spec()["builds"]
+        platforms = {}
+        for test_group, build in builds.items():
+            if args.mcu and build["platform"] != args.mcu:
+                continue
+            if (
+                args.toolchain
+                and build["toolchain"] != TC_DICT[args.toolchain]
+            ):
+                continue
+            test_spec = _get_group_test_spec(test_group, build)
+            platforms.setdefault(build["platform"], {})[test_group] = test_spec
+
+    if not platforms:
+        logging.critical("No build group of test_spec.json matches")
+        sys.exit(1)
 
-    run_cmd_output_realtime(cmd, os.getcwd())
+    logging.info("Testing %s", ", ".join(sorted(platforms)))
+    with ThreadPoolExecutor(max_workers=len(platforms)) as executor:
+        futures = [
+            executor.submit(_run_test_groups, platform, test_groups, args)
+            for platform, test_groups in sorted(platforms.items())
+        ]
+
+    for future in futures:
+        for test_group in future.result():
+            logging.error("%s reported failures", test_group)
 
 
 def _init_test_spec(args):
@@ -258,24 +986,19 @@ def _get_test_group(args):
     return "{}-{}-{}".format(target, toolchain, baud_rate)
 
 
-def _get_test_spec(args, suite, binary_name):
+def _get_test_spec(args, variant, suite, binary_name):
     """
     return test specification for the suite name
     :param args: Command-line arguments
+    :param variant: Build variant
     :param suite: test suite
     :param binary_name: name of the binary
     :return: return test spec dictionary for the suite name
     """
     target = args.mcu
-    toolchain = TC_DICT.get(args.toolchain)
     log_path = join("test", "logs", target, "{}.log".format(suite))
 
-    if args.cli == 1:
-        image_path = join("BUILD", target, toolchain, binary_name)
-    else:
-        image_path = join(
-            "cmake_build", target, "develop", toolchain, binary_name
-        )
+    image_path = join(_get_mbed_os_build_dir(args, variant), binary_name)
 
     return {
         "binaries": [
@@ -288,47 +1011,214 @@ def _get_test_spec(args, suite, binary_name):
     }
 
 
-def _build_regression_test(args, test_spec):
+def _add_test_spec(args, test_spec, variant, suite):
     """
-    Build TF-M regression test for the target
+    Add the test specification of a suite to test_spec
     :param args: Command-line arguments
+    :param test_spec: test specification dictionary
+    :param variant: Build variant
+    :param suite: Test suite
     """
-    logging.info("Build TF-M regression tests for %s", args.mcu)
-    suite = "REGRESSION"
-    _set_json_param(1, 0, 0 if args.no_sync else 1)
-
-    # build stuff
-    _build_tfm(args, "RegressionIPC")
-    _build_mbed_os(args)
-    binary_name = _erase_flash_storage(args, suite)
-
-    # update the test_spec
     test_group = _get_test_group(args)
     test_spec["builds"][test_group]["tests"][suite.lower()] = _get_test_spec(
-        args, suite, binary_name
+        args, variant, suite, _get_binary_name(suite)
     )
 
 
-def _build_compliance_test(args, test_spec):
+def _get_build_suites(args):
     """
-    Build PSA Compliance test for the target
+    List the suites to build for the target
     :param args: Command-line arguments
+    :return: List of tuples (suite, TF-M config, config switches) where the
+             config switches are the (regression, compliance, benchmark,
+             sync) values of the application config
     """
-    _set_json_param(0, 1, 0 if args.no_sync else 1)
+    sync = 0 if args.no_sync else 1
+    suites = [("REGRESSION", "RegressionIPC", (1, 0, 0, sync))]
+
+    # M2354 hasn't supported PSA compliance test yet.
+    if args.mcu != "NU_M2354":
+        for suite in PSA_SUITE_CHOICES:
+            suites.append((suite, "PsaApiTestIPC", (0, 1, 0, sync)))
+
+    if args.benchmark:
+        suites.append(("BENCHMARK", "BenchmarkIPC", (0, 0, 1, sync)))
+
+    if args.suite:
+        suites = [s for s in suites if s[0] in args.suite]
+    return suites
+
+
+def _tagged(phase, args, suite, action):
+    """
+    Run a task, tagging the resource usage of its child processes
+    :param phase: Pipeline phase
+    :param args: Command-line arguments
+    :param suite: Test suite, None if the task is not specific to one
+    :param action: Task action
+    """
+    with rusage_context(phase=phase, target=args.mcu, suite=suite):
+        action()
 
-    test_group = _get_test_group(args)
 
-    for suite in PSA_SUITE_CHOICES:
+def _get_build_pipeline(args, test_spec):
+    """
+    Declare the tasks building the regression and PSA compliance tests.
+
+    All TF-M builds share one CMake build directory and copy their outputs
+    to the same Mbed OS and test library folders, and the Mbed OS builds of
+    a variant share their build directory. So each task which overwrites
+    one of these also depends on the tasks reading the previous content.
+
+    :param args: Command-line arguments
+    :param test_spec: test specification dictionary, filled by the tasks
+    :return: Pipeline
+    """
+    pipeline = Pipeline()
+    lib_dir = join("test", "lib", "TOOLCHAIN_" + TC_DICT.get(args.toolchain))
+    tfm_dir = relpath(join(TF_M_BUILD_DIR, "trusted-firmware-m"), ROOT)
+    delivery_dir = relpath(
+        join(mbed_path, "targets", get_target(args.mcu).tfm_delivery_dir),
+        ROOT,
+    )
 
-        logging.info("Build PSA Compliance - %s suite for %s", suite, args.mcu)
+    # Tasks the next TF-M build has to wait for
+    tfm_deps = []
+    # Tasks the next Mbed OS build of each variant has to wait for
+    variant_deps = {}
+
+    if not args.spec_only and not args.skip_clone:
+        tfm_deps.append(
+            pipeline.add(
+                "clone",
+                partial(
+                    _tagged, "clone", args, None, partial(_clone_tfm, args)
+                ),
+                inputs=["dependencies.yaml", "dependencies.lock"],
+                outputs=[tfm_dir],
+                kind=IO,
+                cost=TASK_COSTS["clone"],
+            )
+        )
 
-        _build_tfm(args, "PsaApiTestIPC", suite)
-        _build_mbed_os(args)
-        binary_name = _erase_flash_storage(args, suite)
+    for suite, config, switches in _get_build_suites(args):
+        variant = _get_variant(*switches)
+        build_dir = _get_mbed_os_build_dir(args, variant)
+        image = join(build_dir, _get_binary_name(suite))
+        spec_deps = []
+
+        if not args.spec_only:
+            overlay = join(_get_variant_dir(args, variant), "mbed_app.json")
+            if variant not in variant_deps:
+                variant_deps[variant] = [
+                    pipeline.add(
+                        "config:" + variant,
+                        partial(
+                            _write_config_overlay, args, variant, *switches
+                        ),
+                        inputs=["mbed_app.json"],
+                        outputs=[overlay],
+                        kind=IO,
+                        cost=TASK_COSTS["config"],
+                    )
+                ]
+
+            tfm = pipeline.add(
+                "tfm:" + suite,
+                partial(
+                    _tagged,
+                    "tfm",
+                    args,
+                    suite,
+                    partial(_build_tfm, args, config, suite),
+                ),
+                deps=tfm_deps,
+                inputs=[tfm_dir, "build_tfm.py", "tfm_ns_import.yaml"],
+                outputs=[lib_dir, delivery_dir],
+                kind=CPU,
+                cost=TASK_COSTS["tfm"],
+            )
+            mbed_os = pipeline.add(
+                "mbed-os:" + suite,
+                partial(
+                    _tagged,
+                    "mbed-os",
+                    args,
+                    suite,
+                    partial(_build_mbed_os, args, variant),
+                ),
+                deps=[tfm] + variant_deps[variant],
+                inputs=[
+                    "main.cpp",
+                    "CMakeLists.txt",
+                    "mbed-os.lib",
+                    overlay,
+                    lib_dir,
+                ],
+                outputs=[join(build_dir, "mbed-os-tf-m-regression-tests.bin")],
+                kind=CPU,
+                cost=TASK_COSTS["mbed-os"],
+            )
+            erase = pipeline.add(
+                "image:" + suite,
+                partial(
+                    _tagged,
+                    "image",
+                    args,
+                    suite,
+                    partial(_erase_flash_storage, args, variant, suite),
+                ),
+                deps=[mbed_os],
+                inputs=[join(build_dir, "mbed-os-tf-m-regression-tests.bin")],
+                outputs=[image],
+                kind=IO,
+                cost=TASK_COSTS["image"],
+            )
+            tfm_deps = [mbed_os]
+            variant_deps[variant] = [erase]
+            spec_deps = [erase]
+
+            if args.bundle:
+                bundle = pipeline.add(
+                    "bundle:" + suite,
+                    partial(_pack_bundle, args, variant, suite),
+                    deps=[erase],
+                    inputs=[build_dir, lib_dir, delivery_dir],
+                    outputs=[args.bundle],
+                    kind=IO,
+                    cost=TASK_COSTS["bundle"],
+                )
+                tfm_deps.append(bundle)
+                variant_deps[variant].append(bundle)
+
+        pipeline.add(
+            "spec:" + suite,
+            partial(_add_test_spec, args, test_spec, variant, suite),
+            deps=spec_deps,
+            inputs=[image, join("test", "logs", args.mcu, suite + ".log")],
+            kind=IO,
+            cost=TASK_COSTS["spec"],
+            checkpoint=False,
+        )
 
-        test_spec["builds"][test_group]["tests"][
-            suite.lower()
-        ] = _get_test_spec(args, suite, binary_name)
+    return pipeline
+
+
+def _get_journal(args):
+    """
+    Return the run journal of the target and toolchain
+    :param args: Command-line arguments
+    """
+    params = {
+        "mcu": args.mcu,
+        "toolchain": args.toolchain,
+        "cli": args.cli,
+        "sync": not args.no_sync,
+        "benchmark": args.benchmark,
+        "bundle": args.bundle,
+    }
+    path = join(JOURNAL_DIR, "{}-{}.json".format(args.mcu, args.toolchain))
+    return RunJournal(path, params, ROOT)
 
 
 def _get_parser():
@@ -337,8 +1227,7 @@ def _get_parser():
     parser.add_argument(
         "-m",
         "--mcu",
-        help="Build for the given MCU",
-        choices=get_tfm_regression_targets(),
+        help="Build for the given MCU, see --list",
         default=None,
     )
 
@@ -364,12 +1253,125 @@ def _get_parser():
         action="store_true",
     )
 
+    parser.add_argument(
+        "-s",
+        "--suite",
+        help="Only build this suite, can be repeated (default: all)",
+        choices=["REGRESSION"] + PSA_SUITE_CHOICES + ["BENCHMARK"],
+        action="append",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--spec-only",
+        help="Only write test_spec.json for the images already built",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--runner",
+        help="Test runner: Greentea, or the lean host_runner.py which only "
+        "flashes each image, syncs and matches the compare log",
+        choices=["mbedgt", "lean"],
+        default="mbedgt",
+    )
+
+    parser.add_argument(
+        "--full-flash",
+        help="With --runner lean, program whole images instead of only the "
+        "sectors changed since the last image flashed to the board",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--reuse-results",
+        help="Skip the suites whose exact image already passed with the "
+        "same compare log and runner, and record the outcomes of the others",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--force-rerun",
+        help="Run every suite even if its outcome is recorded, and record "
+        "the new outcomes",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--benchmark",
+        help="Also build and run the PSA crypto benchmark",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--benchmark-threshold",
+        help="Fail a build group if a crypto operation is slower than its "
+        "baseline in test/benchmark by this percentage (default: %d)"
+        % (crypto_benchmark.DEFAULT_THRESHOLD * 100),
+        type=float,
+        default=crypto_benchmark.DEFAULT_THRESHOLD * 100,
+    )
+
+    parser.add_argument(
+        "--update-benchmark-baseline",
+        help="Record the crypto throughputs as their baseline in "
+        "test/benchmark",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--timing-threshold",
+        help="Fail a build group if a suite or test took longer on the "
+        "target than its baseline in test/timing by this percentage "
+        "(default: %d)" % (test_timing.DEFAULT_THRESHOLD * 100),
+        type=float,
+        default=test_timing.DEFAULT_THRESHOLD * 100,
+    )
+
+    parser.add_argument(
+        "--timing-slack",
+        help="Slowdown in seconds always allowed, for short tests "
+        "(default: %.1f)" % test_timing.DEFAULT_SLACK,
+        type=float,
+        default=test_timing.DEFAULT_SLACK,
+    )
+
+    parser.add_argument(
+        "--update-timing-baseline",
+        help="Record how long the suites and tests which did not fail took "
+        "as their baseline in test/timing",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--reset-spec",
+        help="Drop the build groups of other targets and toolchains from "
+        "test_spec.json instead of merging with them",
+        action="store_true",
+    )
+
     parser.add_argument(
         "--no-sync",
         help="Tests start without waiting for sync from Greentea host",
         action="store_true",
     )
 
+    parser.add_argument(
+        "--watch",
+        help="After building, rebuild the stages affected by every change of "
+        "the TF-M sources, main.cpp or the compare logs, and run the tests "
+        "whose image or compare log changed again",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--debounce",
+        help="With --watch, seconds without change before rebuilding "
+        "(default: %.1f)" % DEFAULT_DEBOUNCE,
+        type=float,
+        default=DEFAULT_DEBOUNCE,
+    )
+
     parser.add_argument(
         "-l",
         "--list",
@@ -391,6 +1393,109 @@ def _get_parser():
         default=False,
     )
 
+    parser.add_argument(
+        "--update-lock",
+        help="Resolve the refs of dependencies.yaml again and pin their "
+        "commits, branches included, in dependencies.lock",
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--resume",
+        help="Skip the build steps a previous run completed, if their inputs "
+        "and outputs are unchanged",
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--plan",
+        help="Print the build tasks and their critical path without building",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--cpu-jobs",
+        help="Number of compilation tasks run at once (default: 1)",
+        type=int,
+        default=1,
+    )
+
+    parser.add_argument(
+        "--io-jobs",
+        help="Number of copy and image generation tasks run at once "
+        "(default: 2)",
+        type=int,
+        default=2,
+    )
+
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of parallel compile jobs shared by all the builds "
+        "(default: number of CPUs)",
+        type=int,
+        default=None,
+    )
+
+    parser.add_argument(
+        "--mem-limit",
+        help="Memory the builds may use together, e.g. 16G (default: no "
+        "limit)",
+        type=parse_size,
+        default=None,
+    )
+
+    parser.add_argument(
+        "--mem-per-job",
+        help="Memory used by one compile job, used with --mem-limit "
+        "(default: 1G)",
+        type=parse_size,
+        default=parse_size("1G"),
+    )
+
+    parser.add_argument(
+        "--bundle",
+        help="Pack the build outputs of every suite into this artifact bundle",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--workspace-pool",
+        help="Build TF-M in a workspace kept per target, toolchain, config "
+        "and suite so that rebuilds are incremental",
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--workspace-budget",
+        help="Disk budget of the workspace pool (default: %s)"
+        % DEFAULT_BUDGET,
+        default=DEFAULT_BUDGET,
+    )
+
+    parser.add_argument(
+        "--ccache",
+        help="Compile TF-M through ccache to reuse objects across suites",
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--ccache-dir",
+        help="Cache directory of ccache (default: ccache's own setting)",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--ccache-max-size",
+        help="Size limit of the cache, e.g. 5G (default: ccache's own "
+        "setting)",
+        default=None,
+    )
+
     parser.add_argument(
         "--cli",
         help="Build with the specified version of Mbed CLI",
@@ -399,16 +1504,46 @@ def _get_parser():
         choices=[1, 2],
     )
 
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        help="Log debug messages",
+        action="store_true",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--log-json",
+        help="Also append every log event to this file as JSON lines, with "
+        "its step, target and suite",
+        default=None,
+    )
+
     return parser
 
 
-def _main():
+def _main(argv=None):
     """
     Build and run Regression, PSA compliance for suported targets
+    :param argv: Command-line arguments, defaults to sys.argv
     """
-    signal.signal(signal.SIGINT, exit_gracefully)
+    # The build server handles Ctrl+C itself
+    if not IN_PROCESS:
+        signal.signal(signal.SIGINT, exit_gracefully)
     parser = _get_parser()
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    event_log.configure("Test-Target", args.verbose, args.log_json)
+
+    if args.resume and args.clean:
+        parser.error("--resume cannot be used with --clean")
+    if args.resume and args.update_lock:
+        parser.error("--resume cannot be used with --update-lock")
+    if args.update_lock and args.skip_clone:
+        parser.error("--update-lock cannot be used with --skip-clone")
+    if args.watch and (args.plan or args.spec_only):
+        parser.error("--watch cannot be used with --plan or --spec-only")
+    if args.watch and args.run and not args.build:
+        parser.error("--watch needs to build, it cannot be used with -r")
 
     if args.list:
         logging.info(
@@ -418,34 +1553,169 @@ def _main():
         )
         return
 
+    # Validated here rather than with choices, so --help does not need to
+    # read the targets
+    if args.mcu and args.mcu not in get_tfm_regression_targets():
+        parser.error(
+            "argument -m/--mcu: invalid choice: %r (see --list)" % args.mcu
+        )
+
+    if are_dependencies_installed() != 0:
+        sys.exit(1)
+
     logging.info("Target - %s", args.mcu)
 
     build = args.build
     run = args.run
 
     # Default to build and run
-    if not args.build and not args.run:
+    if args.spec_only:
+        build = True
+        run = False
+    elif not args.build and not args.run:
         build = True
         run = True
 
+    owns_rusage_log = start_rusage_log()
+    try:
+        _run(args, build, run)
+    finally:
+        if owns_rusage_log:
+            finish_rusage_log()
+        stats = get_write_stats()
+        logging.info(
+            "Generated files: %d written, %d unchanged",
+            stats["written"],
+            stats["unchanged"],
+        )
+
+
+def _run(args, build, run):
+    """
+    Build and/or run the tests
+    :param args: Command-line arguments
+    :param build: Build the tests
+    :param run: Run the tests
+    """
+    global JOB_SLOTS
     if build:
+        JOB_SLOTS = JobSlotPool(
+            args.jobs, args.cpu_jobs, args.mem_limit, args.mem_per_job
+        )
         test_spec = _init_test_spec(args)
-        _build_regression_test(args, test_spec)
-        # M2354 hasn't supported PSA compliance test yet.
-        if args.mcu != "NU_M2354":
-            _build_compliance_test(args, test_spec)
+        pipeline = _get_build_pipeline(args, test_spec)
+        if args.plan:
+            pipeline.print_plan()
+            return
+
+        journal = None if args.spec_only else _get_journal(args)
+        pipeline.run(args.cpu_jobs, args.io_jobs, journal, args.resume)
 
-        with open("test_spec.json", "w") as f:
-            f.write(json.dumps(test_spec, indent=2))
+        _merge_test_spec(test_spec, args.reset_spec)
 
         logging.info("Target built succesfully - %s", args.mcu)
 
     if run:
-        _execute_test()
+        _execute_test(args)
+
+    if args.watch:
+        _watch(args, run)
+
+
+def _get_watch_tasks(pipeline, changed, installed):
+    """
+    List the tasks to run after some sources changed. The TF-M builds of
+    all the suites copy their outputs to the same folders, so an image is
+    only relinked with the TF-M build of its own suite in place.
+
+    :param pipeline: Build pipeline
+    :param changed: Changed paths, relative to ROOT
+    :param installed: TF-M task whose outputs are in place, None if unknown
+    :return: tuple (task names, TF-M task whose outputs are in place after
+             they run)
+    """
+    tasks = set(pipeline.affected_tasks(changed))
+    for name in pipeline.topological_order():
+        phase, __, suite = name.partition(":")
+        if phase == "tfm" and name in tasks:
+            installed = name
+        elif phase == "mbed-os" and name in tasks:
+            if installed != "tfm:" + suite:
+                installed = "tfm:" + suite
+                tasks.add(installed)
+
+    return [n for n in pipeline.topological_order() if n in tasks], installed
+
+
+def _watch(args, run):
+    """
+    Rebuild the tasks affected by every change of their sources until
+    interrupted: a TF-M source change rebuilds and copies TF-M then relinks
+    the images, a main.cpp change only rebuilds the images, a compare log
+    change only updates the test specification. Changes made in quick
+    succession are combined into one rebuild.
+    :param args: Command-line arguments
+    :param run: Run the tests again after every rebuild
+    """
+    # Rebuilding must not check out TF-M again over the changes
+    args.skip_clone = True
+    test_spec = _init_test_spec(args)
+    pipeline = _get_build_pipeline(args, test_spec)
+
+    produced = set()
+    for task in pipeline.tasks.values():
+        produced.update(task.outputs)
+    sources = set()
+    for task in pipeline.tasks.values():
+        sources.update(p for p in task.inputs if p not in produced)
+
+    # Only the suites whose image or compare log changed, or which did not
+    # pass, run again
+    test_args = argparse.Namespace(**vars(args))
+    test_args.reuse_results = True
+
+    watcher = FileWatcher(ROOT, sources, produced)
+    logging.info(
+        "Watching %d paths with %s, press Ctrl+C to stop",
+        len(watcher.paths),
+        "polling" if watcher.fd is None else "inotify",
+    )
+    # The TF-M build of the last suite was the last one copied
+    installed = None
+    for name in pipeline.topological_order():
+        if name.startswith("tfm:"):
+            installed = name
+    # Changes not rebuilt yet, kept after a failed rebuild
+    changed = set()
+    try:
+        while True:
+            changed |= watcher.wait(args.debounce)
+            tasks, after = _get_watch_tasks(pipeline, changed, installed)
+            logging.info(
+                "Changed: %s, running %s",
+                ", ".join(sorted(changed)),
+                ", ".join(tasks) if tasks else "no task",
+            )
+
+            start = time.monotonic()
+            try:
+                pipeline.run(args.cpu_jobs, args.io_jobs, tasks=tasks)
+            except SystemExit as e:
+                if not e.code:
+                    raise
+                logging.error("Rebuild failed, waiting for the next change")
+                installed = None
+                continue
+            changed = set()
+            installed = after
+            _merge_test_spec(test_spec, args.reset_spec)
+            logging.info("Rebuilt in %.1fs", time.monotonic() - start)
+
+            if run:
+                _execute_test(test_args)
+    finally:
+        watcher.close()
 
 
 if __name__ == "__main__":
-    if are_dependencies_installed() != 0:
-        sys.exit(1)
-    else:
-        _main()
+    _main()
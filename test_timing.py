@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2021 ARM Limited. All rights reserved.
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import sys
+import argparse
+import json
+import logging
+import re
+from atomic_write import write_file_atomically
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+
+# Baselines of the durations, test/timing/<TARGET>/<TOOLCHAIN>.json
+TIMING_DIR = os.path.join(ROOT, "test", "timing")
+
+# Allowed slowdown, as a fraction of the baseline and in seconds
+DEFAULT_THRESHOLD = 0.5
+DEFAULT_SLACK = 1.0
+
+# Start and end markers printed by the TF-M regression tests and the PSA
+# arch tests, the first match wins
+MARKERS = [
+    ("suite", re.compile(r"Running Test Suite (.+?)\.\.\.")),
+    ("suite", re.compile(r"Running\.\. (.+ Suite)")),
+    ("test", re.compile(r"> Executing '([^']+)'")),
+    ("test", re.compile(r"TEST: (\d+) \|")),
+    ("result", re.compile(r"TEST: (\S+) - ([A-Z]+)!")),
+    ("result", re.compile(r"TEST RESULT: ([A-Z ]+?)\s*$")),
+    ("suite_result", re.compile(r"TESTSUITE ([A-Z]+)!")),
+    ("suite_result", re.compile(r"\S+ Suite Report")),
+]
+# Results whose duration says nothing of the speed of the test
+NO_BASELINE_RESULTS = ("incomplete", "FAILED", "SIM ERROR")
+# ID of a TF-M suite, e.g. "... tests (TFM_NS_PS_TEST_1XXX)"
+SUITE_ID = re.compile(r"\((\w+)\)\s*$")
+# Serial line relayed by mbedhtrun, with the time the host received it
+HTRUN_LINE = re.compile(r"\[(\d+\.\d+)\]\[\w+\]\[RXD\] ?(.*)")
+
+
+def split_htrun_line(line):
+    """
+    :param line: Line of Greentea output
+    :return: (time the host received the serial line, the serial line), or
+             (None, line) if it was not received from the device
+    """
+    match = HTRUN_LINE.search(line)
+    if match:
+        return float(match.group(1)), match.group(2)
+    return None, line
+
+
+class TestTimer:
+    """
+    Durations of the suites and tests of a run, derived from the time each
+    line of serial output was received
+    """
+
+    def __init__(self):
+        self.suites = {}
+        self.tests = {}
+        self._suite = None
+        self._test = None
+        self._last = None
+
+    def _close_test(self, timestamp, result):
+        if self._test:
+            self._test["seconds"] = round(timestamp - self._test["start"], 3)
+            self._test["result"] = result
+            self._test = None
+
+    def _close_suite(self, timestamp, result):
+        self._close_test(self._last, "incomplete")
+        if self._suite:
+            self._suite["seconds"] = round(timestamp - self._suite["start"], 3)
+            self._suite["result"] = result
+            self._suite = None
+
+    def feed(self, timestamp, line):
+        """
+        :param timestamp: Time the line was received, in seconds
+        :param line: Line of serial output
+        """
+        for kind, pattern in MARKERS:
+            match = pattern.search(line)
+            if match:
+                break
+        else:
+            self._last = timestamp
+            return
+
+        # What did not finish lasted until the last line before this one
+        if kind == "suite":
+            self._close_suite(self._last, "incomplete")
+            name = match.group(1)
+            suite_id = SUITE_ID.search(name)
+            name = suite_id.group(1) if suite_id else name
+            self._suite = self.suites[name] = {
+                "name": name,
+                "start": timestamp,
+            }
+        elif kind == "test":
+            self._close_test(self._last, "incomplete")
+            name = match.group(1)
+            if self._suite:
+                name = self._suite["name"] + "/" + name
+            self._test = self.tests[name] = {"start": timestamp}
+        elif kind == "result":
+            self._close_test(timestamp, match.group(match.lastindex))
+        elif self._suite:
+            result = match.group(1) if match.groups() else "REPORTED"
+            self._close_suite(timestamp, result)
+        self._last = timestamp
+
+    def get_results(self):
+        """
+        :return: dict with the "suites" and "tests", each a dict of name to
+                 its duration in seconds and result. Suites and tests which
+                 did not finish last until the last line received.
+        """
+        if self._last is not None:
+            self._close_suite(self._last, "incomplete")
+        return {
+            kind: {
+                name: {"seconds": item["seconds"], "result": item["result"]}
+                for name, item in items.items()
+                if "seconds" in item
+            }
+            for kind, items in (("suites", self.suites), ("tests", self.tests))
+        }
+
+
+def read_transcript(path):
+    """
+    Read the timestamped lines of a recorded run: a host_runner.py --record
+    transcript, or Greentea output with the mbedhtrun timestamps
+    :param path: Path of the transcript
+    :return: List of (time received, line)
+    """
+    lines = []
+    with open(path, encoding="utf-8", errors="replace") as f:
+        first = f.readline()
+        f.seek(0)
+        if first.startswith("{"):
+            pending = ""
+            for entry in f:
+                entry = json.loads(entry)
+                if "rx" not in entry:
+                    continue
+                # A line is received with the chunk which ends it
+                chunks = (pending + entry["rx"]).split("\n")
+                pending = chunks.pop()
+                for line in chunks:
+                    lines.append((entry["t"], line.rstrip("\r")))
+        else:
+            for line in f:
+                timestamp, line = split_htrun_line(line.rstrip("\r\n"))
+                if timestamp is not None:
+                    lines.append((timestamp, line))
+
+    if not lines:
+        raise ValueError("%s has no timestamped serial output" % path)
+    return lines
+
+
+def get_baseline_path(target, toolchain):
+    """
+    :param target: Target name
+    :param toolchain: Toolchain, e.g. GCC_ARM
+    :return: Path of the baseline of the target built with the toolchain
+    """
+    return os.path.join(TIMING_DIR, target, toolchain + ".json")
+
+
+def load_baseline(path):
+    """
+    :param path: Path of the baseline
+    :return: dict of the "suites" and "tests", each a dict of name to its
+             duration in seconds
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"suites": {}, "tests": {}}
+
+
+def update_baseline(path, timings):
+    """
+    Record the durations of the suites and tests which finished without
+    failing as their baseline, the baseline of the others is kept
+    :param path: Path of the baseline
+    :param timings: Result of TestTimer.get_results()
+    :return: Number of suites and tests recorded
+    """
+    baseline = load_baseline(path)
+    count = 0
+    for kind, items in timings.items():
+        for name, item in items.items():
+            if item["result"] not in NO_BASELINE_RESULTS:
+                baseline.setdefault(kind, {})[name] = item["seconds"]
+                count += 1
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_file_atomically(
+        path, json.dumps(baseline, indent=2, sort_keys=True) + "\n"
+    )
+    return count
+
+
+def compare(baseline, timings, threshold=DEFAULT_THRESHOLD, slack=0):
+    """
+    :param baseline: Result of load_baseline()
+    :param timings: Result of TestTimer.get_results()
+    :param threshold: Allowed slowdown as a fraction of the baseline
+    :param slack: Allowed slowdown in seconds, absorbs the noise of short
+                  tests
+    :return: List of (name, baseline seconds, seconds) of the suites and
+             tests which became slower
+    """
+    regressions = []
+    for kind, items in sorted(timings.items()):
+        for name, item in sorted(items.items()):
+            before = baseline.get(kind, {}).get(name)
+            if before is None:
+                continue
+            if item["seconds"] > before * (1 + threshold) + slack:
+                regressions.append((name, before, item["seconds"]))
+    return regressions
+
+
+def log_timings(timings):
+    """
+    :param timings: Result of TestTimer.get_results()
+    """
+    for name, suite in sorted(timings["suites"].items()):
+        logging.info(
+            "%-40s %9.3fs %s", name, suite["seconds"], suite["result"]
+        )
+
+
+def _get_parser():
+    parser = argparse.ArgumentParser(
+        description="Time the suites and tests of a recorded run"
+    )
+    parser.add_argument(
+        "transcript",
+        help="host_runner.py --record transcript, or Greentea output",
+    )
+    parser.add_argument(
+        "--tests", help="Show every test, not only suites", action="store_true"
+    )
+    parser.add_argument(
+        "-b", "--baseline", help="Compare with this baseline", default=None
+    )
+    parser.add_argument(
+        "--threshold",
+        help="Allowed slowdown compared to the baseline, in percent "
+        "(default: %d)" % (DEFAULT_THRESHOLD * 100),
+        type=float,
+        default=DEFAULT_THRESHOLD * 100,
+    )
+    parser.add_argument(
+        "--slack",
+        help="Allowed slowdown compared to the baseline, in seconds "
+        "(default: %.1f)" % DEFAULT_SLACK,
+        type=float,
+        default=DEFAULT_SLACK,
+    )
+    parser.add_argument(
+        "--update",
+        help="Record the durations of the suites and tests which did not "
+        "fail as the baseline",
+        action="store_true",
+    )
+    return parser
+
+
+def _main():
+    """
+    Time a recorded run and compare it with a baseline
+    """
+    args = _get_parser().parse_args()
+
+    timer = TestTimer()
+    try:
+        for timestamp, line in read_transcript(args.transcript):
+            timer.feed(timestamp, line)
+    except (OSError, ValueError) as e:
+        logging.critical(str(e))
+        sys.exit(1)
+
+    timings = timer.get_results()
+    if not timings["suites"] and not timings["tests"]:
+        logging.critical("No suites or tests in %s", args.transcript)
+        sys.exit(1)
+    log_timings(timings)
+    if args.tests:
+        for name, test in sorted(timings["tests"].items()):
+            logging.info(
+                "  %-38s %9.3fs %s", name, test["seconds"], test["result"]
+            )
+
+    if not args.baseline:
+        return
+    if args.update:
+        count = update_baseline(args.baseline, timings)
+        logging.info("Recorded %d durations in %s", count, args.baseline)
+        return
+
+    regressions = compare(
+        load_baseline(args.baseline),
+        timings,
+        args.threshold / 100,
+        args.slack,
+    )
+    for name, before, after in regressions:
+        logging.error("%s took %.3fs, baseline %.3fs", name, after, before)
+    if regressions:
+        logging.critical("%d suites and tests got slower", len(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[Test-Timing] %(asctime)s: %(message)s.",
+        datefmt="%H:%M:%S",
+    )
+    _main()
@@ -7,6 +7,7 @@ apt-get update
 apt-get full-upgrade -y
 apt-get install -y \
 	build-essential \
+	ccache \
 	cmake \
 	gcc-multilib \
 	git \
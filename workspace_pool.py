@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2021 ARM Limited. All rights reserved.
+
+SPDX-License-Identifier: Apache-2.0
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import argparse
+import hashlib
+import json
+import logging
+import shutil
+import time
+from psa_builder import (
+    ROOT,
+    file_lock,
+    write_file_atomically,
+    handle_read_permission_error,
+)
+from job_slots import parse_size
+
+# Outside of tfm/repos, so that --clean keeps the warm builds
+WORKSPACES_DIR = os.path.join(ROOT, "tfm", "workspaces")
+DEFAULT_BUDGET = "20G"
+KEY_FIELDS = [
+    "dependencies",
+    "target",
+    "toolchain",
+    "config",
+    "suite",
+    "profile",
+    "debug",
+]
+# Workspaces missing from the index are only deleted once nothing was
+# written to them for this long, they may be a build another run just
+# started
+UNKNOWN_GRACE = 3600
+
+
+def _get_dir_size(path):
+    """
+    :param path: Directory
+    :return: Disk usage of the files in the directory in bytes
+    """
+    size = 0
+    for dirpath, __, filenames in os.walk(path):
+        for f in filenames:
+            try:
+                st = os.lstat(os.path.join(dirpath, f))
+            except FileNotFoundError:
+                continue
+            size += getattr(st, "st_blocks", 0) * 512 or st.st_size
+    return size
+
+
+def _get_last_modified(path):
+    """
+    :param path: Directory
+    :return: Latest modification time of the directory and its files
+    """
+    latest = os.path.getmtime(path)
+    for dirpath, __, filenames in os.walk(path):
+        for f in filenames:
+            try:
+                latest = max(
+                    latest, os.lstat(os.path.join(dirpath, f)).st_mtime
+                )
+            except FileNotFoundError:
+                continue
+    return latest
+
+
+def _format_size(size):
+    """
+    :param size: Size in bytes
+    :return: Human readable size
+    """
+    for unit in ["B", "K", "M"]:
+        if size < 1024:
+            return "%d%s" % (size, unit)
+        size /= 1024
+    return "%.1fG" % size
+
+
+class WorkspacePool:
+    """
+    TF-M build directories kept between runs, one per build configuration,
+    within a disk budget. The least recently used workspaces are deleted
+    when the pool grows over budget.
+
+    :param budget: Disk budget in bytes
+    :param root: Directory holding the workspaces and their index
+    """
+
+    def __init__(self, budget=parse_size(DEFAULT_BUDGET), root=WORKSPACES_DIR):
+        self.budget = budget
+        self.root = root
+        self.index_path = os.path.join(root, "index.json")
+
+    def _load(self):
+        """
+        :return: dict of workspace name to its index entry
+        """
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _lock(self):
+        """
+        :return: Context manager holding the lock of the index, concurrent
+                 runs read, change and write it back one at a time
+        """
+        os.makedirs(self.root, exist_ok=True)
+        return file_lock(self.index_path + ".lock")
+
+    def _save(self, index):
+        write_file_atomically(
+            self.index_path, json.dumps(index, indent=2, sort_keys=True)
+        )
+
+    @staticmethod
+    def get_name(key):
+        """
+        :param key: dict with the KEY_FIELDS of a build
+        :return: Name of the workspace of the build
+        """
+        data = json.dumps([key.get(f) for f in KEY_FIELDS])
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()[:16]
+
+    def acquire(self, key):
+        """
+        Return the workspace of a build, creating it if needed
+        :param key: dict with the KEY_FIELDS of the build
+        :return: Absolute path of the workspace
+        """
+        name = self.get_name(key)
+        path = os.path.join(self.root, name)
+        with self._lock():
+            index = self._load()
+            entry = index.get(name)
+            if entry and os.path.isdir(path):
+                logging.info("Reusing build workspace %s", name)
+            else:
+                logging.info("Creating build workspace %s", name)
+                os.makedirs(path, exist_ok=True)
+                entry = {"key": key, "size": 0, "created": time.time()}
+
+            entry["last_used"] = time.time()
+            index[name] = entry
+            self._save(index)
+        return path
+
+    def release(self, path):
+        """
+        Record the size of a workspace after a build and shrink the pool
+        back to its budget, keeping this workspace
+        :param path: Path returned by acquire()
+        """
+        name = os.path.basename(path)
+        size = _get_dir_size(path)
+        with self._lock():
+            index = self._load()
+            if name in index:
+                index[name]["size"] = size
+                self._save(index)
+        self.gc(keep=[name])
+
+    def status(self):
+        """
+        :return: List of (name, index entry), most recently used first
+        """
+        return sorted(
+            self._load().items(), key=lambda item: -item[1]["last_used"]
+        )
+
+    def gc(self, budget=None, keep=()):
+        """
+        Delete the least recently used workspaces until the pool fits in
+        the budget, as well as workspaces missing from the index
+
+        :param budget: Budget in bytes, defaults to the pool's
+        :param keep: Names of workspaces never deleted
+        :return: Number of bytes reclaimed
+        """
+        budget = self.budget if budget is None else budget
+        with self._lock():
+            return self._gc(budget, keep)
+
+    def _gc(self, budget, keep):
+        """
+        gc() with the lock of the index held
+        """
+        index = self._load()
+        reclaimed = 0
+
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if not os.path.isdir(path) or name in index:
+                continue
+            if time.time() - _get_last_modified(path) < UNKNOWN_GRACE:
+                continue
+            logging.info("Deleting unknown workspace %s", name)
+            reclaimed += _get_dir_size(path)
+            shutil.rmtree(path, onerror=handle_read_permission_error)
+
+        total = sum(entry["size"] for entry in index.values())
+        for name, entry in sorted(
+            index.items(), key=lambda item: item[1]["last_used"]
+        ):
+            if total <= budget:
+                break
+            if name in keep:
+                continue
+            logging.info(
+                "Deleting workspace %s (%s %s %s %s, %s)",
+                name,
+                entry["key"]["target"],
+                entry["key"]["toolchain"],
+                entry["key"]["config"],
+                entry["key"]["suite"] or "",
+                _format_size(entry["size"]),
+            )
+            path = os.path.join(self.root, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path, onerror=handle_read_permission_error)
+            total -= entry["size"]
+            reclaimed += entry["size"]
+            del index[name]
+
+        self._save(index)
+        return reclaimed
+
+
+def _get_parser():
+    parser = argparse.ArgumentParser(
+        description="Manage the pool of TF-M build workspaces"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("status", help="List the workspaces")
+
+    gc = subparsers.add_parser(
+        "gc", help="Delete workspaces until the pool fits in a budget"
+    )
+    gc.add_argument(
+        "--budget",
+        help="Disk budget, e.g. 10G, 0 deletes all (default: %s)"
+        % DEFAULT_BUDGET,
+        type=parse_size,
+        default=parse_size(DEFAULT_BUDGET),
+    )
+
+    return parser
+
+
+def _main():
+    """
+    Report or reclaim the space used by the build workspaces
+    """
+    args = _get_parser().parse_args()
+    pool = WorkspacePool()
+
+    if args.command == "status":
+        total = 0
+        for name, entry in pool.status():
+            key = entry["key"]
+            total += entry["size"]
+            print(
+                "%s  %-8s %s  %s %s %s %s %s"
+                % (
+                    name,
+                    _format_size(entry["size"]),
+                    time.strftime(
+                        "%Y-%m-%d %H:%M",
+                        time.localtime(entry["last_used"]),
+                    ),
+                    key["target"],
+                    key["toolchain"],
+                    key["config"],
+                    key["suite"] or "-",
+                    key["profile"] or "-",
+                )
+            )
+        print("Total: %s" % _format_size(total))
+    else:
+        reclaimed = pool.gc(args.budget)
+        logging.info("Reclaimed %s", _format_size(reclaimed))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[Workspace-Pool] %(asctime)s: %(message)s.",
+        datefmt="%H:%M:%S",
+    )
+    _main()